@@ -0,0 +1,140 @@
+import contextvars
+import io
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+from rest_framework.permissions import SAFE_METHODS
+
+logger = logging.getLogger(__name__)
+
+# Заголовки, относящиеся к телу исходного запроса
+SKIPPED_META = (
+    'CONTENT_LENGTH', 'CONTENT_TYPE', 'QUERY_STRING', 'PATH_INFO',
+    'REQUEST_METHOD', 'wsgi.input',
+)
+
+
+def build_subrequest(parent, method, path, body):
+    """Внутренний запрос с аутентификацией исходного запроса."""
+    url = urlsplit(path)
+    request = HttpRequest()
+    request.method = method
+    request.path = request.path_info = url.path
+    request.META = {
+        key: value for key, value in parent.META.items()
+        if key not in SKIPPED_META
+    }
+    request.META.update(
+        REQUEST_METHOD=method, PATH_INFO=url.path, QUERY_STRING=url.query)
+    request.GET = QueryDict(url.query)
+    request.COOKIES = parent.COOKIES
+    payload = b'' if body is None else json.dumps(body).encode()
+    request.META['CONTENT_TYPE'] = 'application/json'
+    request.META['CONTENT_LENGTH'] = str(len(payload))
+    request._stream = io.BytesIO(payload)
+    request._read_started = False
+    # DRF не проверяет JWT повторно и берет пользователя отсюда
+    request._force_auth_user = parent.user
+    request._force_auth_token = parent.auth
+    return request
+
+
+def response_content(response):
+    """Тело ответа; потоковый ответ читается целиком."""
+    if not response.streaming:
+        return response.content
+    try:
+        return b''.join(response.streaming_content)
+    finally:
+        # файлы ответа закрываются без сигнала request_finished из close()
+        for closer in response._resource_closers:
+            closer()
+
+
+def call_view(parent, request, match):
+    """
+    Вызов вьюхи подзапроса. Подзапрос к пути под сбросом нагрузки
+    занимает место в лимите LoadSheddingMiddleware, как обычный запрос.
+    """
+    view = match.func
+    shedder = getattr(parent, 'load_shedder', None)
+    if shedder is not None and shedder.paths_re.match(request.path_info):
+        return shedder.run(view, request, *match.args, **match.kwargs)
+    return view(request, *match.args, **match.kwargs)
+
+
+def dispatch(parent, item):
+    """
+    Выполнение одного подзапроса через резолвер URL. Ошибка подзапроса
+    возвращается как его ответ 500 и не прерывает остальные.
+    """
+    method = item['method']
+    path = item['path']
+    try:
+        match = resolve(urlsplit(path).path)
+    except Resolver404:
+        return {'status': 404, 'body': {'detail': 'Страница не найдена.'}}
+    if match.url_name == 'batch':
+        return {'status': 400, 'body': {
+            'detail': 'Вложенные пакетные запросы запрещены.'}}
+    request = build_subrequest(parent, method, path, item.get('body'))
+    request.resolver_match = match
+    try:
+        response = call_view(parent, request, match)
+        if hasattr(response, 'render'):
+            response.render()
+        content = response_content(response).decode()
+    except Exception:
+        logger.exception('Ошибка подзапроса %s %s', method, path)
+        return {'status': 500, 'body': {
+            'detail': 'Внутренняя ошибка сервера.'}}
+    if content and response.get('Content-Type', '').startswith(
+            'application/json'):
+        content = json.loads(content)
+    return {'status': response.status_code, 'body': content}
+
+
+def dispatch_in_thread(context, parent, item):
+    try:
+        return context.run(dispatch, parent, item)
+    finally:
+        for connection in connections.all():
+            connection.close()
+
+
+def run_batch(parent, items, parallel=False):
+    """
+    Выполнение подзапросов пакета.
+
+    Одинаковые безопасные подзапросы выполняются один раз. Параллельно в
+    пуле потоков выполняются только пакеты из безопасных методов.
+    """
+    keys, unique = [], {}
+    for index, item in enumerate(items):
+        key = (item['method'], item['path'])
+        if item['method'] not in SAFE_METHODS:
+            key, parallel = index, False
+        keys.append(key)
+        unique.setdefault(key, item)
+    if parallel and len(unique) > 1:
+        with ThreadPoolExecutor(settings.BATCH_MAX_WORKERS) as executor:
+            futures = {
+                key: executor.submit(
+                    dispatch_in_thread, contextvars.copy_context(),
+                    parent, item)
+                for key, item in unique.items()
+            }
+        results = {key: future.result() for key, future in futures.items()}
+    else:
+        results = {
+            key: dispatch(parent, item) for key, item in unique.items()}
+    return [
+        dict(results[key], path=item['path'])
+        for key, item in zip(keys, items)
+    ]
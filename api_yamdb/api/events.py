@@ -0,0 +1,297 @@
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import lru_cache
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+from reviews.models import Title
+
+EVENTS_PATH_RE = re.compile(r'^/api/v1/titles/(?P<title_id>\d+)/events/$')
+
+# Признак переполнения очереди медленного клиента: поток закрывается,
+# клиент переподключается с Last-Event-ID и дочитывает из буфера
+OVERFLOW = object()
+
+
+def deliver(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(OVERFLOW)
+
+
+class MemoryBroker:
+    """
+    Брокер событий внутри процесса. Хранит последние EVENTS_BACKLOG_SIZE
+    событий каждого произведения для продолжения с Last-Event-ID.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_id = 0
+        self.backlogs = OrderedDict()
+        self.subscribers = {}
+        # произведение -> время ухода последнего подписчика
+        self.left = {}
+
+    def has_subscribers(self, title_id):
+        """Подписчики есть или недавно были и могут переподключиться."""
+        with self.lock:
+            if self.subscribers.get(title_id):
+                return True
+            left = self.left.get(title_id)
+        return left is not None and (
+            time.monotonic() - left < settings.EVENTS_SUBSCRIBER_TTL)
+
+    def publish(self, title_id, event_type, data):
+        with self.lock:
+            self.last_id += 1
+            event = {'id': self.last_id, 'type': event_type, 'data': data}
+            backlog = self.backlogs.pop(title_id, None) or deque(
+                maxlen=settings.EVENTS_BACKLOG_SIZE)
+            backlog.append(event)
+            self.backlogs[title_id] = backlog
+            if len(self.backlogs) > settings.EVENTS_MAX_TITLES:
+                self.backlogs.popitem(last=False)
+            subscribers = list(self.subscribers.get(title_id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(deliver, queue, event)
+        return event
+
+    async def listen(self, title_id, last_event_id=None):
+        subscriber = (
+            asyncio.get_running_loop(),
+            asyncio.Queue(maxsize=settings.EVENTS_BACKLOG_SIZE)
+        )
+        with self.lock:
+            if last_event_id is not None and last_event_id > self.last_id:
+                # номера событий начались заново после перезапуска
+                last_event_id = 0
+            missed = [
+                event for event in self.backlogs.get(title_id, ())
+                if last_event_id is not None and event['id'] > last_event_id
+            ]
+            self.subscribers.setdefault(title_id, set()).add(subscriber)
+        try:
+            for event in missed:
+                yield event
+            while True:
+                event = await subscriber[1].get()
+                if event is OVERFLOW:
+                    return
+                yield event
+        finally:
+            with self.lock:
+                subscribers = self.subscribers.get(title_id, set())
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    self.subscribers.pop(title_id, None)
+                    self.left[title_id] = time.monotonic()
+
+
+class CacheBroker:
+    """
+    Брокер событий через общий кэш EVENTS_CACHE_ALIAS (Redis, Memcached)
+    для нескольких процессов. Подписчики опрашивают номер последнего
+    события произведения раз в EVENTS_POLL_INTERVAL секунд.
+    """
+    def __init__(self):
+        self.cache = caches[settings.EVENTS_CACHE_ALIAS]
+
+    def key(self, title_id, suffix):
+        return 'events:{}:{}'.format(title_id, suffix)
+
+    def has_subscribers(self, title_id):
+        """Отметку подписчика обновляют опросы его потока."""
+        return self.cache.get(self.key(title_id, 'watched')) is not None
+
+    def publish(self, title_id, event_type, data):
+        last_key = self.key(title_id, 'last')
+        self.cache.add(last_key, 0, None)
+        event_id = self.cache.incr(last_key)
+        event = {'id': event_id, 'type': event_type, 'data': data}
+        self.cache.set(
+            self.key(title_id, event_id), event,
+            settings.EVENTS_CACHE_TIMEOUT
+        )
+        return event
+
+    async def listen(self, title_id, last_event_id=None):
+        get = sync_to_async(self.cache.get, thread_sensitive=False)
+        get_many = sync_to_async(self.cache.get_many, thread_sensitive=False)
+        watch = sync_to_async(self.cache.set, thread_sensitive=False)
+        watched_key = self.key(title_id, 'watched')
+        last_key = self.key(title_id, 'last')
+        await watch(watched_key, True, settings.EVENTS_SUBSCRIBER_TTL)
+        watched = time.monotonic()
+        current = await get(last_key, 0)
+        if last_event_id is None or last_event_id > current:
+            last_event_id = current
+        last_event_id = max(
+            last_event_id, current - settings.EVENTS_BACKLOG_SIZE)
+        while True:
+            if (time.monotonic() - watched
+                    > settings.EVENTS_SUBSCRIBER_TTL / 2):
+                await watch(
+                    watched_key, True, settings.EVENTS_SUBSCRIBER_TTL)
+                watched = time.monotonic()
+            current = await get(last_key, 0)
+            if current <= last_event_id:
+                await asyncio.sleep(settings.EVENTS_POLL_INTERVAL)
+                continue
+            keys = [
+                self.key(title_id, event_id)
+                for event_id in range(last_event_id + 1, current + 1)
+            ]
+            events = await get_many(keys)
+            for key in keys:
+                if key in events:
+                    yield events[key]
+            last_event_id = current
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    return import_string(settings.EVENTS_BROKER)()
+
+
+def publish(title_id, event_type, data):
+    return get_broker().publish(title_id, event_type, data)
+
+
+def has_subscribers(title_id):
+    """
+    Есть ли кому отправлять события произведения. Подписчик считается
+    еще EVENTS_SUBSCRIBER_TTL секунд после отключения: переподключившись
+    с Last-Event-ID, он дочитает пропущенное.
+    """
+    return get_broker().has_subscribers(title_id)
+
+
+def format_event(event):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+        event['id'], event['type'],
+        json.dumps(event['data'], ensure_ascii=False)
+    ).encode()
+
+
+def get_last_event_id(scope):
+    """Last-Event-ID из заголовка или параметра last_event_id."""
+    values = [
+        value.decode('latin-1') for name, value in scope['headers']
+        if name == b'last-event-id'
+    ]
+    values += parse_qs(
+        scope.get('query_string', b'').decode('latin-1')
+    ).get('last_event_id', [])
+    for value in values:
+        if value.isdigit():
+            return int(value)
+    return None
+
+
+def title_exists(title_id):
+    close_old_connections()
+    try:
+        return Title.objects.filter(pk=title_id).exists()
+    finally:
+        close_old_connections()
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+class EventStreamApplication:
+    """
+    ASGI-приложение: поток server-sent events с новыми отзывами и
+    комментариями произведения по адресу /api/v1/titles/{id}/events/.
+    Соединение обслуживается корутиной, без отдельного потока на клиента.
+    Остальные запросы передаются приложению Django.
+    """
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        match = None
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            match = EVENTS_PATH_RE.match(scope['path'])
+        if match is None:
+            await self.application(scope, receive, send)
+            return
+        title_id = int(match.group('title_id'))
+        if not await sync_to_async(title_exists)(title_id):
+            await self.respond(send, 404, {'detail': 'Страница не найдена.'})
+            return
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': 'retry: {}\n\n'.format(settings.EVENTS_RETRY).encode(),
+            'more_body': True,
+        })
+        await self.stream(
+            send, receive, get_broker().listen(
+                title_id, get_last_event_id(scope)))
+
+    async def stream(self, send, receive, events):
+        disconnect = asyncio.ensure_future(wait_disconnect(receive))
+        next_event = asyncio.ensure_future(events.__anext__())
+        try:
+            while True:
+                done, _ = await asyncio.wait(
+                    {disconnect, next_event},
+                    timeout=settings.EVENTS_HEARTBEAT,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if disconnect in done:
+                    return
+                if next_event not in done:
+                    body = b': ping\n\n'
+                else:
+                    try:
+                        body = format_event(next_event.result())
+                    except StopAsyncIteration:
+                        break
+                    next_event = asyncio.ensure_future(events.__anext__())
+                await send({
+                    'type': 'http.response.body',
+                    'body': body,
+                    'more_body': True,
+                })
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            for task in (disconnect, next_event):
+                task.cancel()
+            await asyncio.gather(disconnect, next_event,
+                                 return_exceptions=True)
+            await events.aclose()
+
+    async def respond(self, send, status, data):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json')],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': json.dumps(data, ensure_ascii=False).encode(),
+        })
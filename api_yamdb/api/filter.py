@@ -1,17 +1,28 @@
 from django_filters import rest_framework as filters
 
-from reviews.models import Title
+from reviews.lookups import get_lookups
+from reviews.models import GenreTitle, Title
 
 
 class TitleFilter(filters.FilterSet):
-    """Фильтр для TitleViewSet."""
-    genre = filters.CharFilter(
-        field_name='genre__slug', lookup_expr='icontains')
-    category = filters.CharFilter(
-        field_name='category__slug', lookup_expr='icontains')
+    """
+    Фильтр для TitleViewSet. Жанры и категории по части slug ищутся
+    в кэше справочников, без соединения с их таблицами.
+    """
+    genre = filters.CharFilter(method='filter_genre')
+    category = filters.CharFilter(method='filter_category')
     name = filters.CharFilter(field_name='name', lookup_expr='icontains')
     year = filters.NumberFilter(field_name='year', lookup_expr='icontains')
 
     class Meta:
         model = Title
         fields = ('name', 'year', 'category', 'genre')
+
+    def filter_genre(self, queryset, name, value):
+        return queryset.filter(pk__in=GenreTitle.objects.filter(
+            genre_id__in=get_lookups().genres.matching(value)
+        ).values('title_id'))
+
+    def filter_category(self, queryset, name, value):
+        return queryset.filter(
+            category_id__in=get_lookups().categories.matching(value))
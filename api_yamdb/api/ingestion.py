@@ -0,0 +1,310 @@
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from api.events import has_subscribers, publish
+from reviews.models import Comment, Review, YaMdbUser
+from reviews.sharding import is_moving, shard_for
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = 'comments-'
+SEGMENT_SUFFIX = '.jsonl'
+# Записи очереди, которые нельзя записать: отзыв или автор удалены
+REJECTED_NAME = 'rejected.jsonl'
+
+
+def increment(model, counts, using=None):
+    """Увеличение счетчиков одним UPDATE на объект."""
+    for pk, total in counts.items():
+        model._base_manager.db_manager(using).filter(pk=pk).update(
+            comments_count=F('comments_count') + total)
+
+
+def write_comments(entries):
+    """
+    Запись комментариев из очереди, одна транзакция на шард. Уже
+    записанные ingest_id пропускаются, поэтому повторное проигрывание
+    журнала не создает дублей.
+    """
+    shards = defaultdict(list)
+    for entry in entries:
+        if is_moving(entry['title_id']):
+            # журнал будет проигран после переноса
+            raise RuntimeError(
+                'Произведение {} переносится'.format(entry['title_id']))
+        shards[shard_for(entry['title_id'])].append(entry)
+    return sum(
+        write_shard(alias, shard_entries)
+        for alias, shard_entries in shards.items()
+    )
+
+
+def existing_values(queryset, field, values):
+    """Значения field из values, которые есть в queryset, пачками."""
+    size = settings.COMMENT_INGESTION_BATCH_SIZE
+    values = list(values)
+    existing = set()
+    for start in range(0, len(values), size):
+        existing.update(str(value) for value in queryset.filter(**{
+            f'{field}__in': values[start:start + size]
+        }).values_list(field, flat=True))
+    return existing
+
+
+def quarantine(entries):
+    """Отложенные в сторону записи: их не проигрывает ни один процесс."""
+    logger.warning(
+        'Комментарии из очереди отброшены, отзыв или автор удалены: %s',
+        ', '.join(entry['ingest_id'] for entry in entries))
+    path = os.path.join(settings.COMMENT_INGESTION_JOURNAL_DIR, REJECTED_NAME)
+    with open(path, 'a') as rejected:
+        for entry in entries:
+            rejected.write(json.dumps(entry) + '\n')
+
+
+def write_shard(alias, entries):
+    size = settings.COMMENT_INGESTION_BATCH_SIZE
+    with transaction.atomic(using=alias), transaction.atomic():
+        existing = existing_values(
+            Comment.objects.using(alias), 'ingest_id',
+            (entry['ingest_id'] for entry in entries))
+        unique = []
+        for entry in entries:
+            if entry['ingest_id'] not in existing:
+                existing.add(entry['ingest_id'])
+                unique.append(entry)
+        # отзыв могли удалить, пока комментарий ждал в очереди: одна
+        # такая запись не должна останавливать запись всей пачки
+        reviews = existing_values(
+            Review._base_manager.using(alias), 'pk',
+            {entry['review'] for entry in unique})
+        authors = existing_values(
+            YaMdbUser._base_manager.all(), 'pk',
+            {entry['author_id'] for entry in unique})
+        entries, rejected = [], []
+        for entry in unique:
+            if (str(entry['review']) in reviews
+                    and str(entry['author_id']) in authors):
+                entries.append(entry)
+            else:
+                rejected.append(entry)
+        if rejected:
+            transaction.on_commit(lambda: quarantine(rejected), using=alias)
+        comments = Comment.objects.using(alias).bulk_create(
+            (
+                Comment(
+                    ingest_id=entry['ingest_id'],
+                    review_id=entry['review'],
+                    author_id=entry['author_id'],
+                    text=entry['text'],
+                )
+                for entry in entries
+            ),
+            batch_size=size
+        )
+        increment(
+            Review, Counter(entry['review'] for entry in entries), alias)
+        increment(YaMdbUser, Counter(entry['author_id'] for entry in entries))
+        events = [
+            (entry['title_id'], dict(
+                public_data(entry), id=comment.pk,
+                pub_date=comment.pub_date.isoformat()))
+            for entry, comment in zip(entries, comments)
+        ]
+        transaction.on_commit(lambda: publish_events(events), using=alias)
+    return len(comments)
+
+
+def publish_events(events):
+    for title_id, data in events:
+        if has_subscribers(title_id):
+            publish(title_id, 'comment', data)
+
+
+def read_segment(segment):
+    entries = []
+    for line in segment:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            # запись, оборванная при падении процесса
+            continue
+    return entries
+
+
+def public_data(entry):
+    """Комментарий из очереди в виде ответа API."""
+    return {
+        'provisional_id': entry['ingest_id'],
+        'author': entry['author'],
+        'review': entry['review'],
+        'text': entry['text'],
+        'pub_date': entry['pub_date'],
+    }
+
+
+class CommentIngestion:
+    """
+    Очередь отложенной записи комментариев.
+
+    Комментарий дописывается в журнал процесса и в очередь, фоновый
+    поток раз в COMMENT_INGESTION_FLUSH_INTERVAL секунд записывает всю
+    очередь через bulk_create. Сегмент журнала удаляется после commit.
+    Процесс держит блокировку flock на своих сегментах; сегменты без
+    блокировки остались от упавших процессов и проигрываются заново.
+    Комментарии к удаленным за это время отзывам откладываются в
+    REJECTED_NAME и не мешают записи остальных.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pending = []
+        self.flushing = []
+        self.sequence = 0
+        self.segment = None
+        self.thread = None
+        self.replay_needed = True
+
+    def open_segment(self):
+        """Новый сегмент журнала; под своим именем он уже заблокирован."""
+        os.makedirs(settings.COMMENT_INGESTION_JOURNAL_DIR, exist_ok=True)
+        self.sequence += 1
+        path = os.path.join(
+            settings.COMMENT_INGESTION_JOURNAL_DIR,
+            '{}{}-{}{}'.format(
+                SEGMENT_PREFIX, os.getpid(), self.sequence, SEGMENT_SUFFIX)
+        )
+        segment = open(path + '.tmp', 'a')
+        fcntl.flock(segment, fcntl.LOCK_EX)
+        os.rename(path + '.tmp', path)
+        segment.path = path
+        return segment
+
+    def start(self):
+        self.segment = self.open_segment()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def enqueue(self, author, review, text):
+        """Постановка проверенного комментария в очередь."""
+        entry = {
+            'ingest_id': str(uuid.uuid4()),
+            'author_id': author.pk,
+            'author': author.username,
+            'review': review.pk,
+            'title_id': review.title_id,
+            'text': text,
+            'pub_date': timezone.now().isoformat(),
+        }
+        with self.lock:
+            if self.thread is None:
+                self.start()
+            self.segment.write(json.dumps(entry) + '\n')
+            self.segment.flush()
+            self.pending.append(entry)
+            if len(self.pending) >= settings.COMMENT_INGESTION_BATCH_SIZE:
+                self.wakeup.set()
+        return public_data(entry)
+
+    def pending_for(self, author_id, review_id):
+        """Еще не записанные комментарии автора к отзыву, новые первыми."""
+        with self.lock:
+            entries = self.flushing + self.pending
+        return [
+            public_data(entry) for entry in reversed(entries)
+            if entry['author_id'] == author_id and entry['review'] == review_id
+        ]
+
+    def close(self):
+        """Запись очереди при остановке процесса и удаление пустого журнала."""
+        self.flush()
+        with self.lock:
+            if not self.pending:
+                os.remove(self.segment.path)
+                self.segment.close()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(settings.COMMENT_INGESTION_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            close_old_connections()
+            if self.replay_needed:
+                self.replay_orphans()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return 0
+            entries, self.pending = self.pending, []
+            segment, self.segment = self.segment, self.open_segment()
+            self.flushing = entries
+        try:
+            written = write_comments(entries)
+        except Exception:
+            # сегмент остается на диске и будет проигран повторно
+            logger.exception('Не удалось записать комментарии из очереди')
+            self.replay_needed = True
+            written = 0
+        else:
+            os.remove(segment.path)
+        finally:
+            segment.close()
+            with self.lock:
+                self.flushing = []
+        return written
+
+    def replay_orphans(self):
+        """Проигрывание сегментов журнала, не заблокированных процессами."""
+        self.replay_needed = False
+        try:
+            names = os.listdir(settings.COMMENT_INGESTION_JOURNAL_DIR)
+        except FileNotFoundError:
+            return 0
+        written = 0
+        for name in sorted(names):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(
+                    SEGMENT_SUFFIX):
+                written += self.replay_segment(os.path.join(
+                    settings.COMMENT_INGESTION_JOURNAL_DIR, name))
+        return written
+
+    def replay_segment(self, path):
+        try:
+            segment = open(path)
+        except FileNotFoundError:
+            return 0
+        with segment:
+            try:
+                fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # сегмент живого процесса
+                return 0
+            if not os.path.exists(path):
+                return 0
+            try:
+                written = write_comments(read_segment(segment))
+            except Exception:
+                logger.exception('Не удалось проиграть журнал %s', path)
+                self.replay_needed = True
+                return 0
+            os.remove(path)
+        return written
+
+
+@lru_cache(maxsize=None)
+def get_ingestion():
+    return CommentIngestion()
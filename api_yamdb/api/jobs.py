@@ -0,0 +1,16 @@
+from django.conf import settings
+
+from api.warmup import hottest_titles, page_paths, warm_pages, warm_up
+from reviews.scheduler import job
+
+
+@job(None)
+def warm_up_pages():
+    """
+    Прогрев после выкладки, пока nginx остановлен: справочники и
+    страницы самых обсуждаемых произведений.
+    """
+    warm_up()
+    warm_pages(
+        page_paths(hottest_titles(settings.WARMUP_TITLES)),
+        settings.WARMUP_BASE_URL)
@@ -0,0 +1,127 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import QuerySet
+from django.db.models.fields.related_descriptors import (
+    ForwardManyToOneDescriptor
+)
+
+
+class BatchLoader:
+    """
+    Объекты по внешним ключам, загруженные за время одного запроса:
+    каждый объект читается из базы не больше одного раза.
+    """
+    def __init__(self):
+        # (модель, база, поле ключа) -> {значение ключа: объект}
+        self.loaded = defaultdict(dict)
+
+    def load(self, relation, alias, keys):
+        """Объекты связи relation по ключам одним IN-запросом на пачку."""
+        model = relation.remote_field.model
+        key_name = relation.target_field.attname
+        loaded = self.loaded[model, alias, key_name]
+        missing = list({key for key in keys if key not in loaded})
+        size = settings.BATCH_LOADER_MAX_KEYS
+        for start in range(0, len(missing), size):
+            for obj in model._base_manager.using(alias).filter(**{
+                f'{key_name}__in': missing[start:start + size]
+            }):
+                loaded[getattr(obj, key_name)] = obj
+        return loaded
+
+
+def get_loader(context):
+    """Загрузчик текущего запроса; без запроса в контексте - новый."""
+    request = context.get('request')
+    if request is None:
+        return BatchLoader()
+    request = getattr(request, '_request', request)
+    if not hasattr(request, 'batch_loader'):
+        request.batch_loader = BatchLoader()
+    return request.batch_loader
+
+
+def page_of(field, instance):
+    """
+    Объекты, которые сериализует родительский список вместе с instance.
+    QuerySet к этому моменту уже прочитан списком целиком.
+    """
+    parent = field.parent
+    page = getattr(getattr(parent, 'parent', None), 'instance', None)
+    if isinstance(page, QuerySet):
+        page = page._result_cache
+    if isinstance(page, (list, tuple)) and any(
+            item is instance for item in page):
+        return page
+    return [instance]
+
+
+def is_primed(instance, source_attrs):
+    """Вся цепочка связей объекта уже в кэше."""
+    for attr in source_attrs:
+        descriptor = getattr(type(instance), attr, None)
+        if not isinstance(descriptor, ForwardManyToOneDescriptor):
+            return True
+        relation = descriptor.field
+        if getattr(instance, relation.attname) is None:
+            return True
+        if not relation.is_cached(instance):
+            return False
+        instance = relation.get_cached_value(instance)
+        if instance is None:
+            return True
+    return True
+
+
+def prime(loader, objects, source_attrs):
+    """
+    Заполнение кэша связей по цепочке source_attrs ('review', 'title'):
+    на каждом шаге недостающие объекты загружаются по базам, которые
+    выбирают роутеры, как при обычном обращении к связи.
+    """
+    for attr in source_attrs:
+        descriptor = getattr(type(objects[0]), attr, None)
+        if not isinstance(descriptor, ForwardManyToOneDescriptor):
+            return
+        relation = descriptor.field
+        pending = defaultdict(list)
+        for obj in objects:
+            if (not relation.is_cached(obj)
+                    and getattr(obj, relation.attname) is not None):
+                alias = relation.remote_field.model._base_manager.db_manager(
+                    hints={'instance': obj}).db
+                pending[alias].append(obj)
+        for alias, group in pending.items():
+            loaded = loader.load(relation, alias, [
+                getattr(obj, relation.attname) for obj in group])
+            for obj in group:
+                related = loaded.get(getattr(obj, relation.attname))
+                # ненайденный объект остается обычной ленивой связи
+                if related is not None:
+                    relation.set_cached_value(obj, related)
+        objects = [
+            relation.get_cached_value(obj) for obj in objects
+            if relation.is_cached(obj)
+            and relation.get_cached_value(obj) is not None
+        ]
+        if not objects:
+            return
+
+
+class BatchLoadMixin:
+    """
+    Примесь к полю сериализатора со связанным объектом (source 'author'
+    или цепочка 'review.title'). При первом обращении ключи собираются
+    со всей страницы родительского списка и загружаются одним
+    IN-запросом через загрузчик запроса; дальше значение поля берется
+    из кэша связи без запросов.
+    """
+    def get_attribute(self, instance):
+        pk_only = getattr(self, 'use_pk_only_optimization', lambda: False)
+        if not (pk_only() and len(self.source_attrs) == 1
+                or is_primed(instance, self.source_attrs)):
+            prime(
+                get_loader(self.context), page_of(self, instance),
+                self.source_attrs)
+        return super().get_attribute(instance)
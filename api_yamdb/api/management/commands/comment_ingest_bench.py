@@ -0,0 +1,79 @@
+import threading
+import time
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.views import CommentViewSet
+from reviews.deletion import delete_rows
+from reviews.models import Comment, Review
+
+
+class Command(BaseCommand):
+    """
+    Пропускная способность записи комментариев через API: обычная запись
+    и отложенная через очередь. Для очереди время считается до появления
+    всех строк в базе. Созданные комментарии затем удаляются.
+    """
+    help = 'Бенчмарк записи комментариев с очередью отложенной записи и без.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--comments', type=int, default=1000)
+        parser.add_argument('--clients', type=int, default=4)
+        parser.add_argument('--timeout', type=float, default=60)
+
+    def post_comments(self, path, token, count):
+        client = Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+        for number in range(count):
+            response = client.post(
+                path, {'text': f'Комментарий {number}'},
+                content_type='application/json'
+            )
+            if response.status_code not in (201, 202):
+                raise CommandError(
+                    f'Ответ {response.status_code}: {response.content!r}')
+
+    def run(self, review, options):
+        token = AccessToken.for_user(review.author)
+        path = '/api/v1/titles/{}/reviews/{}/comments/'.format(
+            review.title_id, review.pk)
+        last_pk = Comment.objects.order_by('-pk').values_list(
+            'pk', flat=True).first() or 0
+        per_client = options['comments'] // options['clients']
+        total = per_client * options['clients']
+        threads = [
+            threading.Thread(
+                target=self.post_comments, args=(path, token, per_client))
+            for _ in range(options['clients'])
+        ]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        accepted = time.monotonic() - started
+        created = Comment.objects.filter(pk__gt=last_pk)
+        deadline = time.monotonic() + options['timeout']
+        while created.count() < total and time.monotonic() < deadline:
+            time.sleep(0.01)
+        stored = time.monotonic() - started
+        written = created.count()
+        delete_rows(Comment._base_manager.filter(pk__gt=last_pk))
+        return total, accepted, stored, written
+
+    def handle(self, *args, **options):
+        review = Review.objects.select_related('author').first()
+        if review is None:
+            raise CommandError('Нужен хотя бы один отзыв.')
+        self.stdout.write('{:<10}{:>10}{:>14}{:>14}{:>10}'.format(
+            'ingestion', 'comments', 'accepted/s', 'stored/s', 'rows'))
+        for ingestion in (False, True):
+            throttles = mock.patch.object(
+                CommentViewSet, 'throttle_classes', ())
+            with override_settings(COMMENT_INGESTION=ingestion), throttles:
+                total, accepted, stored, written = self.run(review, options)
+            self.stdout.write('{:<10}{:>10}{:>14.0f}{:>14.0f}{:>10}'.format(
+                'on' if ingestion else 'off', total,
+                total / accepted, total / stored, written))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+
+class Command(BaseCommand):
+    """Замер размера ответа и процессорного времени на запрос."""
+    help = 'Бенчмарк сжатия ответов: байты на запрос и CPU на запрос.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/v1/titles/')
+        parser.add_argument('--requests', type=int, default=200)
+
+    def measure(self, client, path, encoding, count):
+        headers = {'HTTP_ACCEPT_ENCODING': encoding} if encoding else {}
+        size = 0
+        started = time.process_time()
+        for _ in range(count):
+            response = client.get(path, **headers)
+            size = len(response.content)
+        cpu = (time.process_time() - started) / count
+        return size, cpu * 1000
+
+    def handle(self, *args, **options):
+        path = options['path']
+        count = options['requests']
+        client = Client()
+        self.stdout.write(
+            '{:<10}{:<8}{:>12}{:>14}'.format(
+                'encoding', 'cache', 'bytes', 'cpu ms/req'))
+        for encoding in ('', 'gzip', 'br'):
+            with override_settings(CATALOG_CACHE_TIMEOUT=0):
+                size, cpu = self.measure(client, path, encoding, count)
+            self.stdout.write('{:<10}{:<8}{:>12}{:>14.3f}'.format(
+                encoding or 'identity', 'off', size, cpu))
+            cache.clear()
+            size, cpu = self.measure(client, path, encoding, count)
+            self.stdout.write('{:<10}{:<8}{:>12}{:>14.3f}'.format(
+                encoding or 'identity', 'on', size, cpu))
@@ -0,0 +1,33 @@
+import resource
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reviews import similarity
+
+
+class Command(BaseCommand):
+    """Пакетный расчет похожих произведений по оценкам пользователей."""
+    help = (
+        'Сходство произведений (косинус оценок, центрированных по средней '
+        'оценке произведения), top-K соседей в таблицу SimilarTitle.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать все произведения, а не только измененные.')
+
+    def show_progress(self, done, total):
+        self.stdout.write(f'Пересчитано {done} из {total}')
+
+    def handle(self, *args, **options):
+        if similarity.np is None:
+            raise CommandError('Для расчета нужны пакеты numpy и scipy.')
+        started = time.monotonic()
+        count = similarity.compute(options['full'], self.show_progress)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.stdout.write(
+            f'Готово: {count} произведений за '
+            f'{time.monotonic() - started:.1f} с, '
+            f'пик памяти {peak // 1024} МБ')
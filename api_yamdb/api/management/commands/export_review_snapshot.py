@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from reviews import analytics
+
+
+class Command(BaseCommand):
+    """Выгрузка отзывов в столбцовый снимок для /api/v1/analytics/."""
+    help = (
+        'Дописывает в снимок ANALYTICS_ROOT отзывы новее последнего '
+        'выгруженного и заново выгружает произведения и жанры.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Выгрузить все отзывы заново, с учетом правок и удалений.')
+        parser.add_argument('--root', default=settings.ANALYTICS_ROOT)
+
+    def handle(self, *args, **options):
+        if analytics.np is None:
+            raise CommandError('Для снимка нужен пакет numpy.')
+        started = time.monotonic()
+        meta, appended = analytics.export(
+            options['root'], options['full'], settings.ANALYTICS_CHUNK_SIZE)
+        self.stdout.write(
+            'Добавлено отзывов: {}, всего {}, произведений {}, '
+            'связей с жанрами {} за {:.1f} с'.format(
+                appended, meta['rows']['reviews'], meta['rows']['titles'],
+                meta['rows']['genre_titles'], time.monotonic() - started))
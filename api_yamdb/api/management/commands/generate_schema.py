@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api.schema import CONTENT_TYPES, write_schema
+
+
+class Command(BaseCommand):
+    """Генерация схемы OpenAPI при сборке образа."""
+    help = 'Сохраняет swagger.json/yaml и их сжатые варианты в SCHEMA_ROOT.'
+
+    def handle(self, *args, **options):
+        for schema_format in CONTENT_TYPES:
+            path = write_schema(schema_format)
+            self.stdout.write(f'Схема сохранена: {path}')
@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Импорты, которые выполняет воркер gunicorn до первого запроса
+STARTUP_CODE = (
+    'import api_yamdb.wsgi; '
+    'from api.warmup import import_views; import_views()'
+)
+
+
+class Command(BaseCommand):
+    """Разбор вывода python -X importtime для старта приложения."""
+    help = 'Отчет о времени импорта модулей при старте воркера.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20)
+
+    def collect(self):
+        """Время импорта в микросекундах: (модуль, собственное, общее)."""
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_CODE],
+            cwd=settings.BASE_DIR,
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE='api_yamdb.settings'),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        )
+        rows = []
+        for line in process.stderr.splitlines():
+            if not line.startswith('import time:'):
+                continue
+            fields = line[len('import time:'):].split('|')
+            try:
+                own, total = int(fields[0]), int(fields[1])
+            except ValueError:
+                # строка заголовка
+                continue
+            rows.append((fields[2].strip(), own, total))
+        return rows
+
+    def handle(self, *args, **options):
+        top = options['top']
+        rows = self.collect()
+        packages = defaultdict(int)
+        for module, own, total in rows:
+            packages[module.split('.')[0]] += own
+        self.stdout.write('Всего: {:.1f} мс, модулей: {}'.format(
+            sum(own for _, own, _ in rows) / 1000, len(rows)))
+        self.stdout.write('\nПакеты по собственному времени импорта, мс:')
+        for package, own in sorted(
+                packages.items(), key=lambda item: -item[1])[:top]:
+            self.stdout.write('{:<40}{:>10.1f}'.format(package, own / 1000))
+        self.stdout.write('\nМодули по общему времени импорта, мс:')
+        for module, own, total in sorted(
+                rows, key=lambda row: -row[2])[:top]:
+            self.stdout.write('{:<40}{:>10.1f}{:>10.1f}'.format(
+                module, own / 1000, total / 1000))
@@ -0,0 +1,411 @@
+import contextlib
+import re
+import time
+from collections import defaultdict
+from unittest import mock
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, migrations, models, transaction
+from django.db.migrations.autodetector import MigrationAutodetector
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.writer import MigrationWriter
+from django.test import Client, override_settings
+from rest_framework.views import APIView
+
+from api.management.commands.slow_query_report import read_entries
+from api.slow_queries import explaining, normalize
+from api.warmup import hottest_titles, page_paths
+from reviews import sharding
+from reviews.lookups import get_lookups
+from reviews.models import Review, YaMdbUser
+
+APP_LABEL = 'reviews'
+TRIAL_INDEX = 'index_audit_trial'
+
+# Столбец "таблица"."столбец" или T3."столбец" с псевдонимом таблицы:
+# T - повторное соединение, U - подзапрос
+COLUMN = r'(?:"(\w+)"|\b([TU]\d+))\."(\w+)"'
+TABLE_RE = re.compile(r'(?:FROM|JOIN) "(\w+)"(?: ([TU]\d+)\b)?')
+EQUALITY_RE = re.compile(COLUMN + r' (?:= |IN \(|IS NULL)')
+JOINED_RE = re.compile(r'= ' + COLUMN)
+RANGE_RE = re.compile(COLUMN + r' (?:[<>]|BETWEEN )')
+ORDER_RE = re.compile(COLUMN + r'(?: (ASC|DESC))?')
+ORDER_BY_RE = re.compile(r' ORDER BY (.*?)(?: LIMIT | OFFSET |\)|$)')
+
+
+def hot_paths(limit):
+    """Страницы API, которые чаще всего читают клиенты."""
+    title_ids = hottest_titles(limit)
+    paths = page_paths(title_ids)
+    lookups = get_lookups()
+    paths += [f'/api/v1/titles/?genre={slug}'
+              for slug in list(lookups.genres.by_slug)[:3]]
+    paths += [f'/api/v1/titles/?category={slug}'
+              for slug in list(lookups.categories.by_slug)[:3]]
+    for title_id in title_ids:
+        base = f'/api/v1/titles/{title_id}'
+        paths += [f'{base}/stats/', f'{base}/similar/',
+                  f'{base}/reviews/?ordering=-score']
+        review_ids = Review.objects.using(
+            sharding.shard_for(title_id)).filter(
+                title_id=title_id).values_list('pk', flat=True)[:2]
+        paths += [f'{base}/reviews/{review_id}/comments/'
+                  for review_id in review_ids]
+    for username in YaMdbUser.objects.order_by(
+            '-reviews_count').values_list('username', flat=True)[:limit]:
+        paths += [f'/api/v1/users/{username}/reviews/',
+                  f'/api/v1/users/{username}/comments/']
+    return paths
+
+
+class QueryRecorder:
+    """Обертка execute_wrapper, запоминающая SELECT-запросы."""
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if (not many and not explaining.get()
+                and sql.lstrip()[:6].upper() in ('SELECT', 'WITH')):
+            self.queries.append({
+                'alias': context['connection'].alias,
+                'sql': sql,
+                'params': params,
+            })
+        return execute(sql, params, many, context)
+
+
+def replay(paths):
+    """
+    GET страниц в этом процессе с записью SELECT-запросов. Кэш каталога
+    и ограничения частоты отключены: запросы доходят до базы.
+    """
+    recorder = QueryRecorder()
+    client = Client()
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(override_settings(CATALOG_CACHE_TIMEOUT=0))
+        stack.enter_context(
+            mock.patch.object(APIView, 'get_throttles', return_value=()))
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        for path in paths:
+            client.get(path)
+    return recorder.queries
+
+
+def read_workload(path):
+    """Запросы журнала медленных запросов, записанные с параметрами."""
+    return [
+        {'alias': entry['alias'], 'sql': entry['sql'],
+         'params': entry['params']}
+        for entry in read_entries(path) if entry.get('params') is not None
+    ]
+
+
+def group_shapes(workload):
+    """Формы запросов к таблицам проекта: число выполнений и пример."""
+    tables = project_tables()
+    shapes = {}
+    for query in workload:
+        if not {table for table, _ in TABLE_RE.findall(query['sql'])} & tables:
+            continue
+        shape = shapes.setdefault(normalize(query['sql']), dict(
+            query, count=0, plan=None))
+        shape['count'] += 1
+    return list(shapes.values())
+
+
+def project_tables():
+    return {
+        model._meta.db_table
+        for model in apps.get_app_config(APP_LABEL).get_models()
+    }
+
+
+def columns_by_table(sql, regex, aliases):
+    found = defaultdict(list)
+    for match in regex.finditer(sql):
+        table, alias, column = match.group(1, 2, 3)
+        table = aliases.get(alias, table)
+        if column not in found[table]:
+            found[table].append(column)
+    return found
+
+
+def candidates(sql):
+    """
+    Индексы, полезные запросу: по каждой таблице столбцы сравнений на
+    равенство, затем столбцы сортировки этой таблицы или первый
+    столбец сравнения на диапазон. Столбец id не учитывается.
+    """
+    aliases = {alias: table for table, alias in TABLE_RE.findall(sql)}
+    equal = columns_by_table(sql, EQUALITY_RE, aliases)
+    for table, columns in columns_by_table(sql, JOINED_RE, aliases).items():
+        equal[table] += [column for column in columns
+                         if column not in equal[table]]
+    ranges = columns_by_table(sql, RANGE_RE, aliases)
+    ordering = []
+    # последняя сортировка - внешнего запроса, а не подзапроса
+    clauses = ORDER_BY_RE.findall(sql)
+    if clauses:
+        for item in ORDER_RE.finditer(clauses[-1]):
+            table, alias, column, direction = item.group(1, 2, 3, 4)
+            ordering.append(
+                (aliases.get(alias, table), column, direction == 'DESC'))
+    order_tables = {table for table, _, _ in ordering}
+    found = []
+    for table in set(equal) | set(ranges) | order_tables:
+        columns = [(column, False) for column in equal[table]
+                   if column != 'id']
+        if order_tables == {table}:
+            columns += [(column, descending)
+                        for _, column, descending in ordering
+                        if (column, False) not in columns]
+        elif ranges[table]:
+            columns.append((ranges[table][0], False))
+        if columns and columns != [('id', False)]:
+            found.append((table, tuple(columns)))
+    return found
+
+
+def existing_indexes(connection, table):
+    with connection.cursor() as cursor:
+        return connection.introspection.get_constraints(cursor, table)
+
+
+def is_covered(indexes, columns):
+    """Есть индекс, начинающийся с тех же столбцов."""
+    names = [column for column, _ in columns]
+    return any(
+        (info['index'] or info['unique'] or info['primary_key'])
+        and info['columns'][:len(names)] == names
+        for info in indexes.values()
+    )
+
+
+def query_plan(connection, sql, params):
+    prefix = {
+        'postgresql': 'EXPLAIN ',
+        'sqlite': 'EXPLAIN QUERY PLAN ',
+    }.get(connection.vendor)
+    if prefix is None:
+        raise CommandError(f'EXPLAIN не поддержан: {connection.vendor}.')
+    token = explaining.set(True)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+    finally:
+        explaining.reset(token)
+    return '\n'.join(str(row[-1] if connection.vendor == 'sqlite' else row[0])
+                     for row in rows)
+
+
+def timing(connection, sql, params, repeat):
+    """Лучшее время выполнения запроса из repeat попыток, секунды."""
+    best = None
+    with connection.cursor() as cursor:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            cursor.execute(sql, params)
+            cursor.fetchall()
+            duration = time.perf_counter() - started
+            best = duration if best is None else min(best, duration)
+    return best
+
+
+def uses_index(plan, name):
+    return re.search(rf'\b{re.escape(name)}\b', plan) is not None
+
+
+def create_index_sql(connection, table, columns):
+    quote = connection.ops.quote_name
+    return 'CREATE INDEX {} ON {} ({})'.format(
+        quote(TRIAL_INDEX), quote(table), ', '.join(
+            quote(column) + (' DESC' if descending else '')
+            for column, descending in columns))
+
+
+def try_index(alias, table, columns, shapes, repeat):
+    """
+    Индекс создается в транзакции, которая затем откатывается; для
+    каждой формы, чей план его использует, замеряется выигрыш.
+    Возвращает сэкономленное время всех выполнений и число форм.
+    """
+    connection = connections[alias]
+    saved, used = 0.0, 0
+    with transaction.atomic(using=alias):
+        with connection.cursor() as cursor:
+            cursor.execute(create_index_sql(connection, table, columns))
+        for shape in shapes:
+            if not uses_index(query_plan(
+                    connection, shape['sql'], shape['params']), TRIAL_INDEX):
+                continue
+            after = timing(connection, shape['sql'], shape['params'], repeat)
+            saved += max(0, shape['time'] - after) * shape['count']
+            used += 1
+        transaction.set_rollback(True, using=alias)
+    return saved, used
+
+
+def model_index(table, columns):
+    """Index модели по столбцам таблицы и имя модели."""
+    model = next(
+        model for model in apps.get_app_config(APP_LABEL).get_models()
+        if model._meta.db_table == table)
+    names = {field.column: field.name
+             for field in model._meta.local_concrete_fields}
+    index = models.Index(fields=[
+        ('-' if descending else '') + names[column]
+        for column, descending in columns
+    ], name='')
+    index.set_name_with_model(model)
+    return model, index
+
+
+def write_migration(model_indexes):
+    """Миграция приложения reviews с рекомендованными индексами."""
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    leaves = loader.graph.leaf_nodes(APP_LABEL)
+    number = max(
+        (MigrationAutodetector.parse_number(name) or 0
+         for _, name in leaves), default=0) + 1
+    migration = migrations.Migration(f'{number:04d}_index_audit', APP_LABEL)
+    migration.dependencies = leaves
+    migration.operations = [
+        migrations.AddIndex(model_name=model._meta.model_name, index=index)
+        for model, index in model_indexes
+    ]
+    writer = MigrationWriter(migration)
+    with open(writer.path, 'w') as file:
+        file.write(writer.as_string())
+    return writer.path
+
+
+class Command(BaseCommand):
+    """
+    Аудит индексов по нагрузке: запросам горячих страниц API, выполненным
+    в этом процессе, или журналу медленных запросов с параметрами
+    (SLOW_QUERY_LOG_PARAMS=1). Каждый недостающий индекс пробуется в
+    откатываемой транзакции, и выигрыш замеряется на запросах, чьи планы
+    его используют. Неиспользуемые - индексы, которых нет ни в одном
+    плане нагрузки.
+
+    CREATE INDEX в транзакции блокирует запись в таблицу до отката, а
+    реплика только для чтения индекс не создаст. Поэтому команда
+    запускается на копии базы (DB_HOST и DB_SHARDS копии) и без флага
+    --allow-locks не выполняется.
+    """
+    help = 'Недостающие и неиспользуемые индексы по нагрузке запросов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--log', help='Журнал медленных запросов вместо горячих страниц.')
+        parser.add_argument(
+            '--titles', type=int, default=20,
+            help='Сколько популярных произведений и авторов запросить.')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument(
+            '--min-saving', type=float, default=1.0,
+            help='Порог выигрыша на всю нагрузку, миллисекунды.')
+        parser.add_argument(
+            '--emit-migration', action='store_true',
+            help='Записать миграцию с рекомендованными индексами.')
+        parser.add_argument(
+            '--allow-locks', action='store_true',
+            help='Подтверждение, что базы - копия: пробные индексы '
+                 'блокируют запись в таблицы.')
+
+    def measure(self, shapes, repeat):
+        """Планы и время форм без новых индексов."""
+        for shape in shapes:
+            connection = connections[shape['alias']]
+            shape['plan'] = query_plan(
+                connection, shape['sql'], shape['params'])
+            shape['time'] = timing(
+                connection, shape['sql'], shape['params'], repeat)
+
+    def recommend(self, shapes, options):
+        trials = defaultdict(list)
+        indexes = {}
+        for shape in shapes:
+            connection = connections[shape['alias']]
+            for table, columns in candidates(shape['sql']):
+                key = (shape['alias'], table)
+                if key not in indexes:
+                    indexes[key] = existing_indexes(connection, table)
+                if not is_covered(indexes[key], columns):
+                    trials[shape['alias'], table, columns].append(shape)
+        savings = defaultdict(lambda: [0.0, 0])
+        for (alias, table, columns), affected in trials.items():
+            saved, used = try_index(
+                alias, table, columns, affected, options['repeat'])
+            savings[table, columns][0] += saved
+            savings[table, columns][1] += used
+        return sorted(
+            ((saved, used, table, columns)
+             for (table, columns), (saved, used) in savings.items()
+             if used and saved * 1000 >= options['min_saving']),
+            key=lambda item: item[0], reverse=True)
+
+    def unused(self, shapes):
+        plans = defaultdict(str)
+        for shape in shapes:
+            plans[shape['alias']] += shape['plan'] + '\n'
+        tables = project_tables()
+        for alias, plan in sorted(plans.items()):
+            connection = connections[alias]
+            for table in sorted(
+                    tables & set(connection.introspection.table_names())):
+                for name, info in existing_indexes(
+                        connection, table).items():
+                    if (info['index'] and not info['unique']
+                            and not info['primary_key']
+                            and not uses_index(plan, name)):
+                        yield alias, table, name, info['columns']
+
+    def handle(self, *args, **options):
+        if not options['allow_locks']:
+            raise CommandError(
+                'Пробные индексы блокируют запись в таблицы баз {}. '
+                'Запустите команду на копии базы с флагом --allow-locks.'
+                .format(', '.join(sharding.shard_aliases())))
+        if options['log']:
+            workload = read_workload(options['log'])
+        else:
+            workload = replay(hot_paths(options['titles']))
+        shapes = group_shapes(workload)
+        if not shapes:
+            raise CommandError(
+                'Нет запросов для анализа. Журнал пишет параметры '
+                'запросов только с SLOW_QUERY_LOG_PARAMS=1.'
+                if options['log'] else 'Нет запросов для анализа.')
+        self.stdout.write(
+            f'Запросов: {len(workload)}, форм: {len(shapes)}')
+        self.measure(shapes, options['repeat'])
+        recommended = self.recommend(shapes, options)
+        self.stdout.write(self.style.MIGRATE_HEADING('Недостающие индексы:'))
+        model_indexes = []
+        for saved, used, table, columns in recommended:
+            model, index = model_index(table, columns)
+            model_indexes.append((model, index))
+            self.stdout.write('  {} ({}): форм {}, выигрыш {:.1f} мс'.format(
+                table, ', '.join(
+                    column + (' DESC' if descending else '')
+                    for column, descending in columns),
+                used, saved * 1000))
+            self.stdout.write(
+                '    models.Index(fields={!r}, name={!r})'.format(
+                    tuple(index.fields), index.name))
+        if not recommended:
+            self.stdout.write('  нет')
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            'Индексы, не использованные нагрузкой:'))
+        for alias, table, name, columns in self.unused(shapes):
+            self.stdout.write('  {} {}.{} ({})'.format(
+                alias, table, name, ', '.join(columns)))
+        if options['emit_migration'] and model_indexes:
+            path = write_migration(model_indexes)
+            self.stdout.write(
+                f'Миграция: {path}. Индексы нужно перенести и в '
+                'Meta.indexes моделей, иначе makemigrations их удалит.')
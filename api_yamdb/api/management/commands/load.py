@@ -4,6 +4,7 @@ import csv
 from reviews.models import (
     Genre, Category, Comment, GenreTitle, Review, YaMdbUser, Title
 )
+from reviews.sharding import get_on_shards
 
 
 class Command(BaseCommand):
@@ -101,7 +102,7 @@ class Command(BaseCommand):
             for row in reader:
                 comment = Comment(
                     id=row[0],
-                    review=Review.objects.get(pk=row[1]),
+                    review=get_on_shards(Review.objects.filter(pk=row[1])),
                     text=row[2],
                     author=YaMdbUser.objects.get(pk=row[3]),
                     pub_date=row[4]
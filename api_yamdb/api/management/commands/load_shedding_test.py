@@ -0,0 +1,96 @@
+import threading
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.core.handlers.base import BaseHandler
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import RequestFactory, override_settings
+from rest_framework.views import APIView
+
+SHEDDING_MIDDLEWARE = 'api.middleware.LoadSheddingMiddleware'
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочный тест сброса нагрузки на приложении целиком.
+
+    Запросы к --path проходят весь стек middleware и вью проекта.
+    --workers потоков моделируют воркеры gunicorn: клиент ждет
+    свободного воркера, как в очереди nginx, и время постановки в
+    очередь передается заголовком X-Request-Start. Клиентов больше, чем
+    воркеров: без сброса нагрузки задержка растет с длиной очереди, со
+    сбросом p99 принятых запросов остается ограниченным. Кэш каталога
+    и ограничения частоты отключены, чтобы каждый запрос доходил до базы.
+    """
+    help = 'p50/p99 задержки при перегрузке со сбросом нагрузки и без.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=64)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--requests', type=int, default=20)
+        parser.add_argument('--path', default='/api/v1/titles/')
+
+    def run(self, shedding, options):
+        middleware = [
+            name for name in settings.MIDDLEWARE
+            if shedding or name != SHEDDING_MIDDLEWARE
+        ]
+        with override_settings(MIDDLEWARE=middleware):
+            handler = BaseHandler()
+            handler.load_middleware()
+        workers = threading.BoundedSemaphore(options['workers'])
+        factory = RequestFactory()
+        latencies, rejected = [], []
+
+        def client():
+            try:
+                for _ in range(options['requests']):
+                    started = time.monotonic()
+                    request = factory.get(
+                        options['path'],
+                        HTTP_X_REQUEST_START='t={:.3f}'.format(time.time()))
+                    with workers:
+                        response = handler.get_response(request)
+                    if response.status_code == 503:
+                        rejected.append(1)
+                    else:
+                        latencies.append(time.monotonic() - started)
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=client)
+            for _ in range(options['clients'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, len(rejected)
+
+    def handle(self, *args, **options):
+        self.stdout.write('{:<10}{:>10}{:>10}{:>12}{:>12}'.format(
+            'shedding', 'ok', '503', 'p50 ms', 'p99 ms'))
+        for shedding in (False, True):
+            with override_settings(
+                CATALOG_CACHE_TIMEOUT=0,
+                LOAD_SHEDDING_PATTERN=r'^{}$'.format(options['path']),
+                LOAD_SHEDDING_MAX_CONCURRENCY=options['workers'],
+            ), mock.patch.object(APIView, 'get_throttles', return_value=[]):
+                latencies, rejected = self.run(shedding, options)
+            self.stdout.write('{:<10}{:>10}{:>10}{:>12.1f}{:>12.1f}'.format(
+                'on' if shedding else 'off',
+                len(latencies),
+                rejected,
+                percentile(latencies, 0.5) * 1000,
+                percentile(latencies, 0.99) * 1000,
+            ))
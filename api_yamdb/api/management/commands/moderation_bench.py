@@ -0,0 +1,171 @@
+import io
+import itertools
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.views import CommentViewSet, ReviewViewSet
+from reviews import sharding
+from reviews.deletion import delete_matching
+from reviews.models import Comment, Review, Title, YaMdbUser
+
+SPAMMER = 'spam-bench'
+
+
+class Command(BaseCommand):
+    """
+    Удаление спама модератором: по одному через DELETE вьюсетов и одним
+    запросом к /moderation/. Спам - комментарии одного автора к
+    существующим отзывам и отзывы спам-аккаунтов ко всем произведениям.
+    После прогона счетчики сверяются командой reconcile_counts.
+    """
+    help = 'Бенчмарк массовой модерации на спам-комментариях и отзывах.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--comments', type=int, default=100000)
+        parser.add_argument('--reviews', type=int, default=10000)
+        parser.add_argument('--sample', type=int, default=200)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def create_spam(self, options):
+        """Спам через bulk_create; счетчики затем пересчитываются."""
+        titles = list(Title.objects.values_list('pk', flat=True))
+        reviews = list(Review.objects.values_list('pk', 'title_id')[:1000])
+        if not titles or not reviews:
+            raise CommandError('Нужны произведения и отзывы.')
+        spammer = YaMdbUser.objects.create(
+            username=SPAMMER, email=f'{SPAMMER}@example.com')
+        names = [
+            f'{SPAMMER}-{number}'
+            for number in range(-(-options['reviews'] // len(titles)))
+        ]
+        YaMdbUser.objects.bulk_create(
+            YaMdbUser(username=name, email=f'{name}@example.com')
+            for name in names)
+        accounts = list(YaMdbUser.objects.filter(username__in=names))
+        pairs = itertools.islice(
+            itertools.product(accounts, titles), options['reviews'])
+        shards = {}
+        for author, title_id in pairs:
+            shards.setdefault(sharding.shard_for(title_id), []).append(
+                Review(author=author, title_id=title_id, score=1,
+                       text='Купите слоников недорого'))
+        for (review_id, title_id), number in zip(
+                itertools.cycle(reviews), range(options['comments'])):
+            shards.setdefault(sharding.shard_for(title_id), []).append(
+                Comment(author=spammer, review_id=review_id,
+                        text=f'Купите слоников недорого {number}'))
+        for alias, rows in shards.items():
+            for model in (Review, Comment):
+                model._base_manager.using(alias).bulk_create(
+                    (row for row in rows if isinstance(row, model)),
+                    batch_size=options['batch_size'])
+        call_command('reconcile_counts', stdout=io.StringIO())
+        return spammer, accounts
+
+    def delete_one_by_one(self, client, queryset, sample):
+        """DELETE каждой записи через API; возвращает число и время."""
+        if queryset.model is Comment:
+            queryset = queryset.select_related('review')
+        rows = list(itertools.islice(itertools.chain.from_iterable(
+            shard_queryset[:sample]
+            for shard_queryset in sharding.on_shards(queryset)
+        ), sample))
+        started = time.monotonic()
+        for row in rows:
+            if isinstance(row, Review):
+                path = f'/api/v1/titles/{row.title_id}/reviews/{row.pk}/'
+            else:
+                path = '/api/v1/titles/{}/reviews/{}/comments/{}/'.format(
+                    row.review.title_id, row.review_id, row.pk)
+            response = client.delete(path)
+            if response.status_code != 204:
+                raise CommandError(
+                    f'Ответ {response.status_code}: {response.content!r}')
+        return len(rows), time.monotonic() - started
+
+    def by_ids(self, action, queryset):
+        """
+        Условия модерации по id строк queryset: под условие по тексту
+        попали бы и настоящие отзывы со словом из спама.
+        """
+        ids = [
+            pk for shard_queryset in sharding.on_shards(queryset)
+            for pk in shard_queryset.values_list('pk', flat=True)
+        ]
+        size = settings.MODERATION_MAX_IDS
+        return [
+            {'action': action, 'ids': ids[start:start + size]}
+            for start in range(0, len(ids), size)
+        ]
+
+    def moderate(self, client, target, conditions):
+        """Запросы к /moderation/; возвращает число строк и время."""
+        rows = 0
+        started = time.monotonic()
+        for data in conditions:
+            response = client.post(
+                f'/api/v1/moderation/{target}/', data,
+                content_type='application/json')
+            if response.status_code != 200:
+                raise CommandError(
+                    f'Ответ {response.status_code}: {response.content!r}')
+            rows += response.json()[target]
+        return rows, time.monotonic() - started
+
+    def report(self, name, rows, seconds):
+        self.stdout.write('{:<28}{:>10}{:>10.2f}{:>12.0f}'.format(
+            name, rows, seconds, rows / seconds if seconds else 0))
+
+    def handle(self, *args, **options):
+        if YaMdbUser.objects.filter(username=SPAMMER).exists():
+            raise CommandError(f'Пользователь {SPAMMER} уже есть.')
+        moderator = YaMdbUser.objects.create(
+            username=f'{SPAMMER}-moderator', role='moderator',
+            email=f'{SPAMMER}-moderator@example.com')
+        client = Client(
+            HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(moderator)}')
+        try:
+            spammer, accounts = self.create_spam(options)
+            spam_reviews = Review._base_manager.filter(author__in=accounts)
+            self.stdout.write('{:<28}{:>10}{:>10}{:>12}'.format(
+                'mode', 'rows', 'seconds', 'rows/s'))
+            throttles = (
+                mock.patch.object(CommentViewSet, 'throttle_classes', ()),
+                mock.patch.object(ReviewViewSet, 'throttle_classes', ()),
+            )
+            with throttles[0], throttles[1]:
+                self.report('comments one by one', *self.delete_one_by_one(
+                    client, Comment.objects.filter(author=spammer),
+                    options['sample']))
+                self.report('reviews one by one (hide)',
+                            *self.delete_one_by_one(
+                                client, spam_reviews.filter(is_deleted=False),
+                                options['sample']))
+            self.report('comments bulk delete', *self.moderate(
+                client, 'comments',
+                [{'action': 'delete', 'author': SPAMMER}]))
+            self.report('reviews bulk hide', *self.moderate(
+                client, 'reviews', self.by_ids(
+                    'hide', spam_reviews.filter(is_deleted=False))))
+            self.report('reviews bulk delete', *self.moderate(
+                client, 'reviews', self.by_ids('delete', spam_reviews)))
+        finally:
+            users = YaMdbUser.objects.filter(username__startswith=SPAMMER)
+            authors = list(users.values_list('pk', flat=True))
+            for model in (Comment, Review):
+                delete_matching(
+                    model._base_manager.filter(author__in=authors),
+                    options['batch_size'])
+            users.delete()
+        output = io.StringIO()
+        call_command('reconcile_counts', stdout=output)
+        fixed = [line for line in output.getvalue().splitlines()
+                 if not line.endswith(' 0')]
+        self.stdout.write('Расхождения счетчиков: {}'.format(
+            ', '.join(fixed) or 'нет'))
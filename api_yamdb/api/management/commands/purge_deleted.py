@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from reviews.deletion import purge
+from reviews.models import DeletionTask
+
+
+class Command(BaseCommand):
+    """Фоновое удаление скрытых произведений, отзывов и пользователей."""
+    help = 'Удаление зависимых записей пачками по задачам DeletionTask.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Работать постоянно, проверяя новые задачи.')
+        parser.add_argument('--sleep', type=float, default=5)
+        parser.add_argument(
+            '--status', action='store_true',
+            help='Показать незавершенные задачи и выйти.')
+
+    def show_progress(self, task):
+        self.stdout.write(
+            f'{task}: удалено строк {task.deleted_rows}')
+
+    def handle(self, *args, **options):
+        pending = DeletionTask.objects.filter(
+            finished__isnull=True).order_by('created')
+        if options['status']:
+            for task in pending:
+                self.show_progress(task)
+            return
+        while True:
+            for task in pending.all():
+                purge(task, options['batch_size'], self.show_progress)
+                self.stdout.write(f'{task}: удаление завершено')
+            if not options['loop']:
+                return
+            time.sleep(options['sleep'])
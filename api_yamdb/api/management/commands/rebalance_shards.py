@@ -0,0 +1,98 @@
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from reviews import sharding
+from reviews.models import Comment, Review
+
+
+def title_loads():
+    """Число отзывов и комментариев каждого произведения по шардам."""
+    loads = {}
+    for alias in settings.DATABASE_SHARDS:
+        counts = Counter()
+        for queryset, key in (
+            (Review._base_manager.using(alias), 'title_id'),
+            (Comment.objects.using(alias), 'review__title_id'),
+        ):
+            counts.update(dict(queryset.order_by().values(key).annotate(
+                total=Count('pk')).values_list(key, 'total')))
+        loads[alias] = counts
+    return loads
+
+
+def plan_moves(loads, tolerance, max_moves):
+    """
+    Переносы с самого загруженного шарда на самый свободный, пока
+    разница больше tolerance от средней загрузки. Переносится
+    произведение, лучше всего сокращающее разницу.
+    """
+    totals = {alias: sum(counts.values()) for alias, counts in loads.items()}
+    average = sum(totals.values()) / len(totals)
+    moves = []
+    while len(moves) < max_moves:
+        source = max(totals, key=totals.get)
+        target = min(totals, key=totals.get)
+        gap = totals[source] - totals[target]
+        if gap <= tolerance * average:
+            break
+        candidates = [
+            (abs(gap - 2 * load), title_id, load)
+            for title_id, load in loads[source].items() if 0 < load < gap
+        ]
+        if not candidates:
+            break
+        _, title_id, load = min(candidates)
+        moves.append((title_id, source, target, load))
+        loads[target][title_id] = loads[source].pop(title_id)
+        totals[source] -= load
+        totals[target] += load
+    return moves
+
+
+class Command(BaseCommand):
+    """
+    Выравнивание шардов по числу отзывов и комментариев. Пока
+    произведение переносится, запись его отзывов и комментариев
+    отвечает 503; чтение продолжается из исходного шарда.
+    """
+    help = 'Перенос произведений между шардами отзывов и комментариев.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tolerance', type=float, default=0.1)
+        parser.add_argument('--max-moves', type=int, default=100)
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument(
+            '--title', type=int, help='Перенести одно произведение в --to.')
+        parser.add_argument('--to', help='Шард для --title.')
+
+    def wait(self):
+        """Все процессы успевают сверить карту шардов."""
+        time.sleep(settings.SHARD_MAP_CHECK_INTERVAL * 2)
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError('Шарды не настроены: DB_SHARDS.')
+        if options['title'] is not None:
+            if options['to'] not in settings.DATABASE_SHARDS:
+                raise CommandError(
+                    'Неизвестный шард: {}.'.format(options['to']))
+            moves = [(
+                options['title'], sharding.stored_shard(options['title']),
+                options['to'], None
+            )]
+        else:
+            moves = plan_moves(
+                title_loads(), options['tolerance'], options['max_moves'])
+        for title_id, source, target, load in moves:
+            self.stdout.write(
+                f'Произведение {title_id}: {source} -> {target} ({load})')
+            if options['dry_run']:
+                continue
+            moved = sharding.move_title(
+                title_id, target, settings.SHARD_MOVE_BATCH_SIZE, self.wait)
+            self.stdout.write(f'  перенесено строк: {moved}')
+        self.stdout.write(f'Переносов: {len(moves)}')
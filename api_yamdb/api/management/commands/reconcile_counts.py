@@ -0,0 +1,163 @@
+from collections import Counter, defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from reviews import sharding
+from reviews.models import (
+    SCORES, Category, Comment, Genre, GenreTitle, Review, Title, YaMdbUser
+)
+
+
+def count_subquery(model, field):
+    """Подзапрос с фактическим числом строк model для внешней записи."""
+    return Coalesce(Subquery(
+        model._base_manager.filter(**{field: OuterRef('pk')})
+        .order_by().values(field).annotate(total=Count('pk'))
+        .values('total')
+    ), 0)
+
+
+def score_subquery(score):
+    """Подзапрос с числом видимых отзывов произведения с оценкой score."""
+    return Coalesce(Subquery(
+        Review._base_manager.filter(
+            title=OuterRef('pk'), score=score, is_deleted=False
+        ).order_by().values('title').annotate(total=Count('pk'))
+        .values('total')
+    ), 0)
+
+
+def rollup_subquery(model, field, relation):
+    """Подзапрос с суммой поля гистограммы по произведениям группы."""
+    return Coalesce(Subquery(
+        model._base_manager.filter(**{relation: OuterRef('pk')})
+        .order_by().values(relation).annotate(total=Sum(field))
+        .values('total')
+    ), 0)
+
+
+def shard_totals(queryset, *keys):
+    """
+    Число строк по ключам, просуммированное по всем шардам. Так
+    считаются счетчики основной базы по отзывам и комментариям в шардах.
+    """
+    totals = Counter()
+    for shard_queryset in sharding.on_shards(queryset.order_by()):
+        for *key, total in shard_queryset.values(*keys).annotate(
+                total=Count('pk')).values_list(*keys, 'total'):
+            totals[tuple(key) if len(key) > 1 else key[0]] += total
+    return totals
+
+
+def score_totals():
+    """Число видимых отзывов по оценкам: {оценка: {произведение: число}}."""
+    by_score = defaultdict(dict)
+    totals = shard_totals(
+        Review._base_manager.filter(is_deleted=False), 'title_id', 'score')
+    for (title_id, score), total in totals.items():
+        by_score[score][title_id] = total
+    return by_score
+
+
+def histograms():
+    """Гистограммы оценок: сначала произведения, затем категории и жанры."""
+    fields = [(score, f'score_{score}') for score in SCORES]
+    if sharding.enabled():
+        by_score = score_totals()
+        titles = [(Title, field, by_score[score]) for score, field in fields]
+    else:
+        titles = [
+            (Title, field, score_subquery(score)) for score, field in fields]
+    return (
+        titles
+        + [
+            (Category, field, rollup_subquery(Title, field, 'category'))
+            for _, field in fields
+        ]
+        + [
+            (Genre, field, rollup_subquery(
+                GenreTitle, f'title__{field}', 'genre'))
+            for _, field in fields
+        ]
+    )
+
+
+class Command(BaseCommand):
+    """Исправление расхождений денормализованных счетчиков."""
+    help = (
+        'Пересчет comments_count отзывов, счетчиков пользователей '
+        'и гистограмм оценок.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def reconcile(self, model, field, actual, batch_size, using=None):
+        """
+        Пересчет пачками по pk, обновляются только разошедшиеся строки.
+        actual - подзапрос или словарь {pk: значение} для счетчиков по
+        данным из шардов.
+        """
+        fixed = 0
+        last_pk = 0
+        objects = model._base_manager.db_manager(using)
+        while True:
+            pks = list(
+                objects.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not pks:
+                return fixed
+            last_pk = pks[-1]
+            with transaction.atomic(using=using):
+                if isinstance(actual, dict):
+                    fixed += self.update_changed(
+                        objects.filter(pk__in=pks), field, actual)
+                else:
+                    fixed += objects.filter(pk__in=pks).exclude(
+                        **{field: actual}).update(**{field: actual})
+
+    def update_changed(self, queryset, field, actual):
+        """Одно обновление на каждое новое значение счетчика."""
+        changed = defaultdict(list)
+        for pk, value in queryset.values_list('pk', field):
+            if actual.get(pk, 0) != value:
+                changed[actual.get(pk, 0)].append(pk)
+        for value, pks in changed.items():
+            queryset.filter(pk__in=pks).update(**{field: value})
+        return sum(len(pks) for pks in changed.values())
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if sharding.enabled():
+            # отзывы и комментарии в шардах: подзапрос к ним из основной
+            # базы невозможен, счетчики сверяются с суммой по шардам
+            users = (
+                (YaMdbUser, 'reviews_count', shard_totals(
+                    Review._base_manager.all(), 'author_id'), None),
+                (YaMdbUser, 'comments_count', shard_totals(
+                    Comment.objects.all(), 'author_id'), None),
+            )
+        else:
+            users = (
+                (YaMdbUser, 'reviews_count',
+                 count_subquery(Review, 'author'), None),
+                (YaMdbUser, 'comments_count',
+                 count_subquery(Comment, 'author'), None),
+            )
+        counters = (
+            *(
+                (Review, 'comments_count', count_subquery(Comment, 'review'),
+                 alias)
+                for alias in sharding.shard_aliases()
+            ),
+            *users,
+            *((*counter, None) for counter in histograms()),
+        )
+        for model, field, actual, using in counters:
+            fixed = self.reconcile(model, field, actual, batch_size, using)
+            self.stdout.write(
+                f'{model._meta.model_name}.{field}: исправлено {fixed}')
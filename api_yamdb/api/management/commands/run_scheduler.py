@@ -0,0 +1,66 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from reviews.models import ScheduledJob
+from reviews.scheduler import Scheduler, load_jobs
+
+
+class Command(BaseCommand):
+    """
+    Периодические задачи приложений (модули jobs). Можно запускать в
+    нескольких контейнерах: каждый запуск задачи выполняет один процесс.
+    По SIGTERM текущая задача доделывается, и цикл завершается.
+    """
+    help = 'Выполнение периодических задач по расписанию.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--run', metavar='NAME',
+            help='Выполнить одну задачу сейчас и выйти.')
+        parser.add_argument(
+            '--status', action='store_true',
+            help='Показать расписание и метрики задач и выйти.')
+        parser.add_argument(
+            '--interval', type=float, default=settings.SCHEDULER_POLL_INTERVAL)
+
+    def show_result(self, job, duration, error):
+        self.stdout.write('{}: {} за {:.2f} с'.format(
+            job.name, 'ошибка' if error else 'выполнена', duration))
+
+    def show_status(self, jobs):
+        self.stdout.write('{:<26}{:<16}{:<22}{:>8}{:>8}{:>10}  {}'.format(
+            'job', 'schedule', 'next run', 'runs', 'errors', 'seconds',
+            'locked by'))
+        for state in ScheduledJob.objects.filter(name__in=jobs):
+            self.stdout.write('{:<26}{:<16}{:<22}{:>8}{:>8}{:>10}  {}'.format(
+                state.name, state.schedule or '-',
+                f'{state.next_run:%Y-%m-%d %H:%M:%S}'
+                if state.next_run else '-',
+                state.runs, state.failures,
+                '-' if state.last_duration is None
+                else f'{state.last_duration:.2f}',
+                state.locked_by or '-'))
+
+    def handle(self, *args, **options):
+        jobs = load_jobs()
+        scheduler = Scheduler(jobs, self.show_result)
+        scheduler.sync()
+        if options['status']:
+            self.show_status(jobs)
+            return
+        if options['run'] is not None:
+            job = jobs.get(options['run'])
+            if job is None:
+                raise CommandError('Неизвестная задача: {}. Есть: {}.'.format(
+                    options['run'], ', '.join(sorted(jobs))))
+            if not scheduler.acquire(job, force=True):
+                raise CommandError(f'Задача {job.name} уже выполняется.')
+            if not scheduler.run(job):
+                raise CommandError(f'Задача {job.name} завершилась ошибкой.')
+            return
+        signal.signal(
+            signal.SIGTERM, lambda *args: scheduler.stopping.set())
+        self.stdout.write('Задачи: {}'.format(', '.join(sorted(jobs))))
+        scheduler.loop(options['interval'])
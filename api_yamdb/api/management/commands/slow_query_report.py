@@ -0,0 +1,92 @@
+import json
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+SORT_KEYS = {
+    'total': lambda shape: shape['total'],
+    'count': lambda shape: shape['count'],
+    'max': lambda shape: shape['max'],
+}
+
+
+def read_entries(path):
+    """Записи журнала медленных запросов вместе с ротированной частью."""
+    for name in (path + '.1', path):
+        try:
+            with open(name) as file:
+                for line in file:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # строка, оборванная при записи
+                        continue
+        except FileNotFoundError:
+            continue
+
+
+def aggregate(entries):
+    """Группировка записей по нормализованной форме запроса."""
+    shapes = {}
+    for entry in entries:
+        shape = shapes.setdefault(entry['shape'], {
+            'shape': entry['shape'],
+            'count': 0,
+            'total': 0.0,
+            'max': 0.0,
+            'sources': Counter(),
+            'callers': Counter(),
+            'plan': None,
+            'analyzed': False,
+        })
+        shape['count'] += 1
+        shape['total'] += entry['duration']
+        shape['max'] = max(shape['max'], entry['duration'])
+        shape['sources'][entry['source']] += 1
+        shape['callers'][entry['caller']] += 1
+        # план с ANALYZE информативнее, из равных берется последний
+        if entry['plan'] and (entry['analyzed'] or not shape['analyzed']):
+            shape['plan'] = entry['plan']
+            shape['analyzed'] = entry['analyzed']
+    return list(shapes.values())
+
+
+class Command(BaseCommand):
+    """Отчет по журналу медленных запросов, сгруппированному по форме."""
+    help = 'Медленные запросы по формам с планами EXPLAIN.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', default=settings.SLOW_QUERY_LOG)
+        parser.add_argument('--top', type=int, default=10)
+        parser.add_argument(
+            '--sort', choices=sorted(SORT_KEYS), default='total')
+        parser.add_argument('--sql-length', type=int, default=300)
+
+    def handle(self, *args, **options):
+        shapes = sorted(
+            aggregate(read_entries(options['log'])),
+            key=SORT_KEYS[options['sort']], reverse=True
+        )
+        if not shapes:
+            self.stdout.write('Медленных запросов не найдено.')
+            return
+        for index, shape in enumerate(shapes[:options['top']], 1):
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                '#{} выполнений: {}, всего {:.1f} мс, среднее {:.1f} мс, '
+                'максимум {:.1f} мс'.format(
+                    index, shape['count'], shape['total'] * 1000,
+                    shape['total'] / shape['count'] * 1000,
+                    shape['max'] * 1000)))
+            self.stdout.write(shape['shape'][:options['sql_length']])
+            for title, counter in (('Источники', shape['sources']),
+                                   ('Вызовы', shape['callers'])):
+                self.stdout.write('{}:'.format(title))
+                for name, count in counter.most_common(3):
+                    self.stdout.write('  {} ({})'.format(name, count))
+            if shape['plan']:
+                self.stdout.write('План{}:'.format(
+                    ' (ANALYZE)' if shape['analyzed'] else ''))
+                for line in shape['plan'].splitlines():
+                    self.stdout.write('  ' + line)
+            self.stdout.write('')
@@ -0,0 +1,108 @@
+import os
+import signal
+import socket
+import subprocess
+import time
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def children(pid):
+    """Дочерние процессы по полю PPid в /proc."""
+    result = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as file:
+                stat = file.read()
+        except OSError:
+            continue
+        if int(stat.rsplit(')', 1)[1].split()[1]) == pid:
+            result.append(int(name))
+    return result
+
+
+def memory(pid):
+    """RSS и PSS процесса в КБ; PSS учитывает разделяемые страницы."""
+    values = {}
+    for path in (f'/proc/{pid}/status', f'/proc/{pid}/smaps_rollup'):
+        try:
+            with open(path) as file:
+                for line in file:
+                    key, _, value = line.partition(':')
+                    if key in ('VmRSS', 'Pss'):
+                        values[key] = int(value.split()[0])
+        except OSError:
+            continue
+    return values.get('VmRSS', 0), values.get('Pss', 0)
+
+
+class Command(BaseCommand):
+    """Холодный старт gunicorn и память воркеров с preload и без него."""
+    help = 'Бенчмарк времени старта и RSS/PSS на воркер gunicorn.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--path', default='/api/v1/categories/')
+        parser.add_argument('--timeout', type=float, default=60)
+
+    def wait_ready(self, url, process, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError('gunicorn завершился при старте.')
+            try:
+                urllib.request.urlopen(url, timeout=1).read()
+                return
+            except (OSError, socket.timeout):
+                time.sleep(0.05)
+        raise CommandError('gunicorn не ответил за {} с.'.format(timeout))
+
+    def run(self, preload, options):
+        env = dict(
+            os.environ,
+            GUNICORN_PRELOAD='1' if preload else '0',
+            GUNICORN_WORKERS=str(options['workers']),
+            GUNICORN_BIND='127.0.0.1:{}'.format(options['port']),
+            GUNICORN_ACCESSLOG='/dev/null',
+        )
+        url = 'http://127.0.0.1:{}{}'.format(options['port'], options['path'])
+        started = time.monotonic()
+        process = subprocess.Popen(
+            ['gunicorn', '--config', 'gunicorn.conf.py',
+             'api_yamdb.wsgi:application'],
+            cwd=settings.BASE_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            self.wait_ready(url, process, options['timeout'])
+            ready = time.monotonic() - started
+            # все воркеры должны успеть подняться и прогреться
+            deadline = time.monotonic() + options['timeout']
+            while (len(children(process.pid)) < options['workers']
+                   and time.monotonic() < deadline):
+                time.sleep(0.05)
+            for _ in range(options['workers'] * 4):
+                urllib.request.urlopen(url, timeout=5).read()
+            workers = [memory(pid) for pid in children(process.pid)]
+            master = memory(process.pid)
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+        return ready, master, workers
+
+    def handle(self, *args, **options):
+        self.stdout.write('{:<10}{:>10}{:>14}{:>14}{:>14}'.format(
+            'preload', 'start, s', 'master RSS', 'worker RSS', 'worker PSS'))
+        for preload in (False, True):
+            ready, master, workers = self.run(preload, options)
+            rss = sum(rss for rss, _ in workers) / len(workers)
+            pss = sum(pss for _, pss in workers) / len(workers)
+            self.stdout.write('{:<10}{:>10.2f}{:>11} KB{:>11.0f} KB'
+                              '{:>11.0f} KB'.format(
+                                  'on' if preload else 'off', ready,
+                                  master[0], rss, pss))
@@ -0,0 +1,272 @@
+import hashlib
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence, compress_string
+
+try:
+    import brotli
+except ImportError:  # brotli - необязательная зависимость
+    brotli = None
+
+SUPPORTED_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+# Заголовки, которые не переносятся из закэшированного ответа
+SKIPPED_HEADERS = ('content-length', 'content-encoding')
+
+
+def get_catalog_version():
+    """Текущая версия кэша каталога."""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, 1, None)
+        return cache.get(CATALOG_VERSION_KEY, 1)
+    return version
+
+
+def bump_catalog_version():
+    """Инвалидация всех закэшированных ответов каталога."""
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, 1, None)
+
+
+def parse_accept_encoding(header):
+    """Разбор заголовка Accept-Encoding в словарь {кодировка: q}."""
+    encodings = {}
+    for item in header.split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        encodings[coding] = quality
+    return encodings
+
+
+def choose_encoding(request):
+    """Выбор лучшей кодировки из поддерживаемых клиентом."""
+    accepted = parse_accept_encoding(
+        request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    best, best_quality = None, 0.0
+    for coding in SUPPORTED_ENCODINGS:
+        quality = accepted.get(coding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress_body(body, encoding):
+    """Сжатие тела ответа целиком."""
+    if encoding == 'br':
+        return brotli.compress(
+            body, quality=settings.COMPRESSION_BROTLI_QUALITY)
+    return compress_string(body)
+
+
+def brotli_sequence(sequence):
+    """Потоковое сжатие brotli с отдачей данных после каждого куска."""
+    compressor = brotli.Compressor(
+        quality=settings.COMPRESSION_BROTLI_QUALITY)
+    for item in sequence:
+        data = compressor.process(item) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware:
+    """
+    Сжатие ответов gzip/brotli по заголовку Accept-Encoding.
+
+    JSON-ответы каталога (произведения, жанры, категории) для анонимных
+    GET-запросов кэшируются вместе со сжатыми вариантами, поэтому при
+    попадании в кэш повторного сжатия не происходит.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.catalog_re = re.compile(settings.CATALOG_CACHE_PATTERN)
+
+    def __call__(self, request):
+        encoding = choose_encoding(request)
+        cache_key = self.get_cache_key(request)
+        if cache_key is not None:
+            entry = cache.get(cache_key)
+            if entry is not None:
+                return self.cached_response(cache_key, entry, encoding)
+        response = self.get_response(request)
+        if (cache_key is not None and response.status_code == 200
+                and not response.streaming
+                and response.get('Content-Type', '').startswith(
+                    'application/json')
+                and not self.is_uncacheable(response)):
+            entry = {
+                'headers': [
+                    (header, value) for header, value in response.items()
+                    if header.lower() not in SKIPPED_HEADERS
+                ],
+                'variants': {'identity': response.content},
+            }
+            return self.cached_response(
+                cache_key, entry, encoding, fresh=True)
+        return self.compress(response, encoding)
+
+    def get_cache_key(self, request):
+        if (settings.CATALOG_CACHE_TIMEOUT <= 0
+                or request.method != 'GET'
+                or 'HTTP_AUTHORIZATION' in request.META
+                or not self.catalog_re.match(request.path_info)):
+            return None
+        # от Accept зависит формат ответа: JSON или страница Browsable
+        # API; хеш вместо адреса - ключ в пределах длины ключа memcached
+        digest = hashlib.md5('{}\n{}'.format(
+            request.META.get('HTTP_ACCEPT', ''), request.get_full_path()
+        ).encode()).hexdigest()
+        return 'catalog:{}:{}'.format(get_catalog_version(), digest)
+
+    def is_uncacheable(self, response):
+        cache_control = response.get('Cache-Control', '')
+        return any(
+            directive in cache_control
+            for directive in ('no-cache', 'no-store', 'private')
+        )
+
+    def cached_response(self, cache_key, entry, encoding, fresh=False):
+        """Ответ из записи кэша, недостающий вариант сжимается один раз."""
+        variants = entry['variants']
+        identity = variants['identity']
+        if len(identity) < settings.COMPRESSION_MIN_SIZE:
+            encoding = None
+        changed = fresh
+        if encoding is not None and encoding not in variants:
+            compressed = compress_body(identity, encoding)
+            # None отмечает вариант, сжатие которого не дает выигрыша
+            variants[encoding] = (
+                compressed if len(compressed) < len(identity) else None)
+            changed = True
+        body = variants.get(encoding or 'identity')
+        if body is None:
+            encoding, body = None, identity
+        if changed:
+            cache.set(cache_key, entry, settings.CATALOG_CACHE_TIMEOUT)
+        response = HttpResponse(body)
+        for header, value in entry['headers']:
+            response[header] = value
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['Content-Length'] = str(len(body))
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    def compress(self, response, encoding):
+        if response.has_header('Content-Encoding'):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if encoding is None:
+            return response
+        if response.streaming:
+            if encoding == 'br':
+                content = brotli_sequence(response.streaming_content)
+            else:
+                content = compress_sequence(response.streaming_content)
+            response.streaming_content = content
+            del response['Content-Length']
+        else:
+            if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+                return response
+            compressed = compress_body(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(response.content))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+
+class LoadSheddingMiddleware:
+    """
+    Сброс нагрузки на дорогих эндпоинтах.
+
+    Запрос отклоняется с 503 и Retry-After, если он слишком долго ждал в
+    очереди (заголовок X-Request-Start от nginx) или если число
+    одновременно выполняемых запросов достигло предела. Предел
+    уменьшается при превышении целевой задержки и медленно растет
+    обратно, пока задержка в норме.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.paths_re = re.compile(settings.LOAD_SHEDDING_PATTERN)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.limit = float(settings.LOAD_SHEDDING_MAX_CONCURRENCY)
+
+    def __call__(self, request):
+        # подзапросы /batch/ проходят через тот же лимит
+        request.load_shedder = self
+        if not self.paths_re.match(request.path_info):
+            return self.get_response(request)
+        if self.queue_time(request) > settings.LOAD_SHEDDING_MAX_QUEUE_TIME:
+            return self.reject()
+        return self.run(self.get_response, request)
+
+    def run(self, handler, *args, **kwargs):
+        """Вызов handler, если лимит одновременных запросов не достигнут."""
+        with self.lock:
+            if self.in_flight >= int(self.limit):
+                return self.reject()
+            self.in_flight += 1
+        started = time.monotonic()
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            elapsed = time.monotonic() - started
+            with self.lock:
+                self.in_flight -= 1
+                self.adapt(elapsed)
+
+    def queue_time(self, request):
+        """Время ожидания в очереди по заголовку X-Request-Start."""
+        header = request.META.get('HTTP_X_REQUEST_START', '')
+        try:
+            started = float(header.replace('t=', '', 1))
+        except ValueError:
+            return 0.0
+        return time.time() - started
+
+    def adapt(self, elapsed):
+        if elapsed > settings.LOAD_SHEDDING_TARGET_LATENCY:
+            self.limit = max(
+                float(settings.LOAD_SHEDDING_MIN_CONCURRENCY),
+                self.limit * 0.9
+            )
+        else:
+            self.limit = min(
+                float(settings.LOAD_SHEDDING_MAX_CONCURRENCY),
+                self.limit + 1 / self.limit
+            )
+
+    def reject(self):
+        response = JsonResponse(
+            {'detail': 'Сервис перегружен, повторите запрос позже.'},
+            status=503
+        )
+        response['Retry-After'] = str(settings.LOAD_SHEDDING_RETRY_AFTER)
+        return response
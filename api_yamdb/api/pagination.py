@@ -0,0 +1,157 @@
+import hashlib
+from collections import OrderedDict
+from functools import partial
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import InvalidPage, Page, Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import (
+    CursorPagination, PageNumberPagination
+)
+from rest_framework.response import Response
+
+COUNT_VERSION_KEY = 'count:version'
+
+
+def get_count_version():
+    version = cache.get(COUNT_VERSION_KEY)
+    if version is None:
+        cache.add(COUNT_VERSION_KEY, 1, None)
+        return cache.get(COUNT_VERSION_KEY, 1)
+    return version
+
+
+def bump_count_version():
+    """Инвалидация закэшированных количеств строк."""
+    try:
+        cache.incr(COUNT_VERSION_KEY)
+    except ValueError:
+        cache.add(COUNT_VERSION_KEY, 1, None)
+
+
+def estimate_count(queryset):
+    """Оценка числа строк планировщиком PostgreSQL, иначе None."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Пагинатор, кэширующий количество строк по набору фильтров. Если
+    планировщик оценивает выборку выше порога, берется оценка.
+    """
+    def __init__(self, *args, cache_key, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_key = cache_key
+
+    @cached_property
+    def count(self):
+        count = cache.get(self.cache_key)
+        if count is not None:
+            return count
+        count = estimate_count(self.object_list)
+        if count is None or count <= settings.COUNT_ESTIMATE_THRESHOLD:
+            count = super().count
+        cache.set(self.cache_key, count, settings.COUNT_CACHE_TIMEOUT)
+        return count
+
+
+class NoCountPage(Page):
+    def has_next(self):
+        return self.paginator.more
+
+
+class NoCountPaginator(Paginator):
+    """Пагинатор без COUNT(*): наличие следующей страницы по лишней строке."""
+    number = 1
+    more = False
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise InvalidPage('Номер страницы должен быть целым числом.')
+        if number < 1:
+            raise InvalidPage('Номер страницы меньше 1.')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise InvalidPage('На этой странице нет результатов.')
+        self.number = number
+        self.more = len(rows) > self.per_page
+        return NoCountPage(rows[:self.per_page], number, self)
+
+    @property
+    def num_pages(self):
+        return self.number + 1 if self.more else self.number
+
+
+class CachedCountPagination(PageNumberPagination):
+    """
+    Постраничный вывод с кэшированным количеством. Параметр count=false
+    убирает поле count из ответа и сам запрос COUNT(*).
+    """
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.with_count = request.query_params.get(
+            self.count_query_param, '').lower() not in ('false', '0', 'no')
+        if self.with_count:
+            self.django_paginator_class = partial(
+                CachedCountPaginator,
+                cache_key=self.get_count_cache_key(request, view)
+            )
+        else:
+            self.django_paginator_class = NoCountPaginator
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count_cache_key(self, request, view):
+        """Ключ по нормализованному набору параметров фильтрации."""
+        filterset_class = getattr(view, 'filterset_class', None)
+        names = (
+            set(filterset_class.base_filters) if filterset_class
+            else set(request.query_params)
+        )
+        names -= {
+            self.page_query_param, self.page_size_query_param,
+            self.count_query_param,
+        }
+        params = sorted(
+            (name, value.strip().lower())
+            for name in names
+            for value in request.query_params.getlist(name)
+            if value.strip()
+        )
+        digest = hashlib.md5(urlencode(params).encode()).hexdigest()
+        return 'count:{}:{}:{}'.format(
+            get_count_version(), type(view).__name__, digest)
+
+    def get_paginated_response(self, data):
+        if self.with_count:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+
+class AuthorFeedPagination(CursorPagination):
+    """
+    Постраничный вывод ленты автора по ключу (pub_date, id) без OFFSET и
+    COUNT(*): время ответа не зависит от номера страницы и числа записей.
+    """
+    ordering = ('-pub_date', '-id')
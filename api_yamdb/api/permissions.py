@@ -37,3 +37,13 @@ class AdminOrReadOnly(permissions.BasePermission):
         if request.user.is_authenticated:
             return request.user.role == 'admin'
         return False
+
+
+class IsModeratorOrAdmin(BasePermission):
+    """Разрешение доступа авторизированному модератору или админу."""
+    def has_permission(self, request, view):
+        return (
+            request.user.is_authenticated
+            and (request.user.role in ('moderator', 'admin')
+                 or request.user.is_superuser)
+        )
@@ -0,0 +1,197 @@
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+PROFILE_ID_RE = re.compile(r'^[0-9]{14}-[0-9a-f]{32}$')
+
+
+class StackSampler(threading.Thread):
+    """
+    Статистический профилировщик: поток раз в PROFILING_INTERVAL секунд
+    снимает стек профилируемого потока и считает одинаковые стеки.
+    """
+    def __init__(self, thread_id):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self.finished = threading.Event()
+
+    def run(self):
+        while not self.finished.wait(settings.PROFILING_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                names.append('{}:{}'.format(
+                    frame.f_globals.get('__name__', '?'),
+                    frame.f_code.co_name))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self.finished.set()
+        self.join()
+
+
+class SQLTimeline:
+    """Обертка execute_wrapper, записывающая запросы со смещением от начала."""
+    def __init__(self, started):
+        self.started = started
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        alias = context['connection'].alias
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'start': round(started - self.started, 6),
+                'duration': round(time.perf_counter() - started, 6),
+                'alias': alias,
+                'sql': sql,
+            })
+
+
+def profile_path(profile_id):
+    return os.path.join(settings.PROFILING_ROOT, profile_id + '.json')
+
+
+def list_profiles():
+    """Сохраненные профили, новые первыми."""
+    try:
+        names = os.listdir(settings.PROFILING_ROOT)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in sorted(names, reverse=True):
+        profile_id, extension = os.path.splitext(name)
+        if extension == '.json' and PROFILE_ID_RE.match(profile_id):
+            profiles.append(profile_id)
+    return profiles
+
+
+def load_profile(profile_id):
+    """Профиль по id или None."""
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    try:
+        with open(profile_path(profile_id)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def enforce_retention():
+    """Удаление старых профилей, пока каталог больше PROFILING_MAX_BYTES."""
+    paths = [profile_path(profile_id) for profile_id in list_profiles()]
+    total = 0
+    for path in paths:
+        try:
+            total += os.path.getsize(path)
+        except FileNotFoundError:
+            continue
+        if total > settings.PROFILING_MAX_BYTES:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+
+
+def save_profile(profile):
+    os.makedirs(settings.PROFILING_ROOT, exist_ok=True)
+    path = profile_path(profile['id'])
+    with open(path + '.tmp', 'w') as file:
+        json.dump(profile, file)
+    os.replace(path + '.tmp', path)
+    enforce_retention()
+
+
+def collapsed_stacks(profile):
+    """Стеки в формате flamegraph.pl / speedscope: 'a;b;c число'."""
+    return ''.join(
+        '{} {}\n'.format(stack, count)
+        for stack, count in sorted(profile['stacks'].items())
+    )
+
+
+def is_admin(user):
+    return bool(
+        user and user.is_authenticated
+        and (user.role == 'admin' or user.is_superuser)
+    )
+
+
+class ProfilingMiddleware:
+    """
+    Профилирование запроса по требованию администратора (заголовок
+    X-Profile или параметр ?profile=1) или случайной выборки запросов
+    с долей PROFILING_SAMPLE_RATE. Профиль - стеки и хронология SQL -
+    сохраняется в PROFILING_ROOT, его id возвращается в X-Profile-Id.
+    Непрофилируемые запросы проходят без дополнительной работы.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+        return self.profile(request)
+
+    def should_profile(self, request):
+        requested = (
+            'HTTP_X_PROFILE' in request.META or 'profile' in request.GET)
+        if requested:
+            return self.is_admin_request(request)
+        rate = settings.PROFILING_SAMPLE_RATE
+        return rate > 0 and random.random() < rate
+
+    def is_admin_request(self, request):
+        if is_admin(getattr(request, 'user', None)):
+            return True
+        try:
+            result = JWTAuthentication().authenticate(request)
+        except (InvalidToken, TokenError):
+            return False
+        return result is not None and is_admin(result[0])
+
+    def profile(self, request):
+        profile_id = '{}-{}'.format(
+            time.strftime('%Y%m%d%H%M%S', time.gmtime()), uuid.uuid4().hex)
+        started = time.perf_counter()
+        timeline = SQLTimeline(started)
+        sampler = StackSampler(threading.get_ident())
+        sampler.start()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timeline))
+                response = self.get_response(request)
+        finally:
+            sampler.stop()
+        save_profile({
+            'id': profile_id,
+            'method': request.method,
+            'path': request.path,
+            'query': request.META.get('QUERY_STRING', ''),
+            'status': response.status_code,
+            'duration': round(time.perf_counter() - started, 6),
+            'interval': settings.PROFILING_INTERVAL,
+            'stacks': dict(sampler.stacks),
+            'sql': timeline.queries,
+        })
+        response['X-Profile-Id'] = profile_id
+        return response
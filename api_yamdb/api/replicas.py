@@ -0,0 +1,120 @@
+import contextvars
+import itertools
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+from reviews import sharding
+
+# Псевдоним базы для чтения в текущем запросе, None - основная база
+read_alias = contextvars.ContextVar('read_alias', default=None)
+
+
+class ReplicaPool:
+    """Выбор реплики по кругу с исключением недоступных на время."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cycle = itertools.cycle(settings.DATABASE_REPLICAS)
+        self.down_until = {}
+
+    def choose(self):
+        for _ in range(len(settings.DATABASE_REPLICAS)):
+            with self.lock:
+                alias = next(self.cycle)
+            if self.down_until.get(alias, 0) > time.monotonic():
+                continue
+            try:
+                connections[alias].ensure_connection()
+            except DatabaseError:
+                self.down_until[alias] = (
+                    time.monotonic() + settings.REPLICA_RETRY_SECONDS)
+                continue
+            return alias
+        return None
+
+
+pool = ReplicaPool() if settings.DATABASE_REPLICAS else None
+
+
+def get_pin_key(request):
+    if request.user and request.user.is_authenticated:
+        return f'replica_pin:user:{request.user.pk}'
+    # адрес клиента за nginx, как у ограничений частоты
+    return 'replica_pin:ip:{}'.format(BaseThrottle().get_ident(request))
+
+
+class ReplicaRouter:
+    """Чтение из реплики, выбранной для текущего запроса."""
+    def db_for_read(self, model, **hints):
+        return read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *settings.DATABASE_REPLICAS}
+        if {obj1._state.db, obj2._state.db} <= databases:
+            return True
+        return None
+
+
+class ReplicaReadMixin:
+    """
+    Безопасные запросы вьюсета читают из реплики. После записи
+    пользователь REPLICA_PIN_SECONDS секунд читает из основной базы и
+    видит свои изменения.
+    """
+    def initial(self, request, *args, **kwargs):
+        self.read_alias_token = None
+        super().initial(request, *args, **kwargs)
+        if (pool is not None and request.method in SAFE_METHODS
+                and not cache.get(get_pin_key(request))):
+            self.read_alias_token = read_alias.set(pool.choose())
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, 'read_alias_token', None)
+        if token is not None:
+            read_alias.reset(token)
+            self.read_alias_token = None
+        if (pool is not None and request.method not in SAFE_METHODS
+                and response.status_code < 400):
+            cache.set(get_pin_key(request), True,
+                      settings.REPLICA_PIN_SECONDS)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class TitleMoving(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Произведение переносится между шардами, повторите позже.'
+    default_code = 'title_moving'
+
+
+class ShardRouteMixin:
+    """
+    Отзывы и комментарии произведения из URL читаются и пишутся в его
+    шарде. Пока произведение переносится, запись недоступна.
+    """
+    def initial(self, request, *args, **kwargs):
+        self.shard_token = None
+        title_id = kwargs.get('title_id')
+        if sharding.enabled() and title_id is not None:
+            if (request.method not in SAFE_METHODS
+                    and sharding.is_moving(title_id)):
+                raise TitleMoving
+            self.shard_token = sharding.current_shard.set(
+                sharding.shard_for(title_id))
+        super().initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, 'shard_token', None)
+        if token is not None:
+            sharding.current_shard.reset(token)
+            self.shard_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
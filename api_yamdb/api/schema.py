@@ -0,0 +1,108 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.shortcuts import render
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+from api.middleware import (
+    SUPPORTED_ENCODINGS, choose_encoding, compress_body
+)
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'yaml': 'application/yaml',
+}
+
+# Схема, загруженная или сгенерированная в этом процессе
+artifacts = {}
+
+
+def generate_schema(schema_format):
+    """
+    Генерация схемы OpenAPI. drf_yasg импортируется только здесь, чтобы
+    воркеры, не отдающие документацию, не тратили время на его импорт.
+    """
+    from drf_yasg import openapi
+    from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    generator = OpenAPISchemaGenerator(openapi.Info(
+        title='API',
+        default_version='v1',
+        description='Документация для приложения YaMDb',
+        contact=openapi.Contact(email='admin@yamdb.ru'),
+        license=openapi.License(name='BSD License'),
+    ))
+    schema = generator.get_schema(request=None, public=True)
+    codec = OpenAPICodecJson if schema_format == 'json' else OpenAPICodecYaml
+    return codec(validators=[]).encode(schema)
+
+
+def schema_path(schema_format, encoding=None):
+    name = f'swagger.{schema_format}'
+    if encoding:
+        name += '.gz' if encoding == 'gzip' else f'.{encoding}'
+    return os.path.join(settings.SCHEMA_ROOT, name)
+
+
+def write_schema(schema_format):
+    """Запись схемы и ее сжатых вариантов в SCHEMA_ROOT."""
+    os.makedirs(settings.SCHEMA_ROOT, exist_ok=True)
+    body = generate_schema(schema_format)
+    variants = {None: body}
+    for encoding in SUPPORTED_ENCODINGS:
+        variants[encoding] = compress_body(body, encoding)
+    for encoding, content in variants.items():
+        with open(schema_path(schema_format, encoding), 'wb') as file:
+            file.write(content)
+    return schema_path(schema_format)
+
+
+def load_artifact(schema_format):
+    """Схема с ETag: из файлов SCHEMA_ROOT или одна генерация на процесс."""
+    if schema_format in artifacts:
+        return artifacts[schema_format]
+    variants = {}
+    for encoding in (None, *SUPPORTED_ENCODINGS):
+        try:
+            with open(schema_path(schema_format, encoding), 'rb') as file:
+                variants[encoding] = file.read()
+        except FileNotFoundError:
+            continue
+    if None not in variants:
+        variants = {None: generate_schema(schema_format)}
+    etag = '"{}"'.format(hashlib.md5(variants[None]).hexdigest())
+    artifacts[schema_format] = (etag, variants)
+    return artifacts[schema_format]
+
+
+def schema_file(request, format):
+    """Отдача готовой схемы /swagger.json и /swagger.yaml."""
+    schema_format = format.lstrip('.')
+    if schema_format not in CONTENT_TYPES:
+        raise Http404
+    etag, variants = load_artifact(schema_format)
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponseNotModified()
+    else:
+        encoding = choose_encoding(request)
+        if encoding is not None and encoding not in variants:
+            variants[encoding] = compress_body(variants[None], encoding)
+        response = HttpResponse(
+            variants[encoding], content_type=CONTENT_TYPES[schema_format])
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    patch_vary_headers(response, ('Accept-Encoding',))
+    patch_cache_control(
+        response, public=True, max_age=settings.SCHEMA_CACHE_TIMEOUT)
+    return response
+
+
+def schema_ui(template_name):
+    """Страница Swagger UI или ReDoc, загружающая готовую схему."""
+    def view(request):
+        return render(request, template_name, {'spec_url': '/swagger.json'})
+    return view
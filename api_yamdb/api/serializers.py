@@ -1,10 +1,13 @@
 from rest_framework import serializers
-from django.db.models import Avg
 from django.conf import settings
+from django.utils.encoding import smart_str
 
+from api.loaders import BatchLoadMixin
+from reviews.histograms import get_mean
+from reviews.lookups import get_lookups
 from reviews.models import (
     Review, Comment, Title, Category,
-    Genre, YaMdbUser
+    Genre, YaMdbUser, SimilarTitle, SCORE_FIELDS
 )
 
 
@@ -24,54 +27,100 @@ class GenreSerializer(serializers.ModelSerializer):
         lookup_field = 'slug'
 
 
+class CachedCategorySerializer(CategorySerializer):
+    """Категория произведения из кэша справочников."""
+    def get_attribute(self, instance):
+        return get_lookups().categories.by_id.get(instance.category_id)
+
+
+class CachedGenreListSerializer(serializers.ListSerializer):
+    """
+    Жанры произведения из кэша справочников по связям GenreTitle,
+    которые вьюсет загружает через prefetch_related.
+    """
+    def get_attribute(self, instance):
+        genres = get_lookups().genres.by_id
+        return sorted(
+            (
+                genres[link.genre_id]
+                for link in instance.genretitle_set.all()
+                if link.genre_id in genres
+            ),
+            key=lambda genre: genre.name
+        )
+
+
+class CachedGenreSerializer(GenreSerializer):
+    class Meta(GenreSerializer.Meta):
+        list_serializer_class = CachedGenreListSerializer
+
+
+class CachedSlugRelatedField(serializers.SlugRelatedField):
+    """Поиск жанра или категории по slug в кэше вместо запроса к базе."""
+    def to_internal_value(self, data):
+        if not isinstance(data, str):
+            self.fail('invalid')
+        obj = get_lookups().table(self.queryset.model).by_slug.get(data)
+        if obj is None:
+            self.fail(
+                'does_not_exist', slug_name=self.slug_field,
+                value=smart_str(data))
+        return obj
+
+
+class BatchedSlugRelatedField(BatchLoadMixin, serializers.SlugRelatedField):
+    """Связанный объект по slug, загружаемый сразу для всей страницы."""
+
+
 class TitleReadSerializer(serializers.ModelSerializer):
     """Сериализатор для модели Title при действии 'list', 'retrieve'."""
-    category = CategorySerializer(read_only=True)
-    genre = GenreSerializer(read_only=True, many=True)
+    category = CachedCategorySerializer(read_only=True)
+    genre = CachedGenreSerializer(read_only=True, many=True)
     rating = serializers.SerializerMethodField()
+    score_histogram = serializers.ReadOnlyField()
 
     class Meta:
-        fields = '__all__'
+        exclude = SCORE_FIELDS
         model = Title
 
     def get_rating(self, obj):
-        return Review.objects.filter(title=obj).aggregate(
-            Avg('score')).get('score__avg')
+        return get_mean(obj.score_histogram)
 
 
 class TitleSerializer(serializers.ModelSerializer):
     """Сериализатор для модели Title."""
-    category = serializers.SlugRelatedField(
+    category = CachedSlugRelatedField(
         queryset=Category.objects.all(),
         slug_field='slug'
     )
-    genre = serializers.SlugRelatedField(
+    genre = CachedSlugRelatedField(
         queryset=Genre.objects.all(),
         slug_field='slug',
         many=True
     )
 
     class Meta:
-        fields = '__all__'
+        exclude = SCORE_FIELDS
         model = Title
 
 
 class ReviewSerializer(serializers.ModelSerializer):
     """Сериализатор для объекта класса Review."""
-    author = serializers.SlugRelatedField(
+    author = BatchedSlugRelatedField(
         read_only=True, slug_field='username'
     )
 
     class Meta:
         fields = '__all__'
         model = Review
-        read_only_fields = ('id', 'title', 'pub_date', 'author',)
+        read_only_fields = (
+            'id', 'title', 'pub_date', 'author', 'comments_count',)
 
     def validate(self, data):
         """
         Валидация на уже существующий отзыв к произведению от одного автора.
         """
-        is_review_exist = Review.objects.filter(
+        is_review_exist = Review.all_objects.filter(
             author=self.context['request'].user,
             title=self.context['view'].kwargs['title_id']
         ).exists()
@@ -83,7 +132,7 @@ class ReviewSerializer(serializers.ModelSerializer):
 
 class CommentSerializer(serializers.ModelSerializer):
     """Сериализатор для объекта класса Comment."""
-    author = serializers.SlugRelatedField(
+    author = BatchedSlugRelatedField(
         read_only=True, slug_field='username'
     )
     title = serializers.PrimaryKeyRelatedField(
@@ -96,6 +145,101 @@ class CommentSerializer(serializers.ModelSerializer):
         model = Comment
 
 
+class FeedTitleSerializer(BatchLoadMixin, serializers.ModelSerializer):
+    """Произведение в ленте автора."""
+    class Meta:
+        model = Title
+        fields = ('id', 'name')
+
+
+class AuthorReviewSerializer(serializers.ModelSerializer):
+    """Отзыв в ленте автора вместе с произведением."""
+    title = FeedTitleSerializer(read_only=True)
+
+    class Meta:
+        model = Review
+        fields = ('id', 'title', 'text', 'score', 'pub_date',
+                  'comments_count')
+
+
+class AuthorCommentSerializer(serializers.ModelSerializer):
+    """Комментарий в ленте автора вместе с отзывом и произведением."""
+    title = FeedTitleSerializer(source='review.title', read_only=True)
+
+    class Meta:
+        model = Comment
+        fields = ('id', 'review', 'title', 'text', 'pub_date')
+
+
+class SimilarTitleSerializer(serializers.ModelSerializer):
+    """Похожее произведение и степень сходства."""
+    id = serializers.IntegerField(source='similar.id')
+    name = serializers.CharField(source='similar.name')
+    year = serializers.IntegerField(source='similar.year')
+
+    class Meta:
+        model = SimilarTitle
+        fields = ('id', 'name', 'year', 'score')
+
+
+class AnalyticsQuerySerializer(serializers.Serializer):
+    """Параметры отчета по снимку отзывов: период [since, until)."""
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=10)
+
+
+class ModerationSerializer(serializers.Serializer):
+    """
+    Условие массовой модерации: id, автор или фрагмент текста, период
+    [since, until). Скрыть можно только отзывы.
+    """
+    action = serializers.ChoiceField(choices=('hide', 'delete'))
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False,
+        allow_empty=False, max_length=settings.MODERATION_MAX_IDS)
+    author = serializers.SlugRelatedField(
+        slug_field='username', queryset=YaMdbUser.objects.all(),
+        required=False)
+    text = serializers.CharField(required=False, min_length=3)
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    dry_run = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if not {'ids', 'author', 'text'} & set(data):
+            raise serializers.ValidationError(
+                'Нужно указать ids, author или text.')
+        if data['action'] == 'hide' and self.context['model'] is Comment:
+            raise serializers.ValidationError(
+                'Комментарии можно только удалить.')
+        if 'since' in data and 'until' in data and (
+                data['since'] >= data['until']):
+            raise serializers.ValidationError(
+                'since должно быть раньше until.')
+        return data
+
+
+class BatchItemSerializer(serializers.Serializer):
+    """Подзапрос пакетного запроса."""
+    method = serializers.ChoiceField(
+        choices=('GET', 'POST', 'PUT', 'PATCH', 'DELETE'), default='GET')
+    path = serializers.RegexField(r'^/api/')
+    body = serializers.JSONField(required=False)
+
+
+class BatchSerializer(serializers.Serializer):
+    """Пакетный запрос."""
+    requests = BatchItemSerializer(many=True, allow_empty=False)
+    parallel = serializers.BooleanField(default=False)
+
+    def validate_requests(self, value):
+        if len(value) > settings.BATCH_MAX_REQUESTS:
+            raise serializers.ValidationError(
+                f'Не более {settings.BATCH_MAX_REQUESTS} подзапросов.')
+        return value
+
+
 # Эндпоинт /singup/
 class UserSingUpSerializer(serializers.ModelSerializer):
     """Сериализатор для объекта класса регистрации."""
@@ -116,8 +260,11 @@ class UserSerializer(serializers.ModelSerializer):
             'first_name',
             'last_name',
             'bio',
-            'role'
+            'role',
+            'reviews_count',
+            'comments_count'
         )
+        read_only_fields = ('reviews_count', 'comments_count')
 
 
 # Эндпоинт /users/me/
@@ -132,10 +279,12 @@ class SelfUserPageSerializer(serializers.ModelSerializer):
             'first_name',
             'last_name',
             'bio',
-            'role'
+            'role',
+            'reviews_count',
+            'comments_count'
         )
         model = YaMdbUser
-        read_only_fields = ('role',)
+        read_only_fields = ('role', 'reviews_count', 'comments_count')
 
 
 # Эндпоинт /token/
@@ -0,0 +1,70 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from api.events import has_subscribers, publish
+from api.middleware import bump_catalog_version
+from api.pagination import bump_count_version
+from api.serializers import CommentSerializer, ReviewSerializer
+from api.slow_queries import install
+from reviews.models import (
+    Category, Comment, Genre, GenreTitle, Review, Title
+)
+from reviews.signals import rows_changed
+
+CATALOG_MODELS = (Title, Genre, Category, GenreTitle, Review)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_catalog(sender, **kwargs):
+    """Сброс кэша каталога при изменении произведений и отзывов."""
+    if sender in CATALOG_MODELS:
+        bump_catalog_version()
+    if sender in (Title, GenreTitle):
+        bump_count_version()
+
+
+@receiver(rows_changed)
+def invalidate_catalog_rows(sender, **kwargs):
+    """
+    Сброс кэша каталога и количеств после массового скрытия или
+    удаления: модерации, удаления из админки, фоновой очистки.
+    """
+    bump_catalog_version()
+    bump_count_version()
+
+
+@receiver(m2m_changed, sender=Title.genre.through)
+def invalidate_catalog_genres(sender, action, **kwargs):
+    """Сброс кэша каталога при изменении жанров произведения."""
+    if action.startswith('post_'):
+        bump_catalog_version()
+        bump_count_version()
+
+
+@receiver(connection_created)
+def install_slow_query_log(sender, connection, **kwargs):
+    """Журнал медленных запросов для каждого нового соединения."""
+    install(connection)
+
+
+@receiver(post_save, sender=Review)
+def publish_review(sender, instance, created, raw=False, **kwargs):
+    """Событие о новом отзыве для потока /titles/{id}/events/."""
+    if created and not raw and has_subscribers(instance.title_id):
+        data = ReviewSerializer(instance).data
+        transaction.on_commit(
+            lambda: publish(instance.title_id, 'review', data))
+
+
+@receiver(post_save, sender=Comment)
+def publish_comment(sender, instance, created, raw=False, **kwargs):
+    """Событие о новом комментарии для потока /titles/{id}/events/."""
+    if not created or raw:
+        return
+    title_id = instance.review.title_id
+    if has_subscribers(title_id):
+        data = CommentSerializer(instance).data
+        transaction.on_commit(lambda: publish(title_id, 'comment', data))
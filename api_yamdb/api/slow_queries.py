@@ -0,0 +1,146 @@
+import contextvars
+import json
+import os
+import random
+import re
+import sys
+import time
+import traceback
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+# Вью или команда, выполняющая запросы в текущем контексте
+current_source = contextvars.ContextVar('current_source', default=None)
+# Флаг выполнения EXPLAIN, чтобы не записывать сами планы
+explaining = contextvars.ContextVar('explaining', default=False)
+
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+\b')
+SPACES_RE = re.compile(r'\s+')
+
+
+def normalize(sql):
+    """Форма запроса: без литералов и с любым числом значений в IN."""
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    sql = STRING_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('N', sql)
+    return SPACES_RE.sub(' ', sql).strip()
+
+
+def find_caller():
+    """Первый кадр стека из кода проекта, а не Django или библиотек."""
+    base_dir = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()[:-1]):
+        if (frame.filename.startswith(base_dir)
+                and not frame.filename.endswith(('slow_queries.py',
+                                                 'profiling.py'))
+                and 'site-packages' not in frame.filename):
+            return '{}:{} in {}'.format(
+                os.path.relpath(frame.filename, base_dir),
+                frame.lineno, frame.name)
+    return None
+
+
+def get_source():
+    source = current_source.get()
+    if source is None and len(sys.argv) > 1 and sys.argv[0].endswith(
+            'manage.py'):
+        return 'command:' + sys.argv[1]
+    return source
+
+
+def explain(connection, sql, params):
+    """План запроса; на PostgreSQL часть планов снимается с ANALYZE."""
+    if connection.vendor == 'postgresql':
+        analyze = random.random() < settings.SLOW_QUERY_ANALYZE_RATE
+        prefix = 'EXPLAIN (ANALYZE, BUFFERS) ' if analyze else 'EXPLAIN '
+    elif connection.vendor == 'sqlite':
+        analyze = False
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        return None, False
+    token = explaining.set(True)
+    try:
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute(prefix + sql, params)
+                rows = cursor.fetchall()
+    except DatabaseError:
+        return None, False
+    finally:
+        explaining.reset(token)
+    if connection.vendor == 'sqlite':
+        return '\n'.join(row[-1] for row in rows), analyze
+    return '\n'.join(row[0] for row in rows), analyze
+
+
+def write_entry(entry):
+    """Добавление записи в журнал с ротацией по размеру."""
+    path = settings.SLOW_QUERY_LOG
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        if os.path.getsize(path) > settings.SLOW_QUERY_LOG_MAX_BYTES:
+            os.replace(path, path + '.1')
+    except FileNotFoundError:
+        pass
+    with open(path, 'a') as file:
+        # даты и прочие значения параметров - строками
+        file.write(json.dumps(entry, default=str) + '\n')
+
+
+def record_slow_queries(execute, sql, params, many, context):
+    """
+    Обертка execute_wrapper: запросы дольше SLOW_QUERY_THRESHOLD
+    записываются в журнал вместе с планом, вью и строкой вызова.
+    """
+    if explaining.get():
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    result = execute(sql, params, many, context)
+    duration = time.perf_counter() - started
+    if duration < settings.SLOW_QUERY_THRESHOLD:
+        return result
+    connection = context['connection']
+    plan, analyzed = None, False
+    if (not many and not connection.needs_rollback
+            and sql.lstrip()[:6].upper() in ('SELECT', 'WITH')):
+        plan, analyzed = explain(connection, sql, params)
+    write_entry({
+        'time': time.time(),
+        'alias': connection.alias,
+        'vendor': connection.vendor,
+        'duration': round(duration, 6),
+        'shape': normalize(sql),
+        'sql': sql,
+        'params': params if settings.SLOW_QUERY_LOG_PARAMS else None,
+        'source': get_source(),
+        'caller': find_caller(),
+        'plan': plan,
+        'analyzed': analyzed,
+    })
+    return result
+
+
+def install(connection):
+    """Постоянная обертка для нового соединения."""
+    if record_slow_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_slow_queries)
+
+
+class SlowQueryMiddleware:
+    """Запоминает вью текущего запроса для журнала медленных запросов."""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = current_source.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            current_source.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        current_source.set('{} {}'.format(
+            request.method, request.resolver_match.view_name))
@@ -0,0 +1,99 @@
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework import throttling
+
+
+class MemoryBucketStore:
+    """
+    Хранилище корзин токенов в памяти процесса, не больше
+    THROTTLE_MEMORY_MAX_KEYS корзин. Корзины упорядочены по времени
+    обновления; при переполнении вытесняется дольше всех не
+    обновлявшаяся - она успела восстановиться больше остальных.
+    """
+    def __init__(self):
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def consume(self, key, capacity, rate, now):
+        """Списывает токен, возвращает 0 или время ожидания в секундах."""
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if len(self.buckets) >= settings.THROTTLE_MEMORY_MAX_KEYS:
+                self.buckets.popitem(last=False)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                return 0
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+
+
+class CacheBucketStore:
+    """
+    Хранилище корзин токенов в общем кэше Django для нескольких
+    процессов и контейнеров. Чтение и запись не атомарны, поэтому при
+    гонке возможен пропуск нескольких лишних запросов.
+    """
+    def __init__(self):
+        self.cache = caches[settings.THROTTLE_CACHE_ALIAS]
+
+    def consume(self, key, capacity, rate, now):
+        tokens, updated = self.cache.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        timeout = int(capacity / rate) + 1
+        if tokens >= 1:
+            self.cache.set(key, (tokens - 1, now), timeout)
+            return 0
+        self.cache.set(key, (tokens, now), timeout)
+        return (1 - tokens) / rate
+
+
+@lru_cache(maxsize=None)
+def get_bucket_store():
+    return import_string(settings.THROTTLE_BACKEND)()
+
+
+class TokenBucketThrottle(throttling.SimpleRateThrottle):
+    """
+    Ограничение частоты запросов корзиной токенов.
+
+    Частота 'N/период' задает емкость корзины N и скорость пополнения
+    N токенов за период, поэтому короткие всплески до N запросов
+    пропускаются без задержки.
+    """
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        self.delay = get_bucket_store().consume(
+            self.key,
+            self.num_requests,
+            self.num_requests / self.duration,
+            self.timer()
+        )
+        return self.delay == 0
+
+    def wait(self):
+        return self.delay
+
+
+class UserTokenBucketThrottle(throttling.UserRateThrottle,
+                              TokenBucketThrottle):
+    """Корзина на пользователя, для анонимов - на IP."""
+
+
+class AnonTokenBucketThrottle(throttling.AnonRateThrottle,
+                              TokenBucketThrottle):
+    """Корзина на IP для неаутентифицированных запросов."""
+
+
+class ScopedTokenBucketThrottle(throttling.ScopedRateThrottle,
+                                TokenBucketThrottle):
+    """Корзина на эндпоинт по атрибуту throttle_scope представления."""
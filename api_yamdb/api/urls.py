@@ -4,7 +4,8 @@ from rest_framework.routers import DefaultRouter
 from api.views import (
     ReviewViewSet, CommentViewSet, TitleViewSet,
     GenreViewSet, CategoriesViewSet, CreateUserAPIView,
-    TokenView, UserViewSet
+    TokenView, UserViewSet, BatchView, ProfileListView, ProfileDetailView,
+    AnalyticsView, ModerationView
 )
 
 
@@ -30,4 +31,14 @@ urlpatterns = [
     path('v1/', include(router.urls)),
     path('v1/auth/token/', TokenView.as_view(),),
     path('v1/auth/signup/', CreateUserAPIView.as_view()),
+    path('v1/batch/', BatchView.as_view(), name='batch'),
+    path('v1/profiles/', ProfileListView.as_view()),
+    path('v1/profiles/<str:profile_id>/', ProfileDetailView.as_view()),
+    path(
+        'v1/profiles/<str:profile_id>/stacks/',
+        ProfileDetailView.as_view(),
+        {'collapsed': True}
+    ),
+    path('v1/analytics/<str:report>/', AnalyticsView.as_view()),
+    path('v1/moderation/<str:target>/', ModerationView.as_view()),
 ]
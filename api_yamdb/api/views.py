@@ -1,6 +1,15 @@
+import calendar
+from contextlib import contextmanager
+
+from django.conf import settings
 from django.core.mail import send_mail
+from django.http import Http404, HttpResponse
 from django.contrib.auth.tokens import default_token_generator
+from django.db import router, transaction
+from django.db.models import OuterRef, Prefetch, Subquery
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
 from django_filters.rest_framework import DjangoFilterBackend
 
 from rest_framework import status, mixins, filters, viewsets
@@ -13,36 +22,173 @@ from rest_framework.permissions import (
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.tokens import AccessToken
 
-from reviews.models import Review, Title, Genre, Category, YaMdbUser
+from reviews import analytics, sharding
+from reviews.deletion import (
+    delete_matching, hide_matching, schedule_deletion
+)
+from reviews.histograms import score_stats
+from reviews.models import (
+    Review, Comment, Title, Genre, Category, YaMdbUser, SimilarTitle,
+    GenreTitle
+)
 from api.permissions import (
     AuthorOrModeratorOrAdminOrReadOnly, IsAuthorOrAndAdmin,
-    IsAuthIsAdminPermission, AdminOrReadOnly
+    IsAuthIsAdminPermission, AdminOrReadOnly, IsModeratorOrAdmin
 )
 from api.serializers import (
     ReviewSerializer, CommentSerializer, GenreSerializer,
     CategorySerializer, UserSerializer, UserSingUpSerializer,
     SelfUserPageSerializer, TokenSerializer,
-    TitleReadSerializer, TitleSerializer
+    TitleReadSerializer, TitleSerializer, BatchSerializer,
+    AnalyticsQuerySerializer, ModerationSerializer,
+    AuthorReviewSerializer, AuthorCommentSerializer, SimilarTitleSerializer
 )
 from api.filter import TitleFilter
+from api.batch import run_batch
+from api.ingestion import get_ingestion
+from api.pagination import AuthorFeedPagination, CachedCountPagination
+from api.profiling import collapsed_stacks, list_profiles, load_profile
+from api.replicas import ReplicaReadMixin, ShardRouteMixin
+
 
+class ScoreStatsMixin:
+    """Эндпоинт {id}/stats/ со статистикой по гистограмме оценок."""
+    @action(detail=True, methods=('GET',))
+    def stats(self, request, *args, **kwargs):
+        return Response(score_stats(self.get_object().score_histogram))
 
-class TitleViewSet(viewsets.ModelViewSet):
+
+class TitleViewSet(ScoreStatsMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     """Вьюсет для работы с моделями произведений"""
     serializer_class = TitleSerializer
     queryset = Title.objects.all()
     permission_classes = (AdminOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = TitleFilter
+    pagination_class = CachedCountPagination
+    throttle_scope = 'titles'
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve'):
+            return queryset
+        # жанры подставляются из кэша справочников по id связей
+        return queryset.prefetch_related(Prefetch(
+            'genretitle_set',
+            queryset=GenreTitle.objects.only('title_id', 'genre_id')
+        ))
 
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve'):
             return TitleReadSerializer
         return TitleSerializer
 
+    def perform_create(self, serializer):
+        # произведение и запись о его шарде появляются одновременно
+        with transaction.atomic():
+            serializer.save()
 
-class GenreViewSet(mixins.CreateModelMixin, mixins.ListModelMixin,
-                   mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    def perform_destroy(self, instance):
+        schedule_deletion(instance)
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Произведение. Параметр include=reviews,comments_preview добавляет
+        первую страницу отзывов и последние комментарии к каждому из них.
+        """
+        include = set(request.query_params.get('include', '').split(','))
+        title = self.get_object()
+        data = self.get_serializer(title).data
+        if include & {'reviews', 'comments_preview'}:
+            data['reviews'] = self.get_reviews_data(
+                title, 'comments_preview' in include)
+        response = Response(data)
+        if 'comments_preview' in include:
+            # комментарии не сбрасывают кэш каталога
+            patch_cache_control(response, no_cache=True)
+        return response
+
+    def get_reviews_data(self, title, with_comments):
+        """Первая страница отзывов фиксированным числом запросов."""
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+        reviews = title.reviews.all()
+        count = reviews.count()
+        page = list(reviews[:page_size])
+        # авторы отзывов и комментариев - одним загрузчиком запроса
+        context = self.get_serializer_context()
+        results = ReviewSerializer(page, many=True, context=context).data
+        if with_comments:
+            previews = get_comments_preview(
+                [review.id for review in page],
+                settings.COMMENTS_PREVIEW_SIZE,
+                reviews.db
+            )
+            # все превью одним списком: авторы загружаются одним запросом
+            comments = [
+                comment for review_comments in previews.values()
+                for comment in review_comments
+            ]
+            data = CommentSerializer(
+                comments, many=True, context=context).data
+            by_review = {}
+            for comment, item in zip(comments, data):
+                by_review.setdefault(comment.review_id, []).append(item)
+            for review in results:
+                review['comments_preview'] = by_review.get(review['id'], [])
+        next_page = None
+        if count > page_size:
+            next_page = self.request.build_absolute_uri(
+                '{}reviews/?page=2'.format(self.request.path))
+        return {'count': count, 'next': next_page, 'results': results}
+
+    # Эндпоинт /titles/{id}/similar/
+    @action(detail=True, methods=('GET',))
+    def similar(self, request, pk=None):
+        """Похожие произведения из таблицы, рассчитанной заранее."""
+        if not pk.isdigit():
+            raise Http404
+        neighbours = SimilarTitle.objects.filter(
+            title_id=pk, similar__is_deleted=False
+        ).select_related('similar').order_by('-score')[
+            :settings.SIMILAR_TITLES_TOP]
+        data = SimilarTitleSerializer(neighbours, many=True).data
+        if not data and not Title.objects.filter(pk=pk).exists():
+            raise Http404
+        return Response(data, status=status.HTTP_200_OK)
+
+
+def get_comments_preview(review_ids, limit, using=None):
+    """Последние limit комментариев к каждому отзыву одним запросом."""
+    latest = Comment.objects.filter(
+        review_id=OuterRef('review_id')
+    ).order_by('-pub_date').values('pk')[:limit]
+    comments = Comment.objects.using(using).filter(
+        review_id__in=review_ids, pk__in=Subquery(latest)
+    )
+    previews = {}
+    for comment in comments:
+        previews.setdefault(comment.review_id, []).append(comment)
+    return previews
+
+
+class LookupWriteMixin:
+    """
+    Изменение жанра или категории и новая версия кэша справочников
+    (сигнал invalidate_lookups) - в одной транзакции.
+    """
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+
+
+class GenreViewSet(LookupWriteMixin, ScoreStatsMixin, ReplicaReadMixin,
+                   mixins.CreateModelMixin,
+                   mixins.ListModelMixin, mixins.DestroyModelMixin,
+                   viewsets.GenericViewSet):
     """Вьюсет для работы с моделями жанров"""
     serializer_class = GenreSerializer
     queryset = Genre.objects.all()
@@ -51,15 +197,17 @@ class GenreViewSet(mixins.CreateModelMixin, mixins.ListModelMixin,
     lookup_field = 'slug'
 
     def get_permissions(self):
-        if self.action == 'list':
+        if self.action in ('list', 'stats'):
             permission_classes = (AllowAny,)
         else:
             permission_classes = (IsAuthIsAdminPermission,)
         return [permission() for permission in permission_classes]
 
 
-class CategoriesViewSet(mixins.CreateModelMixin, mixins.ListModelMixin,
-                        mixins.DestroyModelMixin, viewsets.GenericViewSet):
+class CategoriesViewSet(LookupWriteMixin, ScoreStatsMixin,
+                        ReplicaReadMixin, mixins.CreateModelMixin,
+                        mixins.ListModelMixin, mixins.DestroyModelMixin,
+                        viewsets.GenericViewSet):
     """Вьюсет для работы с моделями категорий"""
     serializer_class = CategorySerializer
     queryset = Category.objects.all()
@@ -68,16 +216,32 @@ class CategoriesViewSet(mixins.CreateModelMixin, mixins.ListModelMixin,
     lookup_field = 'slug'
 
     def get_permissions(self):
-        if self.action == 'list':
+        if self.action in ('list', 'stats'):
             permission_classes = (AllowAny,)
         else:
             permission_classes = (IsAuthIsAdminPermission,)
         return [permission() for permission in permission_classes]
 
 
-class ReviewViewSet(viewsets.ModelViewSet):
+@contextmanager
+def counted_write(model):
+    """
+    Отзыв или комментарий и счетчики из его сигналов в одной транзакции:
+    транзакция шарда с самой записью вложена в транзакцию основной базы
+    со счетчиками пользователя. Шард фиксируется первым; если основная
+    база после этого не зафиксируется, счетчики исправит reconcile_counts.
+    """
+    with transaction.atomic(), transaction.atomic(
+            using=router.db_for_write(model)):
+        yield
+
+
+class ReviewViewSet(ShardRouteMixin, ReplicaReadMixin,
+                    viewsets.ModelViewSet):
     """Вьюсет для работы с моделями отзывов."""
     serializer_class = ReviewSerializer
+    filter_backends = (filters.OrderingFilter,)
+    ordering_fields = ('pub_date', 'score', 'comments_count')
     permission_classes = (
         IsAuthenticatedOrReadOnly,
         AuthorOrModeratorOrAdminOrReadOnly,
@@ -85,6 +249,8 @@ class ReviewViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         '''Функция возвращения всех комментариев поста.'''
+        if getattr(self, 'swagger_fake_view', False):
+            return Review.objects.none()
         title_id = self.kwargs.get("title_id")
         title = get_object_or_404(Title, pk=title_id)
         return title.reviews.all()
@@ -93,11 +259,17 @@ class ReviewViewSet(viewsets.ModelViewSet):
         '''Функция создания нового комментария к посту.'''
         title_id = self.kwargs.get("title_id")
         title = get_object_or_404(Title, pk=title_id)
-        serializer.save(author=self.request.user,
-                        title=title)
+        with counted_write(Review):
+            serializer.save(author=self.request.user,
+                            title=title)
+
+    def perform_destroy(self, instance):
+        with counted_write(Review):
+            schedule_deletion(instance)
 
 
-class CommentViewSet(viewsets.ModelViewSet):
+class CommentViewSet(ShardRouteMixin, ReplicaReadMixin,
+                     viewsets.ModelViewSet):
     """Вьюсет для работы с моделями комментариев."""
     serializer_class = CommentSerializer
     permission_classes = (
@@ -107,6 +279,8 @@ class CommentViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         '''Функция возвращения всех комментариев поста.'''
+        if getattr(self, 'swagger_fake_view', False):
+            return Comment.objects.none()
         title_id = self.kwargs.get("title_id")
         title = get_object_or_404(Title, pk=title_id)
         review_id = self.kwargs.get("review_id")
@@ -125,8 +299,210 @@ class CommentViewSet(viewsets.ModelViewSet):
             Review.objects.filter(title_id=title.id),
             pk=review_id
         )
-        serializer.save(author=self.request.user,
-                        review=review)
+        with counted_write(Comment):
+            serializer.save(author=self.request.user,
+                            review=review)
+
+    def perform_destroy(self, instance):
+        with counted_write(Comment):
+            instance.delete()
+
+    def create(self, request, *args, **kwargs):
+        '''
+        При COMMENT_INGESTION комментарий проверяется и ставится в очередь
+        отложенной записи, ответ 202 содержит временный provisional_id.
+        '''
+        if not settings.COMMENT_INGESTION:
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        title = get_object_or_404(
+            Title.objects.only('id'), pk=self.kwargs.get("title_id"))
+        review = get_object_or_404(
+            Review.objects.filter(title_id=title.id).only('id', 'title_id'),
+            pk=self.kwargs.get("review_id")
+        )
+        data = get_ingestion().enqueue(
+            request.user, review, serializer.validated_data['text'])
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+    def list(self, request, *args, **kwargs):
+        '''Автор сразу видит свои комментарии, еще стоящие в очереди.'''
+        response = super().list(request, *args, **kwargs)
+        if (settings.COMMENT_INGESTION and request.user.is_authenticated
+                and request.query_params.get('page', '1') == '1'):
+            pending = get_ingestion().pending_for(
+                request.user.pk, int(self.kwargs.get("review_id")))
+            if pending:
+                response.data['results'] = (
+                    pending + response.data['results'])
+        return response
+
+
+# Эндпоинт /batch/
+# Принимает список подзапросов и выполняет их в рамках одного запроса
+class BatchView(APIView):
+    """Пакетное выполнение запросов к API."""
+    permission_classes = (AllowAny,)
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = run_batch(
+            request,
+            serializer.validated_data['requests'],
+            serializer.validated_data['parallel']
+        )
+        return Response(results, status=status.HTTP_200_OK)
+
+
+# Эндпоинты /profiles/
+# Просмотр и скачивание профилей, снятых ProfilingMiddleware
+class ProfileListView(APIView):
+    """Список сохраненных профилей запросов."""
+    permission_classes = (IsAuthIsAdminPermission,)
+
+    def get(self, request):
+        profiles = []
+        for profile_id in list_profiles():
+            profile = load_profile(profile_id)
+            if profile is None:
+                continue
+            profiles.append({
+                'id': profile_id,
+                'method': profile['method'],
+                'path': profile['path'],
+                'query': profile['query'],
+                'status': profile['status'],
+                'duration': profile['duration'],
+                'queries': len(profile['sql']),
+            })
+        return Response(profiles, status=status.HTTP_200_OK)
+
+
+class ProfileDetailView(APIView):
+    """Профиль целиком или его стеки в свернутом формате."""
+    permission_classes = (IsAuthIsAdminPermission,)
+
+    def get(self, request, profile_id, collapsed=False):
+        profile = load_profile(profile_id)
+        if profile is None:
+            raise Http404
+        if not collapsed:
+            return Response(profile, status=status.HTTP_200_OK)
+        response = HttpResponse(
+            collapsed_stacks(profile), content_type='text/plain')
+        response['Content-Disposition'] = (
+            'attachment; filename="{}.folded"'.format(profile_id))
+        return response
+
+
+# Эндпоинт /analytics/{report}/
+# Отчеты по столбцовому снимку отзывов без нагрузки на базу
+class AnalyticsView(APIView):
+    """Отчет по снимку: score-by-year, genre-trends, top-authors."""
+    permission_classes = (IsAuthIsAdminPermission,)
+    reports = ('score-by-year', 'genre-trends', 'top-authors')
+
+    def get(self, request, report):
+        if report not in self.reports:
+            raise Http404
+        serializer = AnalyticsQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        snapshot = analytics.open_snapshot() if analytics.np else None
+        if snapshot is None:
+            return Response(
+                {'detail': 'Снимок не выгружен: export_review_snapshot.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        mask = snapshot.review_mask(
+            *(to_epoch(params.get(name)) for name in ('since', 'until')))
+        if report == 'top-authors':
+            results = snapshot.top_authors(mask, params['limit'])
+            add_names(results, 'author_id', 'author', YaMdbUser, 'username')
+        elif report == 'genre-trends':
+            results = snapshot.genre_trends(mask)
+            add_names(results, 'genre_id', 'genre', Genre, 'slug')
+        else:
+            results = snapshot.score_by_year(mask)
+        return Response({
+            'snapshot': {
+                'created': snapshot.meta['created'],
+                'reviews': snapshot.meta['rows']['reviews'],
+            },
+            'results': results,
+        }, status=status.HTTP_200_OK)
+
+
+# Эндпоинт /moderation/{reviews|comments}/
+# Массовое скрытие или удаление спама модератором
+class ModerationView(APIView):
+    """Скрытие или удаление отзывов либо комментариев по условию."""
+    permission_classes = (IsModeratorOrAdmin,)
+    models = {'reviews': Review, 'comments': Comment}
+
+    def post(self, request, target):
+        model = self.models.get(target)
+        if model is None:
+            raise Http404
+        serializer = ModerationSerializer(
+            data=request.data, context={'model': model})
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        queryset = moderation_queryset(model, params)
+        if params['action'] == 'hide':
+            queryset = queryset.filter(is_deleted=False)
+        if params['dry_run']:
+            counts = {target: sum(
+                shard_queryset.count()
+                for shard_queryset in sharding.on_shards(queryset)
+            )}
+        elif params['action'] == 'hide':
+            counts = hide_matching(queryset, settings.MODERATION_BATCH_SIZE)
+        else:
+            counts = delete_matching(
+                queryset, settings.MODERATION_BATCH_SIZE)
+        return Response({
+            'action': params['action'],
+            'dry_run': params['dry_run'],
+            'reviews': counts.get('reviews', 0),
+            'comments': counts.get('comments', 0),
+        }, status=status.HTTP_200_OK)
+
+
+# Условия модерации: параметр -> поиск по полю
+MODERATION_LOOKUPS = {
+    'ids': 'pk__in',
+    'author': 'author',
+    'text': 'text__icontains',
+    'since': 'pub_date__gte',
+    'until': 'pub_date__lt',
+}
+
+
+def moderation_queryset(model, params):
+    """Отзывы или комментарии, подходящие под условие модерации."""
+    return model._base_manager.filter(**{
+        lookup: params[name]
+        for name, lookup in MODERATION_LOOKUPS.items() if name in params
+    })
+
+
+def to_epoch(day):
+    """Начало дня в секундах эпохи (UTC)."""
+    if day is None:
+        return None
+    return calendar.timegm(day.timetuple())
+
+
+def add_names(results, key, name, model, field):
+    """Подстановка имен вместо идентификаторов одним запросом."""
+    names = dict(model._base_manager.filter(
+        pk__in={result[key] for result in results}
+    ).values_list('pk', field))
+    for result in results:
+        result[name] = names.get(result.pop(key))
 
 
 # Эндпоинт /singup/
@@ -135,6 +511,7 @@ class CommentViewSet(viewsets.ModelViewSet):
 class CreateUserAPIView(APIView):
     """Создание нового пользователя."""
     permission_classes = (AllowAny,)
+    throttle_scope = 'signup'
 
     def post(self, request):
         """Регистрация нового пользователя."""
@@ -162,6 +539,7 @@ class CreateUserAPIView(APIView):
         """Генератор пользовательского кода."""
         confirmation_code = default_token_generator.make_token(user)
         user.confirmation_code = confirmation_code
+        user.confirmation_sent = timezone.now()
         user.save()
         return confirmation_code
 
@@ -230,14 +608,69 @@ class TokenView(TokenObtainPairView):
 # Эндпоинт /users/
 class UserViewSet(viewsets.ModelViewSet):
     """Модель пользователя."""
-    queryset = YaMdbUser.objects.all()
+    queryset = YaMdbUser.objects.filter(is_deleted=False)
     lookup_field = 'username'
     serializer_class = UserSerializer
-    filter_backends = (filters.SearchFilter,)
+    filter_backends = (filters.SearchFilter, filters.OrderingFilter)
     search_fields = ('username',)
+    ordering_fields = ('username', 'reviews_count', 'comments_count')
     http_method_names = ('get', 'post', 'patch', 'delete')
     permission_classes = (IsAuthIsAdminPermission,)
 
+    def perform_destroy(self, instance):
+        schedule_deletion(instance)
+
+    def get_author_feed(self, queryset, serializer_class, fields, related):
+        '''
+        Лента записей автора по ключу (pub_date, id) с названием
+        произведения по пути related. При шардировании лента собирается
+        из всех шардов, произведения догружаются из основной базы.
+        '''
+        author = get_object_or_404(
+            YaMdbUser.objects.filter(is_deleted=False).only('id'),
+            username=self.kwargs['username']
+        )
+        queryset = queryset.filter(author=author)
+        path = related.split('__')
+        if sharding.enabled():
+            queryset = sharding.ScatterQuerySet(
+                sharding.on_shards(queryset.only(*fields, path[0])))
+        else:
+            joined = ['__'.join(path[:end]) for end in range(1, len(path) + 1)]
+            queryset = queryset.select_related(related).only(
+                *fields, *joined, f'{related}__name')
+        paginator = AuthorFeedPagination()
+        # без view: сортировка ленты не зависит от OrderingFilter вьюсета
+        page = paginator.paginate_queryset(queryset, self.request)
+        if sharding.enabled():
+            sharding.prefetch_on_shards(page, related)
+        serializer = serializer_class(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    # Эндпоинты /users/{username}/reviews/ и /users/{username}/comments/
+    @action(detail=True, methods=('GET',), permission_classes=(AllowAny,))
+    def reviews(self, request, username=None):
+        """Отзывы пользователя, новые первыми."""
+        return self.get_author_feed(
+            Review.objects.filter(sharding.without_hidden_titles()),
+            AuthorReviewSerializer,
+            ('id', 'text', 'score', 'pub_date', 'comments_count'),
+            'title'
+        )
+
+    @action(detail=True, methods=('GET',), permission_classes=(AllowAny,))
+    def comments(self, request, username=None):
+        """Комментарии пользователя, новые первыми."""
+        return self.get_author_feed(
+            Comment.objects.filter(
+                sharding.without_hidden_titles('review__'),
+                review__is_deleted=False
+            ),
+            AuthorCommentSerializer,
+            ('id', 'text', 'pub_date'),
+            'review__title'
+        )
+
     # Эндпоинт /me/
     @action(
         detail=False,
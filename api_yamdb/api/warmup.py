@@ -0,0 +1,108 @@
+import functools
+import operator
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import F
+from django.urls import get_resolver
+
+from api.middleware import SUPPORTED_ENCODINGS, get_catalog_version
+from api.pagination import get_count_version
+from api.throttling import get_bucket_store
+from reviews.lookups import get_lookups
+from reviews.models import SCORE_FIELDS, Title
+
+
+def import_views():
+    """
+    Импорт всех вьюх, сериализаторов и фильтров через разбор URLconf.
+    В мастер-процессе gunicorn с preload эти модули разделяются
+    воркерами через copy-on-write.
+    """
+    return len(get_resolver().url_patterns)
+
+
+def warm_up():
+    """
+    Подготовка воркера до приема запросов: модули и кэши процесса.
+    Соединения с базами не открываются заранее: они принадлежат потоку,
+    а запросы gthread-воркера обслуживают другие потоки. Соединение,
+    открытое для чтения справочников, сразу закрывается.
+    """
+    import_views()
+    get_catalog_version()
+    get_count_version()
+    get_bucket_store()
+    try:
+        get_lookups()
+    except DatabaseError:
+        # справочники загрузятся при первом запросе
+        pass
+    finally:
+        connections.close_all()
+
+
+def hottest_titles(limit):
+    """Произведения с наибольшим числом отзывов по гистограммам оценок."""
+    total = functools.reduce(
+        operator.add, (F(field) for field in SCORE_FIELDS))
+    return list(Title.objects.annotate(reviews_total=total).order_by(
+        '-reviews_total', 'pk').values_list('pk', flat=True)[:limit])
+
+
+def page_paths(title_ids):
+    paths = ['/api/v1/titles/', '/api/v1/genres/', '/api/v1/categories/']
+    for title_id in title_ids:
+        paths.append(f'/api/v1/titles/{title_id}/')
+        paths.append(f'/api/v1/titles/{title_id}/reviews/')
+    return paths
+
+
+def fetch(base_url, path):
+    """GET через HTTP; ждет, пока сервис не начнет отвечать."""
+    request = urllib.request.Request(
+        base_url.rstrip('/') + path,
+        headers={'Accept-Encoding': ', '.join(SUPPORTED_ENCODINGS)})
+    deadline = time.monotonic() + settings.WARMUP_READY_TIMEOUT
+    while True:
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(1)
+
+
+def warm_pages(paths, base_url=None):
+    """
+    Анонимные GET страниц: ответы каталога попадают в кэш уже в сжатом
+    виде, страницы отзывов - в кэш базы. С base_url запросы идут через
+    HTTP в воркеры сервиса, без него - в этом процессе. При кэше в
+    памяти процесса (CACHES по умолчанию) ответы остаются только у
+    воркеров, которым достались запросы, и прогрев сводится к кэшу
+    базы; всем воркерам он виден при общем кэше (CACHE_BACKEND).
+    Запросы идут с частотой WARMUP_RATE, чтобы не упираться в
+    ограничения частоты. Возвращает число ответов 200.
+    """
+    # django.test не нужен воркерам, которые импортируют этот модуль
+    from django.test import Client
+
+    client = Client(HTTP_ACCEPT_ENCODING=', '.join(SUPPORTED_ENCODINGS))
+    warmed = 0
+    for path in paths:
+        started = time.monotonic()
+        if base_url:
+            status = fetch(base_url, path)
+        else:
+            status = client.get(path).status_code
+        warmed += status == 200
+        time.sleep(max(
+            0, 1 / settings.WARMUP_RATE - (time.monotonic() - started)))
+    return warmed
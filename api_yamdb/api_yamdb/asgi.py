@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api_yamdb.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Поток событий обслуживается отдельно от Django, см. api.events
+from api.events import EventStreamApplication  # noqa: E402
+
+application = EventStreamApplication(django_application)
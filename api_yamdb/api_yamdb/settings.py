@@ -28,7 +28,6 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'drf_yasg',
     'rest_framework',
     'django_filters',
     'reviews.apps.ReviewsConfig',
@@ -37,13 +36,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.LoadSheddingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.profiling.ProfilingMiddleware',
+    'api.slow_queries.SlowQueryMiddleware',
 ]
 
 ROOT_URLCONF = 'api_yamdb.urls'
@@ -52,7 +55,7 @@ TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [TEMPLATES_DIR],
+        'DIRS': [TEMPLATES_DIR, os.path.join(BASE_DIR, 'api_yamdb', 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -77,10 +80,49 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
-        'PORT': os.getenv('DB_PORT')
+        'PORT': os.getenv('DB_PORT'),
+        # Постоянные соединения: поток воркера переиспользует свое
+        # соединение между запросами
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=60)),
     }
 }
 
+# Реплики только для чтения: DB_REPLICA_HOSTS=host1,host2
+# (для SQLite вместо хостов указываются пути к файлам баз)
+for index, replica_host in enumerate(
+        filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), 1):
+    replica = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if replica['ENGINE'].endswith('sqlite3'):
+        replica['NAME'] = replica_host
+    else:
+        replica['HOST'] = replica_host
+    DATABASES[f'replica{index}'] = replica
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+# Шарды отзывов и комментариев по произведению: DB_SHARDS=host1,host2
+# (для SQLite - пути к файлам). Основная база остается первым шардом.
+for index, shard_host in enumerate(
+        filter(None, os.getenv('DB_SHARDS', '').split(',')), 1):
+    shard = dict(DATABASES['default'])
+    if shard['ENGINE'].endswith('sqlite3'):
+        shard['NAME'] = shard_host
+    else:
+        shard['HOST'] = shard_host
+    DATABASES[f'shard{index}'] = shard
+
+DATABASE_SHARDS = [
+    alias for alias in DATABASES if alias not in DATABASE_REPLICAS]
+if len(DATABASE_SHARDS) == 1:
+    DATABASE_SHARDS = []
+DATABASE_ROUTERS = [
+    'reviews.sharding.ShardRouter', 'api.replicas.ReplicaRouter']
+
+# Сколько секунд после записи пользователь читает из основной базы
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', default=5))
+# На сколько секунд исключается недоступная реплика
+REPLICA_RETRY_SECONDS = 30
+
 # Password validation
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -113,6 +155,13 @@ USE_L10N = True
 USE_TZ = True
 
 
+# Начиная с этого числа строк админка показывает оценку из статистики
+# PostgreSQL вместо точного COUNT(*) для списков без фильтров
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+# Сколько удаляемых объектов перечисляет страница подтверждения удаления
+ADMIN_DELETE_PREVIEW = 100
+
+
 # Static files (CSS, JavaScript, Images)
 
 STATIC_URL = '/static/'
@@ -120,17 +169,187 @@ STATIC_URL = '/static/'
 # STATICFILES_DIRS = ((BASE_DIR / 'static/'),)
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
+# Готовая схема OpenAPI (команда generate_schema при сборке образа)
+SCHEMA_ROOT = os.path.join(BASE_DIR, 'schema')
+SCHEMA_CACHE_TIMEOUT = 3600
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# По умолчанию кэш в памяти каждого процесса. Общий для воркеров и
+# контейнеров кэш задается переменными, например
+# CACHE_BACKEND=django.core.cache.backends.memcached.PyMemcacheCache
+# и CACHE_LOCATION=memcached:11211
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', default=''),
+    }
+}
+
+# Сжатие ответов: минимальный размер тела в байтах и степень сжатия
+COMPRESSION_MIN_SIZE = 500
+COMPRESSION_BROTLI_QUALITY = 5
+
+# Кэш ответов каталога для анонимных GET-запросов, в секундах
+CATALOG_CACHE_TIMEOUT = 60
+CATALOG_CACHE_PATTERN = r'^/api/v1/(titles|genres|categories)/(\d+/)?$'
+
+# Число последних комментариев к отзыву в /titles/{id}/?include=...
+COMMENTS_PREVIEW_SIZE = 3
+
+# Пакетные запросы: максимум подзапросов и потоков для их выполнения
+BATCH_MAX_REQUESTS = 50
+BATCH_MAX_WORKERS = 4
+
+# Связанные объекты страницы загружаются пачками не больше этого
+# числа ключей в одном IN (api.loaders.BatchLoadMixin)
+BATCH_LOADER_MAX_KEYS = 500
+
+# Массовая модерация /moderation/: строк в одной транзакции
+# и максимум id в одном запросе
+MODERATION_BATCH_SIZE = 1000
+MODERATION_MAX_IDS = 10000
+
+# Кэш количества произведений по набору фильтров, в секундах, и порог,
+# выше которого берется оценка планировщика PostgreSQL
+COUNT_CACHE_TIMEOUT = 300
+COUNT_ESTIMATE_THRESHOLD = 10000
+
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+    ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'api.throttling.UserTokenBucketThrottle',
+        'api.throttling.AnonTokenBucketThrottle',
+        'api.throttling.ScopedTokenBucketThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'user': '50/second',
+        'anon': '20/second',
+        'signup': '5/minute',
+        'titles': '30/second',
+    },
+    # адрес анонимного клиента - из X-Forwarded-For от nginx
+    'NUM_PROXIES': 1,
 }
 
+# Хранилище корзин токенов: MemoryBucketStore - в памяти процесса,
+# CacheBucketStore - в кэше THROTTLE_CACHE_ALIAS, общем для процессов
+THROTTLE_BACKEND = os.getenv(
+    'THROTTLE_BACKEND', default='api.throttling.MemoryBucketStore')
+THROTTLE_CACHE_ALIAS = 'default'
+THROTTLE_MEMORY_MAX_KEYS = 100000
+
+# Сброс нагрузки на дорогих эндпоинтах: ответ 503 с Retry-After, если
+# запрос провел в очереди nginx дольше MAX_QUEUE_TIME секунд или число
+# одновременных запросов превышает адаптивный предел
+LOAD_SHEDDING_PATTERN = r'^/api/v1/(titles/$|auth/signup/$)'
+LOAD_SHEDDING_MAX_CONCURRENCY = 8
+LOAD_SHEDDING_MIN_CONCURRENCY = 1
+LOAD_SHEDDING_TARGET_LATENCY = 0.5
+LOAD_SHEDDING_MAX_QUEUE_TIME = 1.0
+LOAD_SHEDDING_RETRY_AFTER = 1
+
+# Профилирование запросов: ?profile=1 или заголовок X-Profile от админа,
+# а также случайная доля запросов (0 - выключено)
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', default=0))
+# Период снятия стеков, секунды
+PROFILING_INTERVAL = 0.005
+PROFILING_ROOT = os.path.join(BASE_DIR, 'profiles')
+# Предельный общий размер сохраненных профилей, старые удаляются
+PROFILING_MAX_BYTES = 50 * 1024 * 1024
+
+# Журнал медленных запросов с планами EXPLAIN, порог в секундах
+SLOW_QUERY_THRESHOLD = float(os.getenv('SLOW_QUERY_THRESHOLD', default=0.2))
+# Доля медленных запросов, для которых на PostgreSQL снимается EXPLAIN ANALYZE
+SLOW_QUERY_ANALYZE_RATE = 0.1
+SLOW_QUERY_LOG = os.path.join(BASE_DIR, 'logs', 'slow_queries.jsonl')
+# Параметры запросов в журнале (нужны index_audit --log): в них бывают
+# email, коды подтверждения и тексты пользователей, поэтому по умолчанию
+# не пишутся
+SLOW_QUERY_LOG_PARAMS = os.getenv('SLOW_QUERY_LOG_PARAMS', default='0') == '1'
+# При превышении размера журнал переименовывается в .1
+SLOW_QUERY_LOG_MAX_BYTES = 20 * 1024 * 1024
+
+# Поток новых отзывов и комментариев /titles/{id}/events/ (ASGI, сервис
+# events в infra/docker-compose.yaml). Для нескольких процессов -
+# api.events.CacheBroker и общий кэш CACHE_BACKEND
+EVENTS_BROKER = os.getenv('EVENTS_BROKER', default='api.events.MemoryBroker')
+EVENTS_CACHE_ALIAS = 'default'
+EVENTS_CACHE_TIMEOUT = 3600
+# Сколько последних событий произведения хранится для Last-Event-ID
+EVENTS_BACKLOG_SIZE = 100
+EVENTS_MAX_TITLES = 1000
+EVENTS_POLL_INTERVAL = 1.0
+# Сколько секунд после отключения подписчика события еще публикуются
+EVENTS_SUBSCRIBER_TTL = 60
+# Период комментария-пинга в потоке, секунды
+EVENTS_HEARTBEAT = 15
+# Задержка переподключения клиента, миллисекунды
+EVENTS_RETRY = 3000
+
+# Отложенная запись комментариев: POST отвечает 202, фоновый поток
+# записывает очередь пачками. Журнал в каталоге переживает перезапуск
+COMMENT_INGESTION = os.getenv('COMMENT_INGESTION', default='0') == '1'
+COMMENT_INGESTION_BATCH_SIZE = 500
+COMMENT_INGESTION_FLUSH_INTERVAL = 0.2
+COMMENT_INGESTION_JOURNAL_DIR = os.path.join(BASE_DIR, 'journal')
+
+# Похожие произведения (команда compute_similar_titles)
+SIMILAR_TITLES_TOP = 10
+# Число произведений, для которых сходство считается за один шаг
+SIMILAR_TITLES_BLOCK_SIZE = 128
+# Размер пачки строк потокового курсора при чтении отзывов
+SIMILAR_TITLES_CHUNK_SIZE = 10000
+
+# Статистика оценок /titles/{id}/stats/ по гистограммам
+RATING_PERCENTILES = (10, 25, 75, 90)
+# Вес средней оценки по всем произведениям в байесовском рейтинге:
+# столько отзывов со средней оценкой добавляется к каждому произведению
+RATING_PRIOR_WEIGHT = 10
+RATING_PRIOR_CACHE_TIMEOUT = 300
+
+# Жанры и категории кэшируются в памяти процесса; версия в базе
+# сверяется не чаще раза в указанное число секунд
+LOOKUP_CACHE_CHECK_INTERVAL = 1.0
+
+# Как часто (секунд) процесс сверяет версию карты шардов
+SHARD_MAP_CHECK_INTERVAL = 1.0
+# Диапазон id отзывов и комментариев на шард: id не пересекаются
+# и сохраняются при переносе произведения между шардами
+SHARD_ID_RANGE = 10 ** 12
+# Размер пачки строк при переносе произведения между шардами
+SHARD_MOVE_BATCH_SIZE = 1000
+
+# Столбцовый снимок отзывов для аналитики (команда export_review_snapshot)
+ANALYTICS_ROOT = os.path.join(BASE_DIR, 'analytics')
+ANALYTICS_CHUNK_SIZE = 10000
+
+# Планировщик периодических задач (команда run_scheduler): период
+# проверки расписания и время блокировки задачи по умолчанию, секунды
+SCHEDULER_POLL_INTERVAL = 15
+SCHEDULER_LOCK_TIMEOUT = 3600
+# Отключенные задачи через запятую
+SCHEDULER_DISABLED_JOBS = [
+    name for name in os.getenv(
+        'SCHEDULER_DISABLED_JOBS', default='').split(',') if name
+]
+
+# Прогрев после выкладки (run_scheduler --run warm_up_pages): число
+# самых обсуждаемых произведений и адрес сервиса; без адреса страницы
+# запрашиваются внутри процесса
+WARMUP_TITLES = 50
+WARMUP_BASE_URL = os.getenv('WARMUP_BASE_URL', default='')
+# Запросов в секунду и сколько секунд ждать ответа сервиса
+WARMUP_RATE = 10
+WARMUP_READY_TIMEOUT = 120
+
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 DEFAULT_FROM_EMAIL = 'group56@yamdb.ya'
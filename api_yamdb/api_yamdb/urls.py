@@ -1,21 +1,8 @@
 from django.contrib import admin
 from django.urls import path, include
-from drf_yasg.views import get_schema_view
 from django.conf.urls import url
-from drf_yasg import openapi
-from rest_framework import permissions
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="API",
-        default_version='v1',
-        description="Документация для приложения cats проекта Kittygram",
-        contact=openapi.Contact(email="admin@kittygram.ru"),
-        license=openapi.License(name="BSD License"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+from api.schema import schema_file, schema_ui
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -25,9 +12,9 @@ urlpatterns = [
 
 urlpatterns += [
     url(r'^swagger(?P<format>\.json|\.yaml)$',
-        schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    url(r'^swagger/$', schema_view.with_ui('swagger', cache_timeout=0),
+        schema_file, name='schema-json'),
+    url(r'^swagger/$', schema_ui('swagger.html'),
         name='schema-swagger-ui'),
-    url(r'^redoc/$', schema_view.with_ui('redoc', cache_timeout=0),
+    url(r'^redoc/$', schema_ui('redoc.html'),
         name='schema-redoc'),
 ]
@@ -0,0 +1,68 @@
+"""
+Конфигурация gunicorn для продакшена.
+
+Число воркеров и потоков подбирается по доступным контейнеру CPU и может
+быть переопределено переменными окружения GUNICORN_*.
+"""
+import os
+
+
+def cpu_limit():
+    """Число CPU с учетом affinity и квоты cgroup контейнера."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as file:
+            quota, period = file.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+bind = os.getenv('GUNICORN_BIND', '0:8000')
+workers = env_int('GUNICORN_WORKERS', min(
+    cpu_limit() * 2 + 1, env_int('GUNICORN_MAX_WORKERS', 12)))
+threads = env_int('GUNICORN_THREADS', 2)
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# Приложение загружается в мастере до fork, воркеры делят его память
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+
+# Перезапуск воркеров против утечек памяти, разброс - чтобы не все сразу
+max_requests = env_int('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = env_int('GUNICORN_MAX_REQUESTS_JITTER', 100)
+
+timeout = env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = env_int('GUNICORN_KEEPALIVE', 5)
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+accesslog = os.getenv('GUNICORN_ACCESSLOG', '-')
+errorlog = '-'
+
+
+def when_ready(server):
+    if preload_app:
+        from api.warmup import import_views
+        server.log.info('Предзагружено маршрутов: %s', import_views())
+
+
+def pre_fork(server, worker):
+    # соединения мастера не должны достаться воркерам после fork
+    if preload_app:
+        from django.db import connections
+        connections.close_all()
+
+
+def post_worker_init(worker):
+    from api.warmup import warm_up
+    warm_up()
+    worker.log.info('Воркер %s прогрет', worker.pid)
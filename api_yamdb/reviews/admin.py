@@ -1,12 +1,111 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
 
+from reviews.deletion import (
+    delete_rows, schedule_bulk_deletion, schedule_deletion
+)
+from reviews.lookups import get_lookups
 from reviews.models import (
     YaMdbUser, Title, Genre, Category,
-    GenreTitle, Review, Comment
+    GenreTitle, Review, Comment, DeletionTask, ScheduledJob
 )
 
 
-class UserAdmin(admin.ModelAdmin):
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор, который для больших таблиц без фильтров берет оценку
+    числа строк из статистики PostgreSQL вместо COUNT(*). Без фильтров -
+    значит с условиями базового queryset админки base: скрытые им строки
+    (удаленные пользователи) дочищает фоновая очистка, и на оценку они
+    почти не влияют.
+    """
+    def __init__(self, object_list, per_page, *args, base=None, **kwargs):
+        super().__init__(object_list, per_page, *args, **kwargs)
+        self.base = base
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        model = queryset.model
+        connection = connections[queryset.db]
+        base = self.base
+        if base is None:
+            base = model._default_manager.all()
+        if (connection.vendor == 'postgresql'
+                and queryset.query.where == base.query.where):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class '
+                    'WHERE relname = %s',
+                    [model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] > settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                return row[0]
+        return super().count
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """Админка без полного COUNT(*) на каждой странице списка."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True):
+        return self.paginator(
+            queryset, per_page, orphans, allow_empty_first_page,
+            base=self.get_queryset(request))
+
+
+class CachedRelatedListFilter(admin.RelatedFieldListFilter):
+    """Фильтр списка по жанру или категории из кэша справочников."""
+    def field_choices(self, field, request, model_admin):
+        table = get_lookups().table(field.related_model)
+        return [
+            (obj.pk, str(obj))
+            for obj in sorted(table.by_id.values(), key=lambda obj: obj.name)
+        ]
+
+
+def lookup_name(model, pk, empty):
+    obj = get_lookups().table(model).by_id.get(pk)
+    return empty if obj is None else obj.name
+
+
+class BackgroundDeleteMixin:
+    """Удаление из админки через скрытие и фоновую очистку."""
+    def get_deleted_objects(self, objs, request):
+        """
+        Подтверждение удаления без обхода зависимых записей сборщиком
+        Django: у пользователя или произведения их сотни тысяч, а удалит
+        их фоновая очистка. Перечисляются только сами объекты.
+        """
+        opts = self.model._meta
+        count = objs.count() if isinstance(objs, QuerySet) else len(objs)
+        deleted_objects = [
+            str(obj) for obj in objs[:settings.ADMIN_DELETE_PREVIEW]]
+        if count > len(deleted_objects):
+            deleted_objects.append(
+                'и еще {}'.format(count - len(deleted_objects)))
+        perms_needed = set()
+        if not self.has_delete_permission(request):
+            perms_needed.add(opts.verbose_name)
+        return (
+            deleted_objects, {opts.verbose_name_plural: count},
+            perms_needed, [])
+
+    def delete_model(self, request, obj):
+        schedule_deletion(obj)
+
+    def delete_queryset(self, request, queryset):
+        schedule_bulk_deletion(queryset)
+
+
+class UserAdmin(BackgroundDeleteMixin, ScalableAdmin):
     list_display = (
         'id',
         'username',
@@ -16,13 +115,95 @@ class UserAdmin(admin.ModelAdmin):
         'bio',
         'role',
     )
-    search_fields = ('username',)
+    search_fields = ('=username', '=email')
+    list_filter = ('role', 'is_active')
+    actions = ('deactivate',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).filter(is_deleted=False)
+
+    @admin.action(description='Заблокировать выбранных пользователей')
+    def deactivate(self, request, queryset):
+        queryset.update(is_active=False)
+
+
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'slug')
+    search_fields = ('^name', '=slug')
+
+
+class GenreAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'slug')
+    search_fields = ('^name', '=slug')
+
+
+class TitleAdmin(BackgroundDeleteMixin, ScalableAdmin):
+    list_display = ('id', 'name', 'year', 'category_name')
+    search_fields = ('^name',)
+    list_filter = (('category', CachedRelatedListFilter),)
+    autocomplete_fields = ('category',)
+
+    @admin.display(description='Категория', ordering='category__name')
+    def category_name(self, obj):
+        return lookup_name(
+            Category, obj.category_id, self.get_empty_value_display())
+
+
+class GenreTitleAdmin(ScalableAdmin):
+    list_display = ('id', 'genre_name', 'title')
+    list_select_related = ('title',)
+    search_fields = ('^title__name',)
+    list_filter = (('genre', CachedRelatedListFilter),)
+    autocomplete_fields = ('genre', 'title')
+
+    @admin.display(description='Жанр', ordering='genre__name')
+    def genre_name(self, obj):
+        return lookup_name(
+            Genre, obj.genre_id, self.get_empty_value_display())
+
+
+class ReviewAdmin(BackgroundDeleteMixin, ScalableAdmin):
+    list_display = (
+        'id', 'title', 'author', 'score', 'comments_count', 'pub_date')
+    list_select_related = ('title', 'author')
+    search_fields = ('=author__username',)
+    list_filter = ('pub_date',)
+    autocomplete_fields = ('title', 'author')
+
+
+class CommentAdmin(ScalableAdmin):
+    list_display = ('id', 'review', 'author', 'pub_date')
+    list_select_related = ('review', 'author')
+    search_fields = ('=author__username',)
+    list_filter = ('pub_date',)
+    raw_id_fields = ('review',)
+    autocomplete_fields = ('author',)
+
+    def delete_queryset(self, request, queryset):
+        delete_rows(Comment._base_manager.filter(
+            pk__in=list(queryset.values_list('pk', flat=True))))
+
+
+class DeletionTaskAdmin(admin.ModelAdmin):
+    list_display = ('model', 'object_id', 'created', 'finished',
+                    'deleted_rows')
+    list_filter = ('model',)
+    readonly_fields = list_display
+
+
+class ScheduledJobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'schedule', 'next_run', 'last_started',
+                    'last_duration', 'runs', 'failures', 'locked_by')
+    readonly_fields = list_display + (
+        'locked_until', 'last_finished', 'last_error')
 
 
 admin.site.register(YaMdbUser, UserAdmin)
-admin.site.register(Title)
-admin.site.register(Genre)
-admin.site.register(Category)
-admin.site.register(GenreTitle)
-admin.site.register(Review)
-admin.site.register(Comment)
+admin.site.register(Title, TitleAdmin)
+admin.site.register(Genre, GenreAdmin)
+admin.site.register(Category, CategoryAdmin)
+admin.site.register(GenreTitle, GenreTitleAdmin)
+admin.site.register(Review, ReviewAdmin)
+admin.site.register(Comment, CommentAdmin)
+admin.site.register(DeletionTask, DeletionTaskAdmin)
+admin.site.register(ScheduledJob, ScheduledJobAdmin)
@@ -0,0 +1,316 @@
+import fcntl
+import heapq
+import json
+import os
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from reviews.models import GenreTitle, Review, Title
+from reviews.sharding import on_shards, without_hidden_titles
+
+try:
+    import numpy as np
+except ImportError:  # numpy - необязательная зависимость
+    np = None
+
+META_NAME = 'meta.json'
+
+# Столбцы снимка: таблица -> ((столбец, тип numpy), ...)
+COLUMNS = {
+    'reviews': (
+        ('id', '<i8'), ('title_id', '<i8'), ('author_id', '<i8'),
+        ('score', 'i1'), ('pub_date', '<i8'),
+    ),
+    'titles': (('id', '<i8'), ('year', '<i4'), ('category_id', '<i8')),
+    'genre_titles': (('title_id', '<i8'), ('genre_id', '<i8')),
+}
+
+
+def column_path(root, table, generation, column):
+    return os.path.join(root, f'{table}.{generation}.{column}.bin')
+
+
+def read_meta(root):
+    try:
+        with open(os.path.join(root, META_NAME)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def write_meta(root, meta):
+    """Замена описания снимка целиком: читатели видят старое или новое."""
+    path = os.path.join(root, META_NAME)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(meta, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def append_rows(root, table, generation, rows, chunk_size):
+    """
+    Дописывание строк в файлы столбцов пачками по chunk_size.
+    Возвращает число строк и последнюю строку.
+    """
+    columns = COLUMNS[table]
+    files = [
+        open(column_path(root, table, generation, name), 'ab')
+        for name, _ in columns
+    ]
+    count, last, chunk = 0, None, []
+    try:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                write_chunk(files, columns, chunk)
+                count, last, chunk = count + len(chunk), chunk[-1], []
+        if chunk:
+            write_chunk(files, columns, chunk)
+            count, last = count + len(chunk), chunk[-1]
+        for file in files:
+            file.flush()
+            os.fsync(file.fileno())
+    finally:
+        for file in files:
+            file.close()
+    return count, last
+
+
+def write_chunk(files, columns, chunk):
+    for index, (file, (_, dtype)) in enumerate(zip(files, columns)):
+        np.fromiter(
+            (row[index] for row in chunk), dtype=dtype, count=len(chunk)
+        ).tofile(file)
+
+
+def truncate(root, table, generation, rows):
+    """Отбрасывание хвоста, дописанного прерванным обновлением."""
+    for name, dtype in COLUMNS[table]:
+        path = column_path(root, table, generation, name)
+        size = rows * np.dtype(dtype).itemsize
+        if os.path.getsize(path) > size:
+            os.truncate(path, size)
+
+
+def epoch_rows(rows):
+    """
+    pub_date отзыва в секундах эпохи; исходная дата остается последним
+    полем строки, но в файлы не пишется.
+    """
+    for pk, title_id, author_id, score, pub_date in rows:
+        yield (pk, title_id, author_id, score, int(pub_date.timestamp()),
+               pub_date)
+
+
+def review_rows(after, chunk_size):
+    """
+    Видимые отзывы после (pub_date, id) в порядке добавления;
+    отзывы шардов сливаются в один поток.
+    """
+    reviews = Review.objects.filter(without_hidden_titles())
+    if after is not None:
+        pub_date, pk = after
+        reviews = reviews.filter(
+            Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, pk__gt=pk))
+    return heapq.merge(*(
+        queryset.order_by('pub_date', 'pk').values_list(
+            'pk', 'title_id', 'author_id', 'score', 'pub_date'
+        ).iterator(chunk_size=chunk_size)
+        for queryset in on_shards(reviews)
+    ), key=lambda row: (row[4], row[0]))
+
+
+def export(root, full=False, chunk_size=10000):
+    """
+    Выгрузка снимка отзывов в файлы столбцов. Отзывы дописываются
+    после последнего выгруженного (pub_date, id); измененные и удаленные
+    старые отзывы попадают в снимок только при full. Произведения
+    и жанры небольшие и выгружаются заново в новое поколение файлов.
+    Возвращает описание снимка и число добавленных отзывов.
+    """
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, '.lock'), 'w') as lock:
+        # одновременные выгрузки испортили бы файлы друг друга
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return export_locked(root, full, chunk_size)
+
+
+def export_locked(root, full, chunk_size):
+    previous = read_meta(root)
+    generation = (previous or {}).get('generation', 0) + 1
+    meta = None if full else previous
+    if meta is None:
+        meta = {
+            'reviews_generation': generation,
+            'rows': {'reviews': 0},
+            'last_review': None,
+        }
+        for name, _ in COLUMNS['reviews']:
+            open(column_path(root, 'reviews', generation, name), 'wb').close()
+        after = None
+    else:
+        truncate(root, 'reviews', meta['reviews_generation'],
+                 meta['rows']['reviews'])
+        after = meta['last_review']
+        if after is not None:
+            after = (datetime.fromisoformat(after[0]), after[1])
+    appended, last = append_rows(
+        root, 'reviews', meta['reviews_generation'],
+        epoch_rows(review_rows(after, chunk_size)), chunk_size)
+    if last is not None:
+        meta['last_review'] = [last[-1].isoformat(), last[0]]
+    meta['rows']['reviews'] += appended
+    for table, rows in (
+        ('titles', Title.objects.order_by('pk').values_list(
+            'pk', 'year', Coalesce(F('category_id'), Value(-1)))),
+        ('genre_titles', GenreTitle.objects.filter(
+            title__is_deleted=False).order_by('title_id', 'genre_id')
+            .values_list('title_id', 'genre_id')),
+    ):
+        for name, _ in COLUMNS[table]:
+            open(column_path(root, table, generation, name), 'wb').close()
+        meta['rows'][table], _ = append_rows(
+            root, table, generation, rows.iterator(chunk_size=chunk_size),
+            chunk_size)
+    meta['generation'] = generation
+    meta['created'] = timezone.now().isoformat()
+    write_meta(root, meta)
+    remove_stale(root, meta)
+    return meta, appended
+
+
+def remove_stale(root, meta):
+    """
+    Удаление файлов прежних поколений. Открытые читателями файлы
+    остаются доступны через mmap до закрытия.
+    """
+    current = {
+        column_path(root, table, generation, name)
+        for table, generation in (
+            ('reviews', meta['reviews_generation']),
+            ('titles', meta['generation']),
+            ('genre_titles', meta['generation']),
+        )
+        for name, _ in COLUMNS[table]
+    }
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.endswith('.bin') and path not in current:
+            os.remove(path)
+
+
+class Snapshot:
+    """
+    Снимок, открытый через np.memmap: страницы файлов читаются по
+    требованию и общие для всех процессов. Запросы - векторные
+    группировки numpy без обращения к базе.
+    """
+    def __init__(self, root, meta):
+        self.meta = meta
+        generations = {
+            'reviews': meta['reviews_generation'],
+            'titles': meta['generation'],
+            'genre_titles': meta['generation'],
+        }
+        for table, columns in COLUMNS.items():
+            rows = meta['rows'][table]
+            setattr(self, table, {
+                name: np.memmap(
+                    column_path(root, table, generations[table], name),
+                    dtype=dtype, mode='r', shape=(rows,)
+                ) if rows else np.empty(0, dtype=dtype)
+                for name, dtype in columns
+            })
+
+    def review_mask(self, since=None, until=None):
+        """Отзывы за период [since, until) в секундах эпохи."""
+        pub_date = self.reviews['pub_date']
+        mask = np.ones(len(pub_date), dtype=bool)
+        if since is not None:
+            mask &= pub_date >= since
+        if until is not None:
+            mask &= pub_date < until
+        return mask
+
+    def title_positions(self, mask):
+        """Номера произведений отзывов; отзывы удаленных отбрасываются."""
+        title_ids = self.titles['id']
+        review_titles = self.reviews['title_id'][mask]
+        positions = np.searchsorted(title_ids, review_titles)
+        positions[positions == len(title_ids)] = 0
+        found = np.zeros(len(positions), dtype=bool)
+        if len(title_ids):
+            found = title_ids[positions] == review_titles
+        return positions, found
+
+    def score_by_year(self, mask):
+        """Число отзывов и средняя оценка по году выхода произведения."""
+        positions, found = self.title_positions(mask)
+        years = self.titles['year'][positions[found]]
+        return group_scores(
+            ('year',), (years,), self.reviews['score'][mask][found])
+
+    def genre_trends(self, mask):
+        """Число отзывов и средняя оценка по жанру и году отзыва."""
+        genre_titles = self.genre_titles['title_id']
+        review_titles = self.reviews['title_id'][mask]
+        starts = np.searchsorted(genre_titles, review_titles, 'left')
+        lengths = np.searchsorted(
+            genre_titles, review_titles, 'right') - starts
+        # отзыв повторяется для каждого жанра своего произведения
+        reviews = np.repeat(np.arange(len(review_titles)), lengths)
+        offsets = np.arange(len(reviews)) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths)
+        links = np.repeat(starts, lengths) + offsets
+        years = self.reviews['pub_date'][mask][reviews].astype(
+            'datetime64[s]').astype('datetime64[Y]').astype(int) + 1970
+        return group_scores(
+            ('genre_id', 'year'),
+            (self.genre_titles['genre_id'][links], years),
+            self.reviews['score'][mask][reviews]
+        )
+
+    def top_authors(self, mask, limit):
+        """Самые активные авторы: число отзывов и средняя оценка."""
+        groups = group_scores(
+            ('author_id',), (self.reviews['author_id'][mask],),
+            self.reviews['score'][mask])
+        return sorted(
+            groups, key=lambda group: (-group['count'], group['author_id'])
+        )[:limit]
+
+
+def group_scores(names, keys, scores):
+    """Группировка оценок по одному или нескольким ключам."""
+    if not len(scores):
+        return []
+    unique, inverse = np.unique(
+        np.stack(keys, axis=1), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    counts = np.bincount(inverse, minlength=len(unique))
+    sums = np.bincount(inverse, weights=scores, minlength=len(unique))
+    return [
+        dict(zip(names, (int(value) for value in key)),
+             count=int(count), mean=float(total / count))
+        for key, count, total in zip(unique, counts, sums)
+    ]
+
+
+def open_snapshot(root=None):
+    """Текущий снимок или None, если он еще не выгружен."""
+    root = root or settings.ANALYTICS_ROOT
+    for _ in range(2):
+        meta = read_meta(root)
+        if meta is None:
+            return None
+        try:
+            return Snapshot(root, meta)
+        except FileNotFoundError:
+            # файлы удалены обновлением между чтением описания и открытием
+            continue
+    return None
@@ -0,0 +1,196 @@
+from collections import Counter
+
+from django.db import router, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from reviews.histograms import subtract_reviews
+from reviews.sharding import on_shards
+from reviews.signals import rows_changed
+from reviews.models import (
+    Comment, DeletionTask, GenreTitle, Review, Title, YaMdbUser
+)
+
+MODELS = {'title': Title, 'review': Review, 'user': YaMdbUser}
+
+
+def schedule_deletion(instance):
+    """
+    Скрывает объект сразу и ставит задачу на удаление зависимых записей
+    фоновым обработчиком (команда purge_deleted). Скрытие и задача -
+    в одной транзакции: скрытого объекта без задачи не бывает.
+    """
+    instance.is_deleted = True
+    update_fields = ['is_deleted']
+    if isinstance(instance, YaMdbUser):
+        instance.is_active = False
+        update_fields.append('is_active')
+    names = {model: name for name, model in MODELS.items()}
+    using = router.db_for_write(type(instance), instance=instance)
+    with transaction.atomic(), transaction.atomic(using=using):
+        instance.save(update_fields=update_fields)
+        return DeletionTask.objects.create(
+            model=names[type(instance)], object_id=instance.pk)
+
+
+def schedule_bulk_deletion(queryset):
+    """
+    Скрытие набора объектов двумя запросами вместо сохранения каждого,
+    в одной транзакции с гистограммами оценок и задачами очистки.
+    """
+    model = queryset.model
+    names = {model: name for name, model in MODELS.items()}
+    fields = {'is_deleted': True}
+    if model is YaMdbUser:
+        fields['is_active'] = False
+    with transaction.atomic(), transaction.atomic(using=queryset.db):
+        pks = list(queryset.values_list('pk', flat=True))
+        rows = model._base_manager.using(queryset.db).filter(pk__in=pks)
+        if model is Review:
+            subtract_reviews(rows)
+        rows.update(**fields)
+        DeletionTask.objects.bulk_create(
+            DeletionTask(model=names[model], object_id=pk) for pk in pks)
+    rows_changed.send(sender=model)
+    return len(pks)
+
+
+def decrement(model, field, rows, key, using=None):
+    """Уменьшение счетчиков по сгруппированным удаляемым строкам."""
+    for item in rows.order_by().values(key).annotate(total=Count('pk')):
+        model._base_manager.db_manager(using).filter(pk=item[key]).update(
+            **{field: F(field) - item['total']})
+
+
+def delete_rows(rows):
+    """
+    Удаление комментариев, отзывов без комментариев или связей
+    жанр-произведение одним DELETE без сборщика Django. Счетчики
+    и гистограммы оценок корректируются одним запросом на группу строк.
+    """
+    model = rows.model
+    if model is Comment:
+        decrement(YaMdbUser, 'comments_count', rows, 'author')
+        # отзывы в той же базе, что и комментарии
+        decrement(Review, 'comments_count', rows, 'review', rows.db)
+    elif model is Review:
+        decrement(YaMdbUser, 'reviews_count', rows, 'author')
+        subtract_reviews(rows)
+        # списком: отзывы могут быть в шарде без таблицы произведений
+        Title._base_manager.filter(
+            pk__in=set(rows.values_list('title_id', flat=True)),
+            similar_stale=False
+        ).update(similar_stale=True)
+    rows_changed.send(sender=model)
+    return rows._raw_delete(rows.db)
+
+
+def delete_batch(task, queryset, batch_size):
+    """Удаление одной пачки строк queryset в отдельной транзакции."""
+    with transaction.atomic(), transaction.atomic(using=queryset.db):
+        # блокировка задачи не дает двум обработчикам удалять одну пачку
+        DeletionTask.objects.select_for_update().get(pk=task.pk)
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return 0
+        deleted = delete_rows(queryset.model._base_manager.using(
+            queryset.db).filter(pk__in=pks))
+        DeletionTask.objects.filter(pk=task.pk).update(
+            deleted_rows=F('deleted_rows') + deleted)
+        return deleted
+
+
+def dependents(task):
+    """
+    Наборы зависимых строк в порядке удаления; отзывы и комментарии -
+    в каждом шарде.
+    """
+    object_id = task.object_id
+    comments = Comment.objects.all()
+    reviews = Review._base_manager.all()
+    if task.model == 'title':
+        return (
+            *on_shards(comments.filter(review__title_id=object_id)),
+            *on_shards(reviews.filter(title_id=object_id)),
+            GenreTitle.objects.filter(title_id=object_id),
+        )
+    if task.model == 'review':
+        return on_shards(comments.filter(review_id=object_id))
+    return (
+        *on_shards(comments.filter(author_id=object_id)),
+        *on_shards(comments.filter(review__author_id=object_id)),
+        *on_shards(reviews.filter(author_id=object_id)),
+    )
+
+
+def purge(task, batch_size, progress=None):
+    """Удаление зависимых записей пачками, затем самого объекта."""
+    for queryset in dependents(task):
+        while True:
+            deleted = delete_batch(task, queryset, batch_size)
+            if not deleted:
+                break
+            task.deleted_rows += deleted
+            if progress is not None:
+                progress(task)
+    objects = MODELS[task.model]._base_manager.filter(pk=task.object_id)
+    if task.model == 'review':
+        for queryset in on_shards(objects):
+            queryset.delete()
+    else:
+        objects.delete()
+    task.finished = timezone.now()
+    task.save(update_fields=('finished',))
+
+
+def pk_batches(queryset, batch_size):
+    """Списки pk строк queryset пачками по возрастанию pk."""
+    last_pk = 0
+    while True:
+        pks = list(queryset.filter(pk__gt=last_pk).order_by('pk').values_list(
+            'pk', flat=True)[:batch_size])
+        if not pks:
+            return
+        last_pk = pks[-1]
+        yield pks
+
+
+def hide_matching(queryset, batch_size):
+    """
+    Скрытие видимых отзывов queryset пачками, как при удалении через
+    API: гистограммы оценок меняются той же транзакцией, зависимые
+    записи удалит purge_deleted.
+    """
+    hidden = Counter()
+    for shard_queryset in on_shards(queryset.filter(is_deleted=False)):
+        objects = Review._base_manager.using(shard_queryset.db)
+        for pks in pk_batches(shard_queryset, batch_size):
+            with transaction.atomic(), transaction.atomic(
+                    using=shard_queryset.db):
+                hidden['reviews'] += schedule_bulk_deletion(
+                    objects.filter(pk__in=pks, is_deleted=False))
+    return hidden
+
+
+def delete_matching(queryset, batch_size):
+    """
+    Немедленное удаление отзывов или комментариев queryset пачками.
+    Комментарии удаляемых отзывов, счетчики и гистограммы оценок
+    меняются той же транзакцией, что и пачка.
+    """
+    deleted = Counter()
+    model = queryset.model
+    for shard_queryset in on_shards(queryset):
+        using = shard_queryset.db
+        for pks in pk_batches(shard_queryset, batch_size):
+            with transaction.atomic(), transaction.atomic(using=using):
+                if model is Review:
+                    deleted['comments'] += delete_rows(
+                        Comment.objects.using(using).filter(
+                            review_id__in=pks))
+                    deleted['reviews'] += delete_rows(
+                        model._base_manager.using(using).filter(pk__in=pks))
+                else:
+                    deleted['comments'] += delete_rows(
+                        model._base_manager.using(using).filter(pk__in=pks))
+    return deleted
@@ -0,0 +1,149 @@
+import math
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Greatest
+
+from reviews.models import SCORE_FIELDS, SCORES, Category, Genre, Title
+
+PRIOR_MEAN_KEY = 'ratings:prior_mean'
+
+
+def histogram_updates(deltas):
+    """Выражения UPDATE для {оценка: изменение}, без ухода ниже нуля."""
+    return {
+        f'score_{score}': Greatest(F(f'score_{score}') + delta, 0)
+        for score, delta in deltas.items() if delta
+    }
+
+
+def change_histogram(title_id, deltas):
+    """
+    Изменение гистограмм произведения, его категории и жанров одним
+    UPDATE на таблицу. deltas - {оценка: изменение числа отзывов}.
+    """
+    updates = histogram_updates(deltas)
+    if not updates:
+        return
+    with transaction.atomic():
+        # строка произведения блокируется первой, как и в move_histogram
+        Title._base_manager.filter(pk=title_id).update(**updates)
+        Category.objects.filter(titles__pk=title_id).update(**updates)
+        Genre.objects.filter(title__pk=title_id).update(**updates)
+
+
+def move_histogram(title_id, model, pks, sign):
+    """
+    Добавление (sign=1) или вычитание (sign=-1) гистограммы произведения
+    у категорий или жанров pks при смене категории или жанров.
+    """
+    if not pks:
+        return
+    with transaction.atomic():
+        histogram = Title._base_manager.select_for_update().filter(
+            pk=title_id).values_list(*SCORE_FIELDS).first()
+        if histogram is None:
+            return
+        updates = histogram_updates({
+            score: sign * total for score, total in zip(SCORES, histogram)
+        })
+        if updates:
+            model.objects.filter(pk__in=pks).update(**updates)
+
+
+def review_deltas(old, new):
+    """
+    Изменения гистограмм по состояниям отзыва до и после сохранения.
+    Состояние - (title_id, score, is_deleted) или None; скрытые отзывы
+    в гистограмму не входят.
+    """
+    deltas = defaultdict(Counter)
+    if old is not None and not old[2]:
+        deltas[old[0]][old[1]] -= 1
+    if new is not None and not new[2]:
+        deltas[new[0]][new[1]] += 1
+    return deltas
+
+
+def apply_deltas(deltas):
+    for title_id, title_deltas in deltas.items():
+        change_histogram(title_id, title_deltas)
+
+
+def subtract_reviews(reviews):
+    """Вычитание набора видимых отзывов, сгруппированного по оценкам."""
+    deltas = defaultdict(Counter)
+    for item in reviews.filter(is_deleted=False).order_by().values(
+            'title_id', 'score').annotate(total=Count('pk')):
+        deltas[item['title_id']][item['score']] -= item['total']
+    apply_deltas(deltas)
+
+
+def score_at(histogram, rank):
+    """Оценка с номером rank (с 1) в порядке возрастания."""
+    cumulative = 0
+    for score, total in zip(SCORES, histogram):
+        cumulative += total
+        if cumulative >= rank:
+            return score
+    return SCORES[-1]
+
+
+def percentile(histogram, count, fraction):
+    """Процентиль методом ближайшего ранга."""
+    return score_at(histogram, max(1, math.ceil(fraction * count)))
+
+
+def get_prior_mean():
+    """
+    Средняя оценка по всем произведениям для байесовского рейтинга.
+    Берется из кэша, поэтому не обязана быть точной.
+    """
+    mean = cache.get(PRIOR_MEAN_KEY)
+    if mean is None:
+        totals = Title._base_manager.aggregate(
+            **{field: Sum(field) for field in SCORE_FIELDS})
+        mean = get_mean(
+            [totals[field] or 0 for field in SCORE_FIELDS]) or 0
+        cache.set(PRIOR_MEAN_KEY, mean, settings.RATING_PRIOR_CACHE_TIMEOUT)
+    return mean or None
+
+
+def get_mean(histogram):
+    count = sum(histogram)
+    if not count:
+        return None
+    return sum(
+        score * total for score, total in zip(SCORES, histogram)) / count
+
+
+def score_stats(histogram):
+    """Статистика оценок по гистограмме, без обращения к отзывам."""
+    count = sum(histogram)
+    stats = {
+        'histogram': list(histogram),
+        'count': count,
+        'mean': get_mean(histogram),
+        'median': None,
+        'percentiles': {},
+        'bayesian_rating': None,
+    }
+    if count:
+        stats['median'] = (
+            score_at(histogram, (count + 1) // 2)
+            + score_at(histogram, count // 2 + 1)
+        ) / 2
+        stats['percentiles'] = {
+            str(value): percentile(histogram, count, value / 100)
+            for value in settings.RATING_PERCENTILES
+        }
+    prior = get_prior_mean()
+    if prior is not None:
+        weight = settings.RATING_PRIOR_WEIGHT
+        stats['bayesian_rating'] = (
+            weight * prior + (stats['mean'] or 0) * count
+        ) / (weight + count)
+    return stats
@@ -0,0 +1,44 @@
+import io
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db.models import Q
+from django.utils import timezone
+
+from reviews import analytics, similarity
+from reviews.models import YaMdbUser
+from reviews.scheduler import job
+
+
+@job('30 3 * * *', jitter=600, timeout=6 * 3600)
+def reconcile_counts():
+    call_command('reconcile_counts', stdout=io.StringIO())
+
+
+@job('*/30 * * * *', jitter=120, timeout=3600)
+def compute_similar_titles():
+    """Пересчет произведений с измененными отзывами."""
+    if similarity.np is not None:
+        similarity.compute()
+
+
+@job('*/15 * * * *', jitter=60, timeout=3600)
+def export_review_snapshot():
+    if analytics.np is not None:
+        analytics.export(
+            settings.ANALYTICS_ROOT, chunk_size=settings.ANALYTICS_CHUNK_SIZE)
+
+
+@job('0 4 * * *', jitter=600)
+def purge_confirmation_codes():
+    """
+    Коды подтверждения старше PASSWORD_RESET_TIMEOUT уже не принимаются
+    и не хранятся. Коды без даты отправки выданы до ее появления.
+    """
+    expired = timezone.now() - timedelta(
+        seconds=settings.PASSWORD_RESET_TIMEOUT)
+    YaMdbUser.objects.filter(
+        Q(confirmation_sent__lt=expired) | Q(confirmation_sent__isnull=True),
+        confirmation_code__isnull=False,
+    ).update(confirmation_code=None, confirmation_sent=None)
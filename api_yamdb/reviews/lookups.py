@@ -0,0 +1,96 @@
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+
+from reviews.models import CacheVersion, Category, Genre
+
+VERSION_NAME = 'lookups'
+
+
+def read_version(name=VERSION_NAME):
+    """Версия кэша из основной базы: реплика может отставать."""
+    return CacheVersion.objects.using(DEFAULT_DB_ALIAS).filter(
+        name=name).values_list('version', flat=True).first() or 0
+
+
+def increment_version(name):
+    CacheVersion.objects.get_or_create(name=name)
+    CacheVersion.objects.filter(name=name).update(version=F('version') + 1)
+
+
+def bump_version():
+    """
+    Новая версия справочников. Вызывается в транзакции изменения
+    (вьюсеты жанров и категорий, админка): другие процессы увидят
+    версию вместе с изменением и перечитают таблицы. Вне транзакции
+    версия записывается сразу после изменения.
+    """
+    increment_version(VERSION_NAME)
+    transaction.on_commit(get_lookup_cache().expire)
+
+
+class LookupTable:
+    """Справочник целиком, по id и по slug. Объекты только для чтения."""
+    def __init__(self, objects):
+        self.by_id = {obj.pk: obj for obj in objects}
+        self.by_slug = {obj.slug: obj for obj in objects}
+
+    def matching(self, text):
+        """id объектов, чей slug содержит text без учета регистра."""
+        text = text.lower()
+        return [obj.pk for slug, obj in self.by_slug.items()
+                if text in slug.lower()]
+
+
+class Lookups:
+    def __init__(self, version):
+        self.version = version
+        self.categories = LookupTable(
+            list(Category.objects.using(DEFAULT_DB_ALIAS)))
+        self.genres = LookupTable(list(Genre.objects.using(DEFAULT_DB_ALIAS)))
+
+    def table(self, model):
+        return {Category: self.categories, Genre: self.genres}[model]
+
+
+class LookupCache:
+    """
+    Жанры и категории, загруженные в память процесса целиком.
+    Версия в таблице CacheVersion сверяется не чаще раза в
+    LOOKUP_CACHE_CHECK_INTERVAL секунд; при расхождении таблицы
+    перечитываются. Процесс, изменивший справочник, сверяет версию
+    сразу после commit.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lookups = None
+        self.checked = None
+
+    def get(self):
+        checked = self.checked
+        if (checked is not None and time.monotonic() - checked
+                < settings.LOOKUP_CACHE_CHECK_INTERVAL):
+            return self.lookups
+        with self.lock:
+            # версия читается до таблиц: данные не старее версии
+            version = read_version()
+            if self.lookups is None or self.lookups.version != version:
+                self.lookups = Lookups(version)
+            self.checked = time.monotonic()
+            return self.lookups
+
+    def expire(self):
+        self.checked = None
+
+
+@lru_cache(maxsize=None)
+def get_lookup_cache():
+    return LookupCache()
+
+
+def get_lookups():
+    return get_lookup_cache().get()
@@ -8,6 +8,10 @@ from django.conf import settings
 
 from reviews.services import validate_name_me
 
+# Допустимые оценки отзыва и поля гистограммы оценок
+SCORES = range(1, 11)
+SCORE_FIELDS = tuple(f'score_{score}' for score in SCORES)
+
 ROLE_SET = (
     ('user', 'Пользователь'),
     ('moderator', 'Модератор'),
@@ -68,6 +72,14 @@ class YaMdbUser(AbstractUser):
         blank=False,
         default=None
     )
+    confirmation_sent = models.DateTimeField(
+        'Код отправлен', null=True, blank=True, editable=False)
+    reviews_count = models.PositiveIntegerField(
+        'Число отзывов', default=0, editable=False)
+    comments_count = models.PositiveIntegerField(
+        'Число комментариев', default=0, editable=False)
+    is_deleted = models.BooleanField(
+        'Удален', default=False, editable=False)
 
     USERNAME_FIELD = 'username'
     REQUIRED_FIELDS = ['email']
@@ -83,7 +95,37 @@ class YaMdbUser(AbstractUser):
         return f'{self.first_name} {self.last_name}'
 
 
-class Category(models.Model):
+class SoftDeleteManager(models.Manager):
+    """Менеджер, скрывающий объекты, ожидающие фонового удаления."""
+    def get_queryset(self):
+        return super().get_queryset().filter(is_deleted=False)
+
+
+class ScoreHistogram(models.Model):
+    """
+    Гистограмма оценок: число видимых отзывов с каждой оценкой 1-10.
+    Поддерживается сигналами отзывов, см. reviews/histograms.py.
+    """
+    score_1 = models.PositiveIntegerField(default=0, editable=False)
+    score_2 = models.PositiveIntegerField(default=0, editable=False)
+    score_3 = models.PositiveIntegerField(default=0, editable=False)
+    score_4 = models.PositiveIntegerField(default=0, editable=False)
+    score_5 = models.PositiveIntegerField(default=0, editable=False)
+    score_6 = models.PositiveIntegerField(default=0, editable=False)
+    score_7 = models.PositiveIntegerField(default=0, editable=False)
+    score_8 = models.PositiveIntegerField(default=0, editable=False)
+    score_9 = models.PositiveIntegerField(default=0, editable=False)
+    score_10 = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def score_histogram(self):
+        return [getattr(self, field) for field in SCORE_FIELDS]
+
+
+class Category(ScoreHistogram):
     """Модель категорий."""
     name = models.CharField(max_length=256, verbose_name="Название")
     slug = models.SlugField(
@@ -102,7 +144,7 @@ class Category(models.Model):
         return self.name
 
 
-class Genre(models.Model):
+class Genre(ScoreHistogram):
     """Модель жанров."""
     name = models.CharField(max_length=256, verbose_name='Название')
     slug = models.SlugField(
@@ -121,7 +163,7 @@ class Genre(models.Model):
         return self.name
 
 
-class Title(models.Model):
+class Title(ScoreHistogram):
     """Модель произведений."""
     name = models.CharField(max_length=256)
     year = models.IntegerField(
@@ -134,11 +176,23 @@ class Title(models.Model):
     )
     genre = models.ManyToManyField(Genre, through='GenreTitle')
     rating = models.IntegerField(blank=True, null=True,)
+    is_deleted = models.BooleanField(
+        'Удалено', default=False, db_index=True, editable=False)
+    # Отзывы изменились после последнего расчета похожих произведений
+    similar_stale = models.BooleanField(
+        default=True, db_index=True, editable=False)
+
+    objects = SoftDeleteManager()
+    all_objects = models.Manager()
 
     class Meta:
         ordering = ('name', 'year',)
         verbose_name = 'Произведение'
         verbose_name_plural = 'Произведения'
+        indexes = [
+            # сортировка списка /titles/ по умолчанию
+            models.Index(fields=('name', 'year'), name='title_name_year_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -146,8 +200,9 @@ class Title(models.Model):
 
 class GenreTitle(models.Model):
     """Модель для связи многим ко многим произведения и жанра."""
-    genre = models.ForeignKey(Genre, on_delete=models.CASCADE)
-    title = models.ForeignKey(Title, on_delete=models.CASCADE)
+    # вместо индексов внешних ключей - составные индексы из Meta
+    genre = models.ForeignKey(Genre, on_delete=models.CASCADE, db_index=False)
+    title = models.ForeignKey(Title, on_delete=models.CASCADE, db_index=False)
 
     def __str__(self):
         return f'{self.genre} {self.title}'
@@ -155,26 +210,64 @@ class GenreTitle(models.Model):
     class Meta:
         verbose_name = 'Жанр-произведение'
         verbose_name_plural = 'Жанры-произведения'
+        constraints = [
+            # он же индекс жанров произведения
+            models.UniqueConstraint(
+                fields=('title', 'genre'), name='genre_title_unique'),
+        ]
+        indexes = [
+            # фильтр /titles/?genre= без чтения строк таблицы
+            models.Index(fields=('genre', 'title'), name='genre_title_idx'),
+        ]
 
 
 class Review(models.Model):
     """Модель для отзывов к произведениям."""
+    # вместо индексов внешних ключей - составные индексы из Meta;
+    # авторы и произведения в основной базе, а отзывы могут быть в шарде,
+    # поэтому ограничений внешних ключей в базе нет при любом DB_SHARDS:
+    # схема не меняется при включении шардов
     author = models.ForeignKey(
-        YaMdbUser, on_delete=models.CASCADE, related_name='reviews')
+        YaMdbUser, on_delete=models.CASCADE, related_name='reviews',
+        db_constraint=False, db_index=False)
     title = models.ForeignKey(
-        Title, on_delete=models.CASCADE, related_name='reviews')
+        Title, on_delete=models.CASCADE, related_name='reviews',
+        db_constraint=False, db_index=False)
     text = models.TextField()
     score = models.PositiveSmallIntegerField(
         validators=[MinValueValidator(1), MaxValueValidator(10)]
     )
     pub_date = models.DateTimeField(
         'Дата добавления', auto_now_add=True, db_index=True)
+    comments_count = models.PositiveIntegerField(
+        'Число комментариев', default=0, editable=False)
+    is_deleted = models.BooleanField(
+        'Удален', default=False, db_index=True, editable=False)
+
+    objects = SoftDeleteManager()
+    all_objects = models.Manager()
 
     class Meta:
         verbose_name = 'Отзыв'
         verbose_name_plural = 'Отзывы'
         ordering = ('-pub_date',)
-        unique_together = ['author', 'title']
+        constraints = [
+            # он же индекс проверки отзыва автора в ReviewSerializer
+            models.UniqueConstraint(
+                fields=('author', 'title'), name='review_author_title_unique'),
+        ]
+        indexes = [
+            # отзывы произведения /titles/{id}/reviews/
+            models.Index(
+                fields=('title', '-pub_date'),
+                name='review_title_date_idx'
+            ),
+            # лента отзывов автора /users/{username}/reviews/
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='review_author_feed_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.text[:settings.TEXT_LIMIT]
@@ -182,18 +275,135 @@ class Review(models.Model):
 
 class Comment(models.Model):
     """Модель для комментариев к отзывам."""
+    # вместо индексов внешних ключей - составные индексы из Meta;
+    # автор в основной базе - без ограничения, как у отзыва
     author = models.ForeignKey(
-        YaMdbUser, on_delete=models.CASCADE, related_name='comments')
+        YaMdbUser, on_delete=models.CASCADE, related_name='comments',
+        db_constraint=False, db_index=False)
     review = models.ForeignKey(
-        Review, on_delete=models.CASCADE, related_name='comments')
+        Review, on_delete=models.CASCADE, related_name='comments',
+        db_index=False)
     text = models.TextField()
     pub_date = models.DateTimeField(
         'Дата добавления', auto_now_add=True, db_index=True)
+    # Идентификатор из очереди отложенной записи, защищает от дублей
+    ingest_id = models.UUIDField(
+        null=True, blank=True, unique=True, editable=False)
 
     class Meta:
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
         ordering = ('-pub_date',)
+        indexes = [
+            # комментарии отзыва /titles/{id}/reviews/{id}/comments/
+            models.Index(
+                fields=('review', '-pub_date'),
+                name='comment_review_date_idx'
+            ),
+            # лента комментариев автора /users/{username}/comments/
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='comment_author_feed_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.text[:settings.TEXT_LIMIT]
+
+
+class DeletionTask(models.Model):
+    """Задача фонового удаления объекта вместе с зависимыми записями."""
+    model = models.CharField('Модель', max_length=50)
+    object_id = models.BigIntegerField('Идентификатор объекта')
+    created = models.DateTimeField('Создана', auto_now_add=True)
+    finished = models.DateTimeField('Завершена', null=True, blank=True)
+    deleted_rows = models.PositiveBigIntegerField('Удалено строк', default=0)
+
+    class Meta:
+        verbose_name = 'Задача удаления'
+        verbose_name_plural = 'Задачи удаления'
+        ordering = ('-created',)
+
+    def __str__(self):
+        return f'{self.model} {self.object_id}'
+
+
+class SimilarTitle(models.Model):
+    """Похожее произведение, рассчитанное командой compute_similar_titles."""
+    title = models.ForeignKey(
+        Title, on_delete=models.CASCADE, related_name='similar_titles')
+    similar = models.ForeignKey(
+        Title, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField('Сходство')
+
+    class Meta:
+        verbose_name = 'Похожее произведение'
+        verbose_name_plural = 'Похожие произведения'
+        indexes = [
+            models.Index(fields=('title', '-score'), name='similar_title_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.title_id} {self.similar_id} {self.score:.3f}'
+
+
+class CacheVersion(models.Model):
+    """Версия данных для кэшей внутри процессов, общая для всех воркеров."""
+    name = models.CharField('Кэш', max_length=50, unique=True)
+    version = models.PositiveBigIntegerField('Версия', default=0)
+
+    class Meta:
+        verbose_name = 'Версия кэша'
+        verbose_name_plural = 'Версии кэшей'
+
+    def __str__(self):
+        return f'{self.name} {self.version}'
+
+
+class TitleShard(models.Model):
+    """
+    Шард с отзывами и комментариями произведения. Произведения
+    без записи хранят их в основной базе.
+    """
+    title = models.OneToOneField(
+        Title, on_delete=models.CASCADE, primary_key=True,
+        related_name='shard')
+    alias = models.CharField('База', max_length=50)
+    moving = models.BooleanField('Переносится', default=False)
+
+    class Meta:
+        verbose_name = 'Шард произведения'
+        verbose_name_plural = 'Шарды произведений'
+
+    def __str__(self):
+        return f'{self.title_id} {self.alias}'
+
+
+class ScheduledJob(models.Model):
+    """
+    Состояние периодической задачи планировщика run_scheduler: время
+    следующего запуска, блокировка выполняющего процесса и метрики.
+    """
+    name = models.CharField('Задача', max_length=100, unique=True)
+    schedule = models.CharField('Расписание', max_length=100)
+    next_run = models.DateTimeField(
+        'Следующий запуск', null=True, blank=True)
+    locked_until = models.DateTimeField(
+        'Занята до', null=True, blank=True)
+    locked_by = models.CharField('Процесс', max_length=200, blank=True)
+    last_started = models.DateTimeField('Запущена', null=True, blank=True)
+    last_finished = models.DateTimeField(
+        'Завершена', null=True, blank=True)
+    last_duration = models.FloatField(
+        'Длительность, с', null=True, blank=True)
+    last_error = models.TextField('Ошибка', blank=True)
+    runs = models.PositiveIntegerField('Запусков', default=0)
+    failures = models.PositiveIntegerField('Ошибок', default=0)
+
+    class Meta:
+        verbose_name = 'Периодическая задача'
+        verbose_name_plural = 'Периодические задачи'
+        ordering = ('name',)
+
+    def __str__(self):
+        return self.name
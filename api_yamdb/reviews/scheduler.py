@@ -0,0 +1,222 @@
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from reviews.models import ScheduledJob
+
+logger = logging.getLogger(__name__)
+
+ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+}
+# Поля расписания: (наименьшее, наибольшее значение)
+FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+# Зарегистрированные задачи: имя -> Job
+JOBS = {}
+
+
+def parse_field(text, low, high):
+    """
+    Значения поля расписания cron: *, число, диапазон a-b, шаг /n
+    и списки через запятую.
+    """
+    values = set()
+    for part in text.split(','):
+        expression, _, step = part.partition('/')
+        step = int(step) if step else 1
+        if expression == '*':
+            start, end = low, high
+        elif '-' in expression:
+            start, end = (int(value) for value in expression.split('-', 1))
+        else:
+            start = int(expression)
+            end = high if part != expression else start
+        if step < 1 or not low <= start <= end <= high:
+            raise ValueError(f'Недопустимое поле расписания: {text}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class Cron:
+    """Расписание в формате cron: минута, час, день, месяц, день недели."""
+    def __init__(self, schedule):
+        fields = ALIASES.get(schedule, schedule).split()
+        if len(fields) != len(FIELDS):
+            raise ValueError(f'Расписание из пяти полей: {schedule}')
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            parse_field(field, low, high)
+            for field, (low, high) in zip(fields, FIELDS))
+        # 0 и 7 - воскресенье
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def day_matches(self, moment):
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        # как в cron: заданы оба поля - достаточно одного
+        return day or weekday
+
+    def next_after(self, moment):
+        """Ближайшее время по расписанию позже moment, в UTC."""
+        moment = moment.astimezone(dt_timezone.utc).replace(
+            second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1) + timedelta(days=32)).replace(
+                    day=1, hour=0, minute=0)
+            elif not self.day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError('Расписание не срабатывает.')
+
+
+class Job:
+    """
+    Периодическая задача. jitter - случайная задержка запуска до
+    указанного числа секунд, чтобы задачи разных установок не совпадали
+    по времени; timeout - время блокировки задачи выполняющим процессом.
+    Задача без расписания запускается только командой run_scheduler --run.
+    """
+    def __init__(self, name, func, schedule, jitter=0, timeout=None):
+        self.name = name
+        self.func = func
+        self.schedule = schedule
+        self.cron = Cron(schedule) if schedule else None
+        self.jitter = jitter
+        self.timeout = timeout or settings.SCHEDULER_LOCK_TIMEOUT
+
+    def next_run(self, after):
+        if self.cron is None:
+            return None
+        return self.cron.next_after(after) + timedelta(
+            seconds=random.uniform(0, self.jitter))
+
+
+def job(schedule, name=None, jitter=0, timeout=None):
+    """Регистрация функции как периодической задачи."""
+    def register(func):
+        job_name = name or func.__name__
+        JOBS[job_name] = Job(job_name, func, schedule, jitter, timeout)
+        return func
+    return register
+
+
+def load_jobs():
+    """Задачи из модулей jobs приложений, кроме SCHEDULER_DISABLED_JOBS."""
+    autodiscover_modules('jobs')
+    return {
+        name: job for name, job in JOBS.items()
+        if name not in settings.SCHEDULER_DISABLED_JOBS
+    }
+
+
+class Scheduler:
+    """
+    Выполнение задач по расписанию в нескольких контейнерах сразу.
+    Задачу запускает процесс, которому удалось одним UPDATE занять ее
+    запись в ScheduledJob: запуск наступил, а блокировка свободна или
+    просрочена. Время, длительность, ошибка и число запусков
+    сохраняются в той же записи.
+    """
+    def __init__(self, jobs, report=None):
+        self.jobs = jobs
+        self.report = report
+        self.worker = f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = threading.Event()
+
+    def sync(self):
+        """Записи задач; при смене расписания запуск пересчитывается."""
+        now = timezone.now()
+        for job in self.jobs.values():
+            state, created = ScheduledJob.objects.get_or_create(
+                name=job.name, defaults={
+                    'schedule': job.schedule or '',
+                    'next_run': job.next_run(now),
+                })
+            if not created and state.schedule != (job.schedule or ''):
+                ScheduledJob.objects.filter(pk=state.pk).update(
+                    schedule=job.schedule or '', next_run=job.next_run(now))
+
+    def acquire(self, job, force=False):
+        now = timezone.now()
+        rows = ScheduledJob.objects.filter(name=job.name).filter(
+            Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+        fields = {
+            'locked_until': now + timedelta(seconds=job.timeout),
+            'locked_by': self.worker,
+            'last_started': now,
+        }
+        if not force:
+            rows = rows.filter(next_run__lte=now)
+            # пропущенные запуски не наверстываются
+            fields['next_run'] = job.next_run(now)
+        return rows.update(**fields) == 1
+
+    def run(self, job):
+        """Выполнение занятой задачи; возвращает True без ошибки."""
+        started = time.monotonic()
+        error = ''
+        try:
+            job.func()
+        except Exception:
+            error = traceback.format_exc()
+            logger.exception('Задача %s завершилась ошибкой', job.name)
+        finally:
+            close_old_connections()
+        duration = time.monotonic() - started
+        ScheduledJob.objects.filter(
+            name=job.name, locked_by=self.worker
+        ).update(
+            locked_until=None, locked_by='', last_finished=timezone.now(),
+            last_duration=duration, last_error=error,
+            runs=F('runs') + 1, failures=F('failures') + int(bool(error)))
+        logger.info('Задача %s выполнена за %.2f с', job.name, duration)
+        if self.report is not None:
+            self.report(job, duration, error)
+        return not error
+
+    def run_pending(self):
+        """Запуск наступивших задач; возвращает число запущенных."""
+        count = 0
+        for job in self.jobs.values():
+            if self.stopping.is_set():
+                break
+            if self.acquire(job):
+                self.run(job)
+                count += 1
+        return count
+
+    def loop(self, interval):
+        """Проверка задач раз в interval секунд до stopping."""
+        self.sync()
+        while not self.stopping.is_set():
+            close_old_connections()
+            try:
+                self.run_pending()
+            except DatabaseError:
+                # база недоступна: повторим на следующей проверке
+                logger.exception('Планировщик не смог проверить задачи')
+            self.stopping.wait(interval)
@@ -0,0 +1,353 @@
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max, Q, prefetch_related_objects
+
+from reviews.lookups import increment_version, read_version
+from reviews.models import Comment, Review, Title, TitleShard
+
+SHARDED_MODELS = (Review, Comment)
+VERSION_NAME = 'shards'
+
+# Шард отзывов и комментариев произведения текущего запроса
+current_shard = contextvars.ContextVar('current_shard', default=None)
+
+
+def enabled():
+    return bool(settings.DATABASE_SHARDS)
+
+
+def shard_aliases():
+    return settings.DATABASE_SHARDS or [DEFAULT_DB_ALIAS]
+
+
+def choose_shard(title_id):
+    """Шард нового произведения."""
+    return settings.DATABASE_SHARDS[title_id % len(settings.DATABASE_SHARDS)]
+
+
+class ShardMap:
+    """
+    Карта произведение -> (шард, переносится ли), загруженная в память
+    процесса. Версия сверяется не чаще раза в SHARD_MAP_CHECK_INTERVAL
+    секунд; при расхождении карта перечитывается. Новые произведения
+    дочитываются из базы по одному при первом обращении.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.placements = {}
+        self.checked = None
+
+    def refresh(self):
+        checked = self.checked
+        if (checked is not None and time.monotonic() - checked
+                < settings.SHARD_MAP_CHECK_INTERVAL):
+            return
+        with self.lock:
+            version = read_version(VERSION_NAME)
+            if version != self.version:
+                self.placements = {
+                    title_id: (alias, moving)
+                    for title_id, alias, moving in TitleShard.objects.using(
+                        DEFAULT_DB_ALIAS).values_list(
+                            'title_id', 'alias', 'moving')
+                }
+                self.version = version
+            self.checked = time.monotonic()
+
+    def get(self, title_id):
+        self.refresh()
+        placement = self.placements.get(title_id)
+        if placement is not None:
+            return placement
+        row = Title._base_manager.using(DEFAULT_DB_ALIAS).filter(
+            pk=title_id).values_list('shard__alias', 'shard__moving').first()
+        if row is None:
+            # произведения еще нет: ответ не запоминается
+            return DEFAULT_DB_ALIAS, False
+        # произведения без записи хранятся в основной базе
+        placement = (row[0] or DEFAULT_DB_ALIAS, bool(row[1]))
+        self.placements[title_id] = placement
+        return placement
+
+    def expire(self):
+        self.checked = None
+
+
+@lru_cache(maxsize=None)
+def get_shard_map():
+    return ShardMap()
+
+
+def shard_for(title_id):
+    """Шард с отзывами и комментариями произведения."""
+    if not enabled() or title_id is None:
+        return DEFAULT_DB_ALIAS
+    return get_shard_map().get(int(title_id))[0]
+
+
+def is_moving(title_id):
+    return enabled() and get_shard_map().get(int(title_id))[1]
+
+
+def assign_shard(title):
+    """Запись о шарде нового произведения."""
+    TitleShard.objects.get_or_create(
+        title_id=title.pk, defaults={'alias': choose_shard(title.pk)})
+
+
+def bump_version():
+    """Новая версия карты: процессы перечитают ее после commit."""
+    increment_version(VERSION_NAME)
+    transaction.on_commit(get_shard_map().expire)
+
+
+def instance_shard(instance):
+    """
+    Шард по объекту-подсказке. У несохраненных отзывов и комментариев
+    _state.db мог заполнить дескриптор внешнего ключа на автора,
+    поэтому шард берется по произведению.
+    """
+    if isinstance(instance, Title):
+        return shard_for(instance.pk)
+    if isinstance(instance, Review):
+        if instance._state.adding:
+            return shard_for(instance.title_id)
+        return instance._state.db
+    if isinstance(instance, Comment):
+        review = Comment.review.field.get_cached_value(instance, None)
+        if instance._state.adding and review is not None:
+            return instance_shard(review)
+        return instance._state.db
+    return None
+
+
+class ShardRouter:
+    """
+    Отзывы и комментарии - в шарде произведения: из запроса к
+    /titles/{id}/... или по объекту-подсказке. Объекты остальных моделей,
+    связанные с записями шарда, читаются из основной базы.
+    """
+    def route(self, model, hints):
+        if not enabled():
+            return None
+        instance = hints.get('instance')
+        if model in SHARDED_MODELS:
+            alias = current_shard.get()
+            if alias is None and instance is not None:
+                return instance_shard(instance)
+            return alias
+        if (instance is not None and instance._state.db is not None
+                and instance._state.db != DEFAULT_DB_ALIAS
+                and instance._state.db in settings.DATABASE_SHARDS):
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self.route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self.route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if enabled() and {obj1._state.db, obj2._state.db} <= set(
+                settings.DATABASES):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS or db not in settings.DATABASE_SHARDS:
+            return None
+        # в остальных шардах только таблицы отзывов и комментариев
+        return app_label == 'reviews' and model_name in ('review', 'comment')
+
+
+def reserve_ids(alias):
+    """
+    Начало последовательностей id отзывов и комментариев шарда с
+    номером n - n * SHARD_ID_RANGE: id не пересекаются между шардами.
+    """
+    start = shard_aliases().index(alias) * settings.SHARD_ID_RANGE
+    if not start:
+        return
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        for model in SHARDED_MODELS:
+            table = model._meta.db_table
+            last = model._base_manager.using(alias).aggregate(
+                last=Max('pk'))['last'] or 0
+            if last >= start:
+                continue
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    "SELECT setval(pg_get_serial_sequence(%s, 'id'), %s)",
+                    [table, start])
+            elif connection.vendor == 'sqlite':
+                cursor.execute(
+                    'DELETE FROM sqlite_sequence WHERE name = %s', [table])
+                cursor.execute(
+                    'INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)',
+                    [table, start])
+
+
+def on_shards(queryset):
+    """Копии queryset для каждого шарда; без шардов - сам queryset."""
+    if not enabled():
+        return [queryset]
+    return [queryset.using(alias) for alias in settings.DATABASE_SHARDS]
+
+
+def get_on_shards(queryset):
+    """Объект из первого шарда, где он найден."""
+    for shard_queryset in on_shards(queryset):
+        instance = shard_queryset.first()
+        if instance is not None:
+            return instance
+    raise queryset.model.DoesNotExist
+
+
+def prefetch_on_shards(instances, *lookups):
+    """
+    prefetch_related_objects отдельно для записей каждого шарда:
+    связанные записи ищутся в базе первой записи группы.
+    """
+    groups = defaultdict(list)
+    for instance in instances:
+        groups[instance._state.db].append(instance)
+    for group in groups.values():
+        prefetch_related_objects(group, *lookups)
+
+
+def hidden_title_ids():
+    return list(Title._base_manager.using(DEFAULT_DB_ALIAS).filter(
+        is_deleted=True).values_list('pk', flat=True))
+
+
+def without_hidden_titles(prefix=''):
+    """
+    Условие на отзывы не удаленных произведений. В шарде таблицы
+    произведений нет: удаленные исключаются списком id.
+    """
+    if enabled():
+        return ~Q(**{f'{prefix}title_id__in': hidden_title_ids()})
+    return Q(**{f'{prefix}title__is_deleted': False})
+
+
+class ScatterQuerySet:
+    """
+    Один запрос ко всем шардам с объединением результатов по ordering.
+    Поддерживаются filter, order_by и срез - этого достаточно
+    CursorPagination. Шарды опрашиваются по очереди.
+    """
+    def __init__(self, querysets, ordering=()):
+        self.querysets = querysets
+        self.ordering = ordering
+        self.model = querysets[0].model
+
+    def filter(self, *args, **kwargs):
+        return ScatterQuerySet(
+            [queryset.filter(*args, **kwargs) for queryset in self.querysets],
+            self.ordering)
+
+    def order_by(self, *ordering):
+        return ScatterQuerySet(
+            [queryset.order_by(*ordering) for queryset in self.querysets],
+            ordering)
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step is not None:
+            raise TypeError('Поддерживается только срез без шага.')
+        descending = {field.startswith('-') for field in self.ordering}
+        if len(descending) > 1:
+            raise ValueError('Направления сортировки должны совпадать.')
+        key = attrgetter(*(field.lstrip('-') for field in self.ordering))
+        parts = [list(queryset[:item.stop]) for queryset in self.querysets]
+        merged = heapq.merge(*parts, key=key, reverse=descending == {True})
+        return list(itertools.islice(merged, item.start, item.stop))
+
+
+def stored_shard(title_id):
+    """Шард произведения по записи в основной базе, без кэша процесса."""
+    return TitleShard.objects.using(DEFAULT_DB_ALIAS).filter(
+        title_id=title_id).values_list('alias', flat=True).first(
+    ) or DEFAULT_DB_ALIAS
+
+
+def set_placement(title_id, alias, moving):
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        TitleShard.objects.using(DEFAULT_DB_ALIAS).update_or_create(
+            title_id=title_id, defaults={'alias': alias, 'moving': moving})
+        bump_version()
+
+
+def copy_rows(queryset, target, batch_size):
+    """
+    Копирование строк в другой шард с теми же id и датами добавления.
+    Уже скопированные строки пропускаются, поэтому копирование можно
+    повторить.
+    """
+    model = queryset.model
+    fields = model._meta.local_concrete_fields
+    copied = 0
+    last_pk = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk).order_by('pk')[
+            :batch_size])
+        if not rows:
+            return copied
+        last_pk = rows[-1].pk
+        size = connections[target].ops.bulk_batch_size(fields, rows)
+        for start in range(0, len(rows), size):
+            # raw: auto_now_add не заменяет дату добавления
+            model._base_manager.using(target)._insert(
+                rows[start:start + size], fields=fields, using=target,
+                raw=True, ignore_conflicts=True)
+        copied += len(rows)
+
+
+def title_rows(title_id, alias):
+    return (
+        Review._base_manager.using(alias).filter(title_id=title_id),
+        Comment.objects.using(alias).filter(review__title_id=title_id),
+    )
+
+
+def move_title(title_id, target, batch_size, wait):
+    """
+    Перенос отзывов и комментариев произведения в шард target.
+    Сначала запись помечается переносом, и после wait() процессы
+    перестают писать в исходный шард; строки копируются, карта
+    переключается на target, и после еще одного wait(), когда из
+    исходного шарда больше не читают, исходные строки удаляются.
+    Повторно после переключения строки не копируются: иначе вернулись
+    бы удаленные за это время в target. Возвращает число перенесенных
+    строк.
+    """
+    source = stored_shard(title_id)
+    if source == target:
+        return 0
+    set_placement(title_id, source, True)
+    wait()
+    reviews, comments = title_rows(title_id, source)
+    try:
+        with transaction.atomic(using=target):
+            copied = (copy_rows(reviews, target, batch_size)
+                      + copy_rows(comments, target, batch_size))
+    except Exception:
+        set_placement(title_id, source, False)
+        raise
+    set_placement(title_id, target, False)
+    wait()
+    with transaction.atomic(using=source):
+        comments._raw_delete(source)
+        reviews._raw_delete(source)
+    return copied
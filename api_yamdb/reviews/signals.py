@@ -0,0 +1,168 @@
+from django.conf import settings
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_migrate, post_save, pre_save
+)
+from django.dispatch import Signal, receiver
+
+from reviews.histograms import apply_deltas, move_histogram, review_deltas
+from reviews.lookups import bump_version
+from reviews import sharding
+from reviews.models import (
+    Category, Comment, Genre, GenreTitle, Review, Title, YaMdbUser
+)
+
+# Поля отзыва, от которых зависят гистограммы оценок
+HISTOGRAM_REVIEW_FIELDS = {'title', 'title_id', 'score', 'is_deleted'}
+
+# Строки модели sender скрыты или удалены одним запросом, без post_save
+# и post_delete для каждой строки
+rows_changed = Signal()
+
+
+# Счетчики отзывов и комментариев меняются в сигналах одиночных записей.
+# Транзакцию вместе с записью открывает вызывающий код (counted_write во
+# вьюсетах); вне ее счетчик может разойтись с таблицей до ближайшей
+# сверки reconcile_counts. Из-за получателей post_delete сборщик Django
+# удаляет отзывы и комментарии по одному, без быстрого удаления, поэтому
+# массовое удаление идет через deletion.delete_rows: один DELETE и
+# счетчики одним запросом на группу строк.
+def change_counter(model, pk, field, delta, using=None):
+    """Атомарное изменение счетчика одним UPDATE, без ухода ниже нуля."""
+    model._base_manager.db_manager(using).filter(
+        pk=pk, **{f'{field}__gte': -delta}).update(**{field: F(field) + delta})
+
+
+@receiver(post_save, sender=Review)
+def review_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_counter(YaMdbUser, instance.author_id, 'reviews_count', 1)
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    change_counter(YaMdbUser, instance.author_id, 'reviews_count', -1)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, raw=False, using=None,
+                    **kwargs):
+    if created and not raw:
+        # отзыв в том же шарде, что и комментарий
+        change_counter(Review, instance.review_id, 'comments_count', 1, using)
+        change_counter(YaMdbUser, instance.author_id, 'comments_count', 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, using=None, **kwargs):
+    change_counter(Review, instance.review_id, 'comments_count', -1, using)
+    change_counter(YaMdbUser, instance.author_id, 'comments_count', -1)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def mark_similar_stale(sender, instance, raw=False, **kwargs):
+    """Пометка произведения для пересчета похожих произведений."""
+    if not raw:
+        Title._base_manager.filter(
+            pk=instance.title_id, similar_stale=False
+        ).update(similar_stale=True)
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_state(sender, instance, raw=False, update_fields=None,
+                          using=None, **kwargs):
+    """Состояние отзыва до сохранения для изменения гистограмм оценок."""
+    instance._histogram_state = None
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not HISTOGRAM_REVIEW_FIELDS & set(
+            update_fields):
+        return
+    instance._histogram_state = Review._base_manager.using(using).filter(
+        pk=instance.pk).values_list('title_id', 'score', 'is_deleted').first()
+
+
+@receiver(post_save, sender=Review)
+def update_histogram(sender, instance, created, raw=False, **kwargs):
+    old = getattr(instance, '_histogram_state', None)
+    if raw or (old is None and not created):
+        return
+    apply_deltas(review_deltas(old, (
+        instance.title_id, instance.score, instance.is_deleted)))
+
+
+@receiver(post_delete, sender=Review)
+def remove_from_histogram(sender, instance, **kwargs):
+    apply_deltas(review_deltas(
+        (instance.title_id, instance.score, instance.is_deleted), None))
+
+
+@receiver(post_save, sender=Title)
+def place_title(sender, instance, created, raw=False, **kwargs):
+    """Шард для отзывов нового произведения."""
+    if created and not raw and sharding.enabled():
+        sharding.assign_shard(instance)
+
+
+@receiver(pre_save, sender=Title)
+def remember_title_category(sender, instance, raw=False, **kwargs):
+    instance._histogram_category = None
+    if not raw and not instance._state.adding:
+        instance._histogram_category = Title._base_manager.filter(
+            pk=instance.pk).values_list('category_id', flat=True).first()
+
+
+@receiver(post_save, sender=Title)
+def move_category_histogram(sender, instance, created, raw=False, **kwargs):
+    """Перенос гистограммы произведения в новую категорию."""
+    old = getattr(instance, '_histogram_category', None)
+    if raw or created or old == instance.category_id:
+        return
+    move_histogram(instance.pk, Category, [old] if old else [], -1)
+    move_histogram(
+        instance.pk, Category,
+        [instance.category_id] if instance.category_id else [], 1)
+
+
+@receiver(post_save, sender=GenreTitle)
+def add_genre_histogram(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        move_histogram(instance.title_id, Genre, [instance.genre_id], 1)
+
+
+@receiver(post_delete, sender=GenreTitle)
+def remove_genre_histogram(sender, instance, **kwargs):
+    move_histogram(instance.title_id, Genre, [instance.genre_id], -1)
+
+
+@receiver(m2m_changed, sender=Title.genre.through)
+def add_genres_histogram(sender, instance, action, reverse, pk_set,
+                         **kwargs):
+    """
+    Связи из Title.genre.add() создаются bulk_create без post_save.
+    Удаление связей проходит через post_delete GenreTitle.
+    """
+    if action != 'post_add':
+        return
+    if reverse:
+        for title_id in pk_set:
+            move_histogram(title_id, Genre, [instance.pk], 1)
+    else:
+        move_histogram(instance.pk, Genre, list(pk_set), 1)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def invalidate_lookups(sender, raw=False, **kwargs):
+    """Новая версия кэша справочников во всех процессах."""
+    if not raw:
+        bump_version()
+
+
+@receiver(post_migrate)
+def reserve_shard_ids(sender, using, **kwargs):
+    if sender.name == 'reviews' and using in settings.DATABASE_SHARDS:
+        sharding.reserve_ids(using)
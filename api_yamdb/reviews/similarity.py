@@ -0,0 +1,156 @@
+import array
+import itertools
+
+from django.conf import settings
+from django.db import transaction
+
+from reviews.models import Review, SimilarTitle, Title
+from reviews.sharding import on_shards, without_hidden_titles
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # numpy и scipy - необязательные зависимости
+    np = sparse = None
+
+
+def load_ratings(chunk_size):
+    """
+    Тройки (автор, произведение, оценка) потоковым курсором. Значения
+    копятся в компактных массивах, а не в списке кортежей.
+    """
+    authors, titles = array.array('q'), array.array('q')
+    scores = array.array('b')
+    rows = itertools.chain.from_iterable(
+        queryset.values_list('author_id', 'title_id', 'score').iterator(
+            chunk_size=chunk_size)
+        for queryset in on_shards(
+            Review.objects.filter(without_hidden_titles()).order_by())
+    )
+    for author_id, title_id, score in rows:
+        authors.append(author_id)
+        titles.append(title_id)
+        scores.append(score)
+    return (
+        np.frombuffer(authors, dtype=np.int64),
+        np.frombuffer(titles, dtype=np.int64),
+        np.frombuffer(scores, dtype=np.int8),
+    )
+
+
+def build_matrix(authors, titles, scores):
+    """
+    Разреженная матрица пользователь x произведение с оценками за вычетом
+    средней оценки произведения; столбцы нормированы, поэтому сходство
+    двух произведений - скалярное произведение их столбцов.
+    """
+    title_ids, columns = np.unique(titles, return_inverse=True)
+    users, rows = np.unique(authors, return_inverse=True)
+    values = scores.astype(np.float32)
+    sums = np.bincount(columns, weights=values, minlength=len(title_ids))
+    counts = np.bincount(columns, minlength=len(title_ids))
+    values -= (sums / counts)[columns].astype(np.float32)
+    matrix = sparse.csc_matrix(
+        (values, (rows, columns)), shape=(len(users), len(title_ids)))
+    matrix.eliminate_zeros()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    norms[norms == 0] = 1
+    matrix = sparse.csc_matrix(matrix @ sparse.diags(1 / norms))
+    return title_ids, matrix
+
+
+def positions_of(title_ids, ids):
+    """Номера столбцов произведений, которые есть в матрице."""
+    ids = np.asarray(ids, dtype=np.int64)
+    positions = np.searchsorted(title_ids, ids)
+    found = positions < len(title_ids)
+    found[found] = title_ids[positions[found]] == ids[found]
+    return positions[found]
+
+
+def affected_columns(title_ids, matrix, by_user, stale_ids):
+    """
+    Столбцы, чьи соседи могли измениться: устаревшие произведения, все
+    произведения с общими с ними авторами и те, у кого они в соседях.
+    """
+    stale = positions_of(title_ids, stale_ids)
+    users = np.unique(matrix[:, stale].indices)
+    columns = np.union1d(np.unique(by_user[users].indices), stale)
+    stored = SimilarTitle.objects.filter(
+        similar_id__in=stale_ids.tolist()
+    ).values_list('title_id', flat=True).distinct()
+    return np.union1d(columns, positions_of(title_ids, list(stored)))
+
+
+def top_neighbours(matrix, by_user, columns, top):
+    """Top-K положительно похожих произведений для блока столбцов."""
+    block = sparse.csr_matrix(matrix[:, columns].T @ by_user)
+    for row, column in enumerate(columns):
+        start, end = block.indptr[row], block.indptr[row + 1]
+        indices = block.indices[start:end]
+        data = block.data[start:end]
+        mask = (indices != column) & (data > 0)
+        indices, data = indices[mask], data[mask]
+        if len(data) > top:
+            best = np.argpartition(-data, top)[:top]
+            indices, data = indices[best], data[best]
+        yield column, indices, data
+
+
+def save_neighbours(title_ids, neighbours):
+    """Замена соседей блока произведений одной транзакцией."""
+    neighbours = list(neighbours)
+    with transaction.atomic():
+        SimilarTitle.objects.filter(title_id__in=[
+            int(title_ids[column]) for column, _, _ in neighbours
+        ]).delete()
+        SimilarTitle.objects.bulk_create(
+            SimilarTitle(
+                title_id=int(title_ids[column]),
+                similar_id=int(title_ids[index]),
+                score=float(score),
+            )
+            for column, indices, data in neighbours
+            for index, score in zip(indices, data)
+        )
+
+
+def compute(full=False, progress=None):
+    """
+    Расчет похожих произведений. Без full пересчитываются только
+    произведения, затронутые изменившимися отзывами.
+    Возвращает число пересчитанных произведений.
+    """
+    stale_titles = Title._base_manager.all()
+    if not full:
+        stale_titles = stale_titles.filter(similar_stale=True)
+    stale_ids = np.array(
+        sorted(stale_titles.values_list('pk', flat=True)), dtype=np.int64)
+    if not len(stale_ids):
+        return 0
+    # флаг снимается до чтения отзывов: изменения во время расчета
+    # снова пометят произведение
+    Title._base_manager.filter(pk__in=stale_ids.tolist()).update(
+        similar_stale=False)
+    try:
+        title_ids, matrix = build_matrix(
+            *load_ratings(settings.SIMILAR_TITLES_CHUNK_SIZE))
+        by_user = sparse.csr_matrix(matrix)
+        if full:
+            columns = np.arange(len(title_ids))
+        else:
+            columns = affected_columns(title_ids, matrix, by_user, stale_ids)
+        orphans = set(stale_ids.tolist()) - set(title_ids.tolist())
+        SimilarTitle.objects.filter(title_id__in=orphans).delete()
+        size = settings.SIMILAR_TITLES_BLOCK_SIZE
+        for start in range(0, len(columns), size):
+            save_neighbours(title_ids, top_neighbours(
+                matrix, by_user, columns[start:start + size],
+                settings.SIMILAR_TITLES_TOP))
+            if progress is not None:
+                progress(min(start + size, len(columns)), len(columns))
+    except Exception:
+        Title._base_manager.filter(pk__in=stale_ids.tolist()).update(
+            similar_stale=True)
+        raise
+    return len(columns)
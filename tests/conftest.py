@@ -1,9 +1,74 @@
 import sys
 from os.path import abspath, dirname, join
 
+import pytest
+
 root_dir = dirname(dirname(abspath(__file__)))
 sys.path.append(root_dir)
 infra_dir_path = join(root_dir, 'infra')
 
 pytest_plugins = [
 ]
+
+# Базы тестов поведения: основная и шард отзывов и комментариев
+TEST_DATABASES = ['default', 'shard1']
+SHARD = 'shard1'
+
+
+@pytest.fixture(scope='session')
+def django_db_modify_db_settings():
+    """
+    Тесты поведения идут на SQLite в памяти. Базы подменяются в
+    django.conf.settings, модуль настроек проекта с PostgreSQL
+    (его проверяет test_settings) остается прежним.
+    """
+    from asgiref.local import Local
+    from django.conf import settings
+    from django.db import connections
+
+    settings.DATABASES = {
+        alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+        for alias in TEST_DATABASES
+    }
+    # в шарде, как в рабочей установке, только отзывы и комментарии
+    settings.DATABASE_SHARDS = TEST_DATABASES
+    connections.settings = connections.configure_settings(settings.DATABASES)
+    connections._connections = Local(connections.thread_critical)
+
+
+@pytest.fixture(scope='session')
+def django_db_setup(django_db_setup):
+    """Шарды включают только тесты с фикстурой shards."""
+    from django.conf import settings
+
+    settings.DATABASE_SHARDS = []
+
+
+@pytest.fixture
+def shards(transactional_db):
+    """
+    Отзывы и комментарии новых произведений распределяются по основной
+    базе и SHARD. Тест идет с настоящими commit: карта шардов процесса
+    обновляется в on_commit. Шарды остаются включенными до очистки баз
+    после теста: иначе очистка создала бы в шарде таблицы прав доступа.
+    """
+    from django.conf import settings
+
+    settings.DATABASE_SHARDS = TEST_DATABASES
+    return TEST_DATABASES
+
+
+@pytest.fixture(autouse=True)
+def reset_process_state():
+    """Кэши и шарды процесса не переносятся из одного теста в другой."""
+    from django.conf import settings
+    from django.core.cache import cache
+
+    from api.throttling import get_bucket_store
+    from reviews.lookups import get_lookup_cache
+    from reviews.sharding import get_shard_map
+
+    settings.DATABASE_SHARDS = []
+    cache.clear()
+    for factory in (get_bucket_store, get_lookup_cache, get_shard_map):
+        factory.cache_clear()
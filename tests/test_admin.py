@@ -0,0 +1,64 @@
+import pytest
+from django.contrib.admin.sites import site
+from django.test import RequestFactory
+
+from reviews.models import Review, Title, YaMdbUser
+
+
+@pytest.mark.django_db
+class TestBackgroundDeleteConfirmation:
+
+    @pytest.fixture
+    def users(self):
+        title = Title.objects.create(name='Произведение', year=2000)
+        users = []
+        for number in range(3):
+            user = YaMdbUser.objects.create(
+                username=f'user{number}', email=f'user{number}@a.ru')
+            Review.objects.create(
+                title=title, author=user, text='Отзыв', score=5)
+            users.append(user)
+        return users
+
+    def deleted_objects(self, user, queryset):
+        request = RequestFactory().post('/admin/reviews/yamdbuser/')
+        request.user = user
+        return site._registry[YaMdbUser].get_deleted_objects(
+            queryset, request)
+
+    def test_preview_without_collector(
+            self, users, settings, admin_user, django_assert_num_queries):
+        settings.ADMIN_DELETE_PREVIEW = 2
+        queryset = YaMdbUser.objects.filter(
+            username__startswith='user').order_by('pk')
+
+        with django_assert_num_queries(2):
+            deleted, counts, perms_needed, protected = self.deleted_objects(
+                admin_user, queryset)
+
+        assert deleted == [str(users[0]), str(users[1]), 'и еще 1'], (
+            'Проверьте, что подтверждение перечисляет не больше '
+            'ADMIN_DELETE_PREVIEW объектов без зависимых записей'
+        )
+        assert counts == {YaMdbUser._meta.verbose_name_plural: 3}
+        assert perms_needed == set()
+        assert protected == []
+
+    def test_permission_needed(self, users):
+        staff = YaMdbUser.objects.create(
+            username='staff', email='staff@a.ru', is_staff=True)
+
+        perms_needed = self.deleted_objects(staff, users)[2]
+
+        assert perms_needed == {YaMdbUser._meta.verbose_name}
+
+    def test_confirmation_page(
+            self, users, admin_client, django_assert_max_num_queries):
+        with django_assert_max_num_queries(10):
+            response = admin_client.post('/admin/reviews/yamdbuser/', {
+                'action': 'delete_selected',
+                '_selected_action': [user.pk for user in users],
+            })
+
+        assert response.status_code == 200
+        assert YaMdbUser._meta.verbose_name_plural in response.content.decode()
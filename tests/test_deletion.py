@@ -0,0 +1,54 @@
+from unittest import mock
+
+import pytest
+from django.db import DatabaseError
+
+from reviews.deletion import schedule_bulk_deletion, schedule_deletion
+from reviews.models import DeletionTask, Review, Title, YaMdbUser
+
+
+@pytest.mark.django_db
+class TestScheduleDeletion:
+
+    @pytest.fixture
+    def review(self):
+        title = Title.objects.create(name='Произведение', year=2000)
+        author = YaMdbUser.objects.create(username='author', email='a@a.ru')
+        return Review.objects.create(
+            title=title, author=author, text='Отзыв', score=7)
+
+    def test_failed_task_keeps_object_visible(self, review):
+        user = review.author
+        with mock.patch.object(
+                DeletionTask.objects, 'create', side_effect=DatabaseError):
+            with pytest.raises(DatabaseError):
+                schedule_deletion(user)
+
+        user = YaMdbUser.objects.get(pk=user.pk)
+        assert not user.is_deleted and user.is_active, (
+            'Проверьте, что объект не остается скрытым без задачи очистки'
+        )
+
+    def test_failed_bulk_tasks_roll_back(self, review):
+        with mock.patch.object(
+                DeletionTask.objects, 'bulk_create',
+                side_effect=DatabaseError):
+            with pytest.raises(DatabaseError):
+                schedule_bulk_deletion(Review.objects.all())
+
+        assert not Review._base_manager.get(pk=review.pk).is_deleted, (
+            'Проверьте, что скрытие набора откатывается без задач очистки'
+        )
+        assert Title.objects.get(pk=review.title_id).score_7 == 1, (
+            'Проверьте, что гистограмма оценок откатывается вместе со '
+            'скрытием'
+        )
+        assert not DeletionTask.objects.exists()
+
+    def test_schedule(self, review):
+        schedule_bulk_deletion(Review.objects.all())
+
+        assert Review._base_manager.get(pk=review.pk).is_deleted
+        assert Title.objects.get(pk=review.title_id).score_7 == 0
+        assert DeletionTask.objects.filter(
+            model='review', object_id=review.pk).exists()
@@ -0,0 +1,93 @@
+import json
+import os
+import uuid
+
+import pytest
+from django.utils import timezone
+
+from api.ingestion import (
+    REJECTED_NAME, SEGMENT_PREFIX, SEGMENT_SUFFIX, CommentIngestion
+)
+from reviews.models import Comment, Review, Title, YaMdbUser
+
+
+def make_entry(author, review_id, title_id):
+    return {
+        'ingest_id': str(uuid.uuid4()),
+        'author_id': author.pk,
+        'author': author.username,
+        'review': review_id,
+        'title_id': title_id,
+        'text': 'Комментарий из очереди',
+        'pub_date': timezone.now().isoformat(),
+    }
+
+
+@pytest.mark.django_db(transaction=True)
+class TestCommentIngestion:
+
+    @pytest.fixture
+    def journal(self, settings, tmp_path):
+        settings.COMMENT_INGESTION_JOURNAL_DIR = str(tmp_path)
+        return tmp_path
+
+    @pytest.fixture
+    def entries(self):
+        """Комментарий к живому отзыву и к отзыву, удаленному в очереди."""
+        author = YaMdbUser.objects.create(username='author', email='a@a.ru')
+        title = Title.objects.create(name='Произведение', year=2000)
+        review = Review.objects.create(
+            title=title, author=author, text='Отзыв', score=8)
+        deleted = Review.objects.create(
+            title=title, author=YaMdbUser.objects.create(
+                username='other', email='o@a.ru'),
+            text='Отзыв', score=3)
+        deleted_id = deleted.pk
+        deleted.delete()
+        return [
+            make_entry(author, review.pk, title.pk),
+            make_entry(author, deleted_id, title.pk),
+        ]
+
+    def rejected(self, journal):
+        with open(journal / REJECTED_NAME) as rejected:
+            return [json.loads(line)['ingest_id'] for line in rejected]
+
+    def test_flush_sets_aside_deleted_review(self, journal, entries):
+        ingestion = CommentIngestion()
+        ingestion.segment = ingestion.open_segment()
+        ingestion.pending = list(entries)
+
+        assert ingestion.flush() == 1, (
+            'Проверьте, что комментарий к удаленному отзыву не останавливает '
+            'запись остальных'
+        )
+        comment = Comment.objects.get()
+        assert str(comment.ingest_id) == entries[0]['ingest_id']
+        assert comment.review.comments_count == 1
+        assert comment.author.comments_count == 1
+        assert self.rejected(journal) == [entries[1]['ingest_id']], (
+            'Проверьте, что комментарий к удаленному отзыву откладывается '
+            f'в {REJECTED_NAME}'
+        )
+
+    def test_replay_orphan_segment(self, journal, entries):
+        path = journal / f'{SEGMENT_PREFIX}1-1{SEGMENT_SUFFIX}'
+        with open(path, 'w') as segment:
+            for entry in entries:
+                segment.write(json.dumps(entry) + '\n')
+            # запись, оборванная при падении процесса
+            segment.write('{"ingest_id": ')
+
+        assert CommentIngestion().replay_orphans() == 1
+        assert not os.path.exists(path), (
+            'Проверьте, что проигранный сегмент журнала удаляется'
+        )
+        assert self.rejected(journal) == [entries[1]['ingest_id']]
+
+        with open(path, 'w') as segment:
+            segment.write(json.dumps(entries[0]) + '\n')
+        assert CommentIngestion().replay_orphans() == 0, (
+            'Проверьте, что повторное проигрывание журнала не создает дублей'
+        )
+        assert Comment.objects.count() == 1
@@ -0,0 +1,50 @@
+import pytest
+from rest_framework.test import APIClient
+
+from reviews.lookups import LookupCache, get_lookup_cache
+from reviews.models import Genre, YaMdbUser
+
+GENRES_URL = '/api/v1/genres/'
+
+
+@pytest.mark.django_db
+class TestLookupCacheCoherence:
+    """Кэш справочников процесса-писателя и другого воркера."""
+
+    @pytest.fixture
+    def admin(self):
+        client = APIClient()
+        client.force_authenticate(YaMdbUser.objects.create(
+            username='admin', email='admin@a.ru', role='admin'))
+        return client
+
+    def slugs(self, worker):
+        return set(worker.get().genres.by_slug)
+
+    def test_other_worker_rereads_after_interval(
+            self, admin, settings, django_capture_on_commit_callbacks):
+        settings.LOOKUP_CACHE_CHECK_INTERVAL = 60
+        Genre.objects.create(name='Драма', slug='drama')
+        writer, other = get_lookup_cache(), LookupCache()
+        assert self.slugs(writer) == self.slugs(other) == {'drama'}
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = admin.post(
+                GENRES_URL, {'name': 'Комедия', 'slug': 'comedy'})
+        assert response.status_code == 201
+
+        assert self.slugs(writer) == {'drama', 'comedy'}, (
+            'Проверьте, что процесс, изменивший справочник, видит '
+            'изменение сразу после commit'
+        )
+        assert self.slugs(other) == {'drama'}
+        settings.LOOKUP_CACHE_CHECK_INTERVAL = 0
+        assert self.slugs(other) == {'drama', 'comedy'}, (
+            'Проверьте, что другие процессы перечитывают справочник '
+            'по новой версии'
+        )
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = admin.delete(f'{GENRES_URL}drama/')
+        assert response.status_code == 204
+        assert self.slugs(writer) == self.slugs(other) == {'comedy'}
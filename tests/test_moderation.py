@@ -0,0 +1,80 @@
+import pytest
+from rest_framework.test import APIClient
+
+from reviews.models import Comment, Review, Title, YaMdbUser
+
+TITLES_URL = '/api/v1/titles/'
+
+
+@pytest.mark.django_db
+class TestModeration:
+
+    @pytest.fixture
+    def title(self):
+        title = Title.objects.create(name='Произведение', year=2000)
+        reader = YaMdbUser.objects.create(username='reader', email='r@a.ru')
+        review = Review.objects.create(
+            title=title, author=reader, text='Хорошая книга', score=10)
+        spammer = YaMdbUser.objects.create(
+            username='spammer', email='s@a.ru')
+        Review.objects.create(
+            title=title, author=spammer, text='Купите слоников', score=1)
+        Comment.objects.create(
+            review=review, author=spammer, text='Купите слоников недорого')
+        return title
+
+    @pytest.fixture
+    def moderator(self):
+        client = APIClient()
+        client.force_authenticate(YaMdbUser.objects.create(
+            username='moderator', email='m@a.ru', role='moderator'))
+        return client
+
+    def rating(self, client, title):
+        response = client.get(TITLES_URL, HTTP_ACCEPT='application/json')
+        assert response.status_code == 200
+        return {
+            item['id']: item['rating'] for item in response.json()['results']
+        }[title.pk]
+
+    def test_delete_updates_counters_and_catalog(
+            self, title, moderator, django_capture_on_commit_callbacks):
+        anonymous = APIClient()
+        assert self.rating(anonymous, title) == 5.5
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = moderator.post(
+                '/api/v1/moderation/reviews/',
+                {'action': 'delete', 'text': 'слоников'}, format='json')
+            response_comments = moderator.post(
+                '/api/v1/moderation/comments/',
+                {'action': 'delete', 'text': 'слоников'}, format='json')
+
+        assert response.status_code == 200
+        assert response.json()['reviews'] == 1
+        assert response_comments.json()['comments'] == 1
+        assert self.rating(anonymous, title) == 10, (
+            'Проверьте, что массовая модерация сбрасывает кэш каталога'
+        )
+        spammer = YaMdbUser.objects.get(username='spammer')
+        assert (spammer.reviews_count, spammer.comments_count) == (0, 0), (
+            'Проверьте, что массовое удаление уменьшает счетчики автора'
+        )
+        review = Review.objects.get()
+        assert review.comments_count == 0
+        assert review.text == 'Хорошая книга'
+
+    def test_catalog_cache_keyed_by_accept(self, title):
+        client = APIClient()
+        html = client.get(TITLES_URL, HTTP_ACCEPT='text/html')
+        assert html['Content-Type'].startswith('text/html')
+
+        response = client.get(TITLES_URL, HTTP_ACCEPT='application/json')
+        assert response['Content-Type'].startswith('application/json'), (
+            'Проверьте, что ответы каталога с разным Accept кэшируются '
+            'раздельно'
+        )
+        html = client.get(TITLES_URL, HTTP_ACCEPT='text/html')
+        assert html['Content-Type'].startswith('text/html'), (
+            'Проверьте, что страница Browsable API не отдается из кэша JSON'
+        )
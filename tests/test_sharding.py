@@ -0,0 +1,64 @@
+import pytest
+
+from reviews import sharding
+from reviews.deletion import delete_rows
+from reviews.models import Comment, Review, Title, TitleShard, YaMdbUser
+
+
+@pytest.mark.django_db(transaction=True, databases='__all__')
+class TestMoveTitle:
+
+    def create_title(self):
+        title = Title.objects.create(name='Произведение', year=2000)
+        sharding.set_placement(title.pk, 'default', False)
+        reviews = []
+        for score in (5, 7, 9):
+            author = YaMdbUser.objects.create(
+                username=f'author{score}', email=f'author{score}@a.ru')
+            reviews.append(Review.objects.create(
+                title=title, author=author, text='Отзыв', score=score))
+        Comment.objects.create(
+            review=reviews[0], author=author, text='Комментарий')
+        return title, reviews
+
+    def test_move_title(self, shards):
+        title, reviews = self.create_title()
+        moving = []
+
+        def wait():
+            moving.append(sharding.is_moving(title.pk))
+
+        copied = sharding.move_title(title.pk, 'shard1', 1, wait)
+
+        assert copied == 4, 'Проверьте, что переносятся отзывы и комментарии'
+        assert moving == [True, False], (
+            'Проверьте, что запись о шарде помечается переносом до '
+            'копирования и снимается после переключения'
+        )
+        assert TitleShard.objects.get(title_id=title.pk).alias == 'shard1'
+        assert not Review._base_manager.using('default').exists(), (
+            'Проверьте, что строки удаляются из исходного шарда'
+        )
+        assert set(Review._base_manager.using('shard1').values_list(
+            'pk', flat=True)) == {review.pk for review in reviews}
+        assert Comment.objects.using('shard1').count() == 1
+
+    def test_deleted_after_switch_not_restored(self, shards):
+        title, reviews = self.create_title()
+        waits = []
+
+        def wait():
+            waits.append(None)
+            if len(waits) == 2:
+                # отзыв удален в новом шарде до очистки исходного
+                delete_rows(Review._base_manager.using('shard1').filter(
+                    pk=reviews[-1].pk))
+
+        sharding.move_title(title.pk, 'shard1', 1, wait)
+
+        assert not Review._base_manager.using('shard1').filter(
+            pk=reviews[-1].pk).exists(), (
+            'Проверьте, что после переключения шарда строки не копируются '
+            'повторно и удаленный отзыв не возвращается'
+        )
+        assert Review._base_manager.using('shard1').count() == 2
@@ -0,0 +1,113 @@
+import time
+from unittest import mock
+
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from rest_framework.test import APIClient
+
+from api.middleware import LoadSheddingMiddleware
+from api.replicas import get_pin_key
+from api.throttling import MemoryBucketStore, TokenBucketThrottle
+
+
+class TestMemoryBucketStore:
+
+    def test_bucket_refills(self):
+        store = MemoryBucketStore()
+        assert store.consume('ip', 2, 1.0, 0.0) == 0
+        assert store.consume('ip', 2, 1.0, 0.0) == 0
+        assert store.consume('ip', 2, 1.0, 0.0) == 1.0, (
+            'Проверьте, что пустая корзина возвращает время ожидания'
+        )
+        assert store.consume('ip', 2, 1.0, 1.0) == 0
+
+    def test_least_recently_updated_evicted(self, settings):
+        settings.THROTTLE_MEMORY_MAX_KEYS = 2
+        store = MemoryBucketStore()
+        for key in ('first', 'second', 'first'):
+            store.consume(key, 2, 1.0, 0.0)
+        store.consume('third', 2, 1.0, 0.0)
+
+        assert list(store.buckets) == ['first', 'third'], (
+            'Проверьте, что при переполнении вытесняется корзина, дольше '
+            'всех не обновлявшаяся'
+        )
+        assert store.consume('first', 2, 1.0, 0.0) > 0
+
+
+class TestLoadShedding:
+
+    def test_concurrency_limit(self, rf, settings):
+        settings.LOAD_SHEDDING_MAX_CONCURRENCY = 1
+        # второй запрос приходит, пока выполняется первый
+        shedder = LoadSheddingMiddleware(
+            lambda request: shedder.run(HttpResponse))
+
+        response = shedder(rf.get('/api/v1/titles/'))
+
+        assert response.status_code == 503, (
+            'Проверьте, что запрос сверх лимита одновременных отклоняется'
+        )
+        assert shedder.in_flight == 0
+
+
+@pytest.mark.django_db
+class TestLimits:
+
+    def test_anonymous_bucket(self, settings):
+        settings.CATALOG_CACHE_TIMEOUT = 0
+        client = APIClient()
+        with mock.patch.object(TokenBucketThrottle, 'timer', lambda self: 0):
+            statuses = [
+                client.get('/api/v1/genres/').status_code for _ in range(21)]
+
+        assert statuses[:20] == [200] * 20
+        assert statuses[20] == 429, (
+            'Проверьте, что для анонимных запросов действует корзина anon'
+        )
+
+    def test_forwarded_addresses_separate_buckets(self, settings):
+        settings.CATALOG_CACHE_TIMEOUT = 0
+        client = APIClient()
+
+        def get(address):
+            return client.get(
+                '/api/v1/genres/', HTTP_X_FORWARDED_FOR=address).status_code
+
+        with mock.patch.object(TokenBucketThrottle, 'timer', lambda self: 0):
+            statuses = [get('192.0.2.1') for _ in range(21)]
+            other = get('192.0.2.2')
+
+        assert statuses[20] == 429
+        assert other == 200, (
+            'Проверьте, что анонимные клиенты за nginx различаются по '
+            'X-Forwarded-For, а не делят одну корзину'
+        )
+
+    def test_long_queue_shed(self, settings):
+        settings.LOAD_SHEDDING_MAX_QUEUE_TIME = 1.0
+        response = APIClient().get(
+            '/api/v1/titles/',
+            HTTP_X_REQUEST_START='t={:.3f}'.format(time.time() - 5))
+
+        assert response.status_code == 503, (
+            'Проверьте, что запрос, долго ждавший в очереди, отклоняется'
+        )
+        assert response['Retry-After'] == str(
+            settings.LOAD_SHEDDING_RETRY_AFTER)
+
+
+class TestReplicaPin:
+
+    def test_anonymous_pin_by_forwarded_address(self, rf):
+        keys = set()
+        for address in ('192.0.2.1', '192.0.2.2'):
+            request = rf.get('/', HTTP_X_FORWARDED_FOR=address)
+            request.user = AnonymousUser()
+            keys.add(get_pin_key(request))
+
+        assert len(keys) == 2, (
+            'Проверьте, что привязка анонимов к основной базе - по адресу '
+            'клиента, а не nginx'
+        )